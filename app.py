@@ -1,14 +1,35 @@
+import flask
 from dash import Dash,html,page_container
 import dash_bootstrap_components as dbc
 
+from opticalsimulation import metrics
+import opticalsimulation.database as db
+
 app = Dash(__name__,use_pages=True,external_stylesheets=[dbc.themes.SPACELAB])
 app.layout = dbc.Container([
     dbc.NavbarSimple([
+        dbc.NavItem(dbc.NavLink("Design",href="design")),
+        dbc.NavItem(dbc.NavLink("Fit",href="fit")),
+        dbc.NavItem(dbc.NavLink("Sweep",href="sweep")),
         dbc.NavItem(dbc.NavLink("Material",href="nk"))
-    ],
+    ]+([dbc.NavItem(dbc.NavLink("Metrics",href="metrics"))] if metrics.enabled() else []),
     brand='Optical Simulation',brand_href='/',dark=True,color='primary'),
 
     page_container
 ])
+
+# JSON dump of the metrics registry (OPTSIM_METRICS=1), ?reset=1 clears it
+@app.server.route('/debug/metrics')
+def debug_metrics():
+    snapshot = metrics.snapshot()
+    if flask.request.args.get('reset'):
+        metrics.reset()
+    return flask.jsonify(snapshot)
+
+# give the pooled connection of the request thread back after every request
+@app.server.teardown_appcontext
+def remove_session(exception=None):
+    db.Session.remove()
+
 if __name__ == '__main__':
     app.run_server(debug=True)
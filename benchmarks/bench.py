@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+import opticalsimulation.opticalsimulation as op
+import opticalsimulation.grid as grid
+from opticalsimulation.incremental import StackEvaluator
+
+# Benchmarks for the transfer-matrix core and the database layer
+#   python -m benchmarks.bench [--quick] [-o benchmark.json]
+#                              [--baseline benchmarks/baseline.json] [--threshold 0.25]
+#                              [--min-delta 0.005] [--save-baseline benchmarks/baseline.json]
+#   Every case runs on synthetic dispersion data; no network is needed. The
+#   best of `repeat` runs is reported. With --baseline the run fails (exit 1)
+#   when any case is slower than baseline*(1+threshold) and by more than
+#   min_delta seconds; the absolute slack keeps the timer noise of millisecond
+#   cases out, and THRESHOLDS loosens the start-up cases. Import times and the first request to the app
+#   are measured in fresh interpreters.
+#   benchmarks/baseline.json is a --quick run with the machine it ran on in
+#   its metadata; before a change touching the core or the database layer run
+#     python -m benchmarks.bench --quick --baseline benchmarks/baseline.json
+#   on that machine, or regenerate the baseline with --save-baseline first on
+#   another one (a mismatching machine is reported).
+
+LAYERS = (1,10,100,500)
+GRIDS = (100,1000,10000,100000)
+ANGLES = (1,90,900)
+QUICK_LAYERS = (1,10,100)
+QUICK_GRIDS = (100,10000)
+QUICK_ANGLES = (1,90)
+
+def timeit(func,repeat=3,number=1):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best,(time.perf_counter()-start)/number)
+    return best
+
+def synthetic_stack(layers,length):
+    lam = np.linspace(300,1200,length)
+    high = 2.3+0.2*(400/lam)**2-0.001j
+    low = 1.45+0.01*(400/lam)**2+0j
+    ns = [high if i%2 == 0 else low for i in range(layers)]
+    ds = np.where(np.arange(layers)%2 == 0,55.0,95.0)
+    return lam,ns,ds,np.full(length,1.52-1e-6j)
+
+def bench_core(layer_counts,grids,angle_counts,repeat):
+    results = {}
+    for layers in layer_counts:
+        for length in grids:
+            if layers*length > 10**7:
+                continue
+            lam,ns,ds,n1 = synthetic_stack(layers,length)
+            results['calc_matrix/layers={}/grid={}'.format(layers,length)] = timeit(
+                lambda:op.calc_matrix(ns,list(ds),1,n1,0.1,lam),repeat)
+            results['calc_spectra/layers={}/grid={}'.format(layers,length)] = timeit(
+                lambda:op.calc_spectra(1,n1,1,0.1,ns,list(ds),[],[],1000,lam),repeat)
+    lam,ns,ds,n1 = synthetic_stack(10,10*max(grids))
+    for dtype in (np.complex128,np.complex64):
+        results['calc_spectra_chunked/layers=10/grid={}/{}'.format(len(lam),np.dtype(dtype).name)] = timeit(
+            lambda:op.calc_spectra_chunked(1,n1,1,0.1,ns,ds,[],[],1000,lam,dtype=dtype),repeat)
+    lam,ns,ds,n1 = synthetic_stack(20,1000)
+    for angles in angle_counts:
+        theta = np.linspace(0,1.5,angles)
+        results['calc_spectra_batch/layers=20/grid=1000/angles={}'.format(angles)] = timeit(
+            lambda:op.calc_spectra_batch(1,n1,1,theta,ns,ds,[],[],1000,lam),repeat)
+        # one thickness of the middle layer edited again, as in the main page table
+        evaluator = StackEvaluator(1,theta,lam)
+        layers = [(i,n,d) for i,(n,d) in enumerate(zip(ns,ds))]
+        evaluator.update(layers)
+        def edit(step=[0]):
+            step[0] += 1
+            layers[10] = (10,ns[10],ds[10]+step[0]%2)
+            evaluator.update(layers)
+            evaluator.spectra(n1,1,1000)
+        edit()
+        results['incremental_edit/layers=20/grid=1000/angles={}'.format(angles)] = timeit(edit,repeat)
+    return results
+
+def _write_library(directory,materials,samples):
+    ws = np.linspace(200,2000,samples)
+    for i in range(materials):
+        data = np.column_stack([ws,1.4+0.05*i+0.01*(500/ws)**2,np.full(samples,1e-4*i)])
+        np.savetxt(directory/'material{:03d}.txt'.format(i),data,header='Wavelength(nm)\tn\tk',comments='',
+                   delimiter='\t')
+
+def bench_database(materials,samples,repeat):
+    from sqlalchemy import create_engine
+    import opticalsimulation.database as db
+    from opticalsimulation.settings import Base
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        library = tmp/'library'
+        library.mkdir()
+        _write_library(library,materials,samples)
+        bind = db.Session.session_factory.kw['bind']
+        try:
+            def ingest():
+                engine = create_engine('sqlite:///{}'.format(tmp/'bench.db'))
+                Base.metadata.drop_all(engine)
+                Base.metadata.create_all(engine)
+                db.Session.configure(bind=engine)
+                db.clear_cache()
+                db.import_opticalindex_directory(library)
+            results['db/ingest/materials={}/samples={}'.format(materials,samples)] = timeit(ingest,repeat)
+            ids = [id for id,_ in db.get_material_list()]
+            results['db/get_range/materials={}'.format(len(ids))] = timeit(
+                lambda:[db.get_range(id) for id in ids],repeat)/len(ids)
+            def resolve():
+                db.clear_cache()
+                db.resolve_stack(ids,grid.uniform(1))
+            results['db/resolve_stack/cold/materials={}'.format(len(ids))] = timeit(resolve,repeat)
+            results['db/get_opticalindex/samples={}'.format(samples)] = timeit(
+                lambda:db.get_opticalindex(ids[0]),repeat)
+
+            def fitted():
+                db.clear_cache()
+                db.fitted_opticalindex(ids[0],400,1000,1)
+            results['db/fitted_opticalindex/cold/samples={}'.format(samples)] = timeit(fitted,repeat)
+            db.fitted_opticalindex(ids[0],400,1000,1)
+            results['db/fitted_opticalindex/warm'] = timeit(lambda:db.fitted_opticalindex(ids[0],400,1000,1),repeat,100)
+        finally:
+            db.Session.configure(bind=bind)
+            db.clear_cache()
+    return results
+
+STARTUP_MODULES = ('opticalsimulation.opticalsimulation','opticalsimulation.sweep','opticalsimulation.database',
+                   'app')
+IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter()-start)
+'''
+# a page module alone, after the modules every page shares (dash, plotly, the database layer)
+PAGE_SCRIPT = '''
+import time
+import dash
+import plotly.graph_objects
+import opticalsimulation.database
+app = dash.Dash(__name__,use_pages=True,pages_folder='')
+start = time.perf_counter()
+import pages.{}
+print(time.perf_counter()-start)
+'''
+PAGES = ('main_page','design_page','fit_page','databse_page','sweep_page','metrics_page')
+# index page and the page content callback of '/', as a browser loads them
+REQUEST_SCRIPT = '''
+import time
+import app
+client = app.app.server.test_client()
+body = {'output':'.._pages_content.children..._pages_store.data..',
+        'outputs':[{'id':'_pages_content','property':'children'},{'id':'_pages_store','property':'data'}],
+        'inputs':[{'id':'_pages_location','property':'pathname','value':'/'},
+                  {'id':'_pages_location','property':'search','value':''}],
+        'changedPropIds':['_pages_location.pathname'],'state':[]}
+start = time.perf_counter()
+assert client.get('/').status_code == 200
+assert client.post('/_dash-update-component',json=body).status_code == 200
+print(time.perf_counter()-start)
+'''
+
+def _fresh(script,env):
+    root = pathlib.Path(__file__).resolve().parent.parent
+    output = subprocess.run([sys.executable,'-c',script],cwd=root,env=env,capture_output=True,text=True,check=True)
+    return float(output.stdout.split()[-1])
+
+def bench_startup(materials,repeat):
+    from sqlalchemy import create_engine
+    import opticalsimulation.database as db
+    from opticalsimulation.settings import Base
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        library = tmp/'library'
+        library.mkdir()
+        _write_library(library,materials,100)
+        url = 'sqlite:///{}'.format(tmp/'startup.db')
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        bind = db.Session.session_factory.kw['bind']
+        db.Session.configure(bind=engine)
+        try:
+            db.import_opticalindex_directory(library)
+        finally:
+            db.Session.configure(bind=bind)
+            db.clear_cache()
+            engine.dispose()
+        env = dict(os.environ,OPTSIM_DATABASE_URL=url)
+        for module in STARTUP_MODULES:
+            results['startup/import/{}'.format(module)] = min(
+                _fresh(IMPORT_SCRIPT.format(module),env) for _ in range(repeat))
+        for page in PAGES:
+            results['startup/page/{}'.format(page)] = min(_fresh(PAGE_SCRIPT.format(page),env) for _ in range(repeat))
+        results['startup/first_request/materials={}'.format(materials)] = min(
+            _fresh(REQUEST_SCRIPT,env) for _ in range(repeat))
+    return results
+
+def run(quick=False,repeat=3):
+    results = {}
+    results.update(bench_core(QUICK_LAYERS if quick else LAYERS,QUICK_GRIDS if quick else GRIDS,
+                              QUICK_ANGLES if quick else ANGLES,repeat))
+    results.update(bench_database(10,10000 if quick else 100000,repeat))
+    results.update(bench_startup(10 if quick else 100,repeat))
+    return results
+
+# allowed slowdown of case groups noisier than the --threshold; starting an interpreter varies by about
+# +-20% between runs on one machine, while an eager scipy import in the app still adds about 50%
+THRESHOLDS = {'startup/':0.5}
+
+def compare(results,baseline,threshold,min_delta=0.0):
+    regressions = {}
+    for name,seconds in results.items():
+        reference = baseline.get(name)
+        allowed = max([threshold]+[x for prefix,x in THRESHOLDS.items() if name.startswith(prefix)])
+        if reference and seconds > reference*(1+allowed) and seconds-reference > min_delta:
+            regressions[name] = (reference,seconds)
+    return regressions
+
+def metadata():
+    return {'python':platform.python_version(),'numpy':np.__version__,'machine':platform.machine(),
+            'platform':platform.platform(),'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the transfer-matrix core and database layer')
+    parser.add_argument('-o','--output',default='benchmark.json')
+    parser.add_argument('--quick',action='store_true',help='smaller grid of cases')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--baseline',help='JSON file written by --save-baseline')
+    parser.add_argument('--threshold',type=float,default=0.25,help='allowed slowdown against the baseline')
+    parser.add_argument('--min-delta',type=float,default=0.005,metavar='SECONDS',
+                        help='slowdowns smaller than this are not regressions')
+    parser.add_argument('--save-baseline',metavar='PATH')
+    args = parser.parse_args(argv)
+
+    results = run(args.quick,args.repeat)
+    document = {'metadata':metadata(),'results':results}
+    for name,seconds in results.items():
+        print('{:<60s} {:>12.6f} s'.format(name,seconds))
+    pathlib.Path(args.output).write_text(json.dumps(document,indent=2))
+    if args.save_baseline:
+        pathlib.Path(args.save_baseline).write_text(json.dumps(document,indent=2))
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())
+        machine = {key:document['metadata'][key] for key in ('python','numpy','machine','platform')}
+        if any(baseline['metadata'].get(key) != value for key,value in machine.items()):
+            print('note: the baseline was measured on {}'.format(
+                {key:baseline['metadata'].get(key) for key in machine}))
+        regressions = compare(results,baseline['results'],args.threshold,args.min_delta)
+        for name,(reference,seconds) in regressions.items():
+            print('REGRESSION {}: {:.6f} s -> {:.6f} s ({:+.0%})'.format(name,reference,seconds,seconds/reference-1))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
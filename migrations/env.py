@@ -5,8 +5,8 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from opticalsimulation.settings import Base
-from opticalsimulation.models import Material, OpticalIndex
+from opticalsimulation.settings import Base, path
+from opticalsimulation.models import Material, Dispersion
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -17,6 +17,9 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# migrate the database the application uses (OPTSIM_DATABASE_URL or test.db)
+config.set_main_option("sqlalchemy.url", path.replace("%", "%%"))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -0,0 +1,95 @@
+"""pack dispersion curves into one row per material
+
+Revision ID: 5d3c0e9a41b7
+Revises: 172a6ee7b2a6
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d3c0e9a41b7'
+down_revision = '172a6ee7b2a6'
+branch_labels = None
+depends_on = None
+
+opticalindex = sa.table('opticalindex',
+    sa.column('id', sa.Integer),
+    sa.column('material_id', sa.Integer),
+    sa.column('wavelength', sa.Float),
+    sa.column('n', sa.Float),
+    sa.column('k', sa.Float),
+)
+
+dispersion = sa.table('dispersion',
+    sa.column('material_id', sa.Integer),
+    sa.column('wl_min', sa.Float),
+    sa.column('wl_max', sa.Float),
+    sa.column('count', sa.Integer),
+    sa.column('wavelength', sa.LargeBinary),
+    sa.column('n', sa.LargeBinary),
+    sa.column('k', sa.LargeBinary),
+)
+
+
+def pack(values):
+    return np.ascontiguousarray(values, dtype='<f8').tobytes()
+
+
+def unpack(blob):
+    return np.frombuffer(blob, dtype='<f8')
+
+
+def upgrade() -> None:
+    op.create_table('dispersion',
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('wl_min', sa.Float(), nullable=True),
+    sa.Column('wl_max', sa.Float(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.Column('wavelength', sa.LargeBinary(), nullable=True),
+    sa.Column('n', sa.LargeBinary(), nullable=True),
+    sa.Column('k', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['material_id'], ['material.id'], ),
+    sa.PrimaryKeyConstraint('material_id')
+    )
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(opticalindex.c.material_id, opticalindex.c.wavelength, opticalindex.c.n, opticalindex.c.k)
+        .order_by(opticalindex.c.material_id, opticalindex.c.wavelength)
+    ).all()
+    if rows:
+        data = np.array([tuple(row) for row in rows], dtype=float)
+        ids, starts = np.unique(data[:, 0], return_index=True)
+        records = []
+        for id, part in zip(ids, np.split(data[:, 1:], starts[1:])):
+            records.append({'material_id': int(id), 'wl_min': part[0, 0], 'wl_max': part[-1, 0],
+                            'count': len(part), 'wavelength': pack(part[:, 0]),
+                            'n': pack(part[:, 1]), 'k': pack(part[:, 2])})
+        op.bulk_insert(dispersion, records)
+
+    op.drop_table('opticalindex')
+
+
+def downgrade() -> None:
+    op.create_table('opticalindex',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=True),
+    sa.Column('wavelength', sa.Float(), nullable=True),
+    sa.Column('n', sa.Float(), nullable=True),
+    sa.Column('k', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    connection = op.get_bind()
+    records = []
+    for row in connection.execute(sa.select(dispersion)).all():
+        for w, n, k in zip(unpack(row.wavelength), unpack(row.n), unpack(row.k)):
+            records.append({'material_id': row.material_id, 'wavelength': float(w), 'n': float(n), 'k': float(k)})
+    if records:
+        op.bulk_insert(opticalindex, records)
+
+    op.drop_table('dispersion')
@@ -0,0 +1,30 @@
+"""analytic dispersion models as material kinds
+
+Revision ID: 8b21f6d0c3e4
+Revises: 5d3c0e9a41b7
+Create Date: 2026-10-18 12:02:47.180533
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b21f6d0c3e4'
+down_revision = '5d3c0e9a41b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('material') as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(), nullable=False, server_default='table'))
+        batch_op.add_column(sa.Column('params', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    # model materials have no tabulated data to fall back on
+    op.execute("DELETE FROM material WHERE kind != 'table'")
+    with op.batch_alter_table('material') as batch_op:
+        batch_op.drop_column('params')
+        batch_op.drop_column('kind')
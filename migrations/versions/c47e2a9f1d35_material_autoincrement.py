@@ -0,0 +1,29 @@
+"""never reuse material ids
+
+Revision ID: c47e2a9f1d35
+Revises: 8b21f6d0c3e4
+Create Date: 2026-10-18 15:41:09.512204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a9f1d35'
+down_revision = '8b21f6d0c3e4'
+branch_labels = None
+depends_on = None
+
+
+# other backends do not reuse sequence values, only SQLite needs AUTOINCREMENT
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('material',recreate='always',table_kwargs={'sqlite_autoincrement':True}):
+            pass
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('material',recreate='always',table_kwargs={'sqlite_autoincrement':False}):
+            pass
@@ -0,0 +1,123 @@
+import numpy as np
+
+from opticalsimulation import metrics
+from opticalsimulation.opticalsimulation import calc_spectra_batch
+
+# Averaging spectra over a distribution of incidence angles
+#   The average of R and T over a weight w(theta) on [a, b] is integrated with
+#   adaptive Gauss-Legendre quadrature: every interval is compared with the
+#   sum of its two halves, and all halves of one refinement round are
+#   evaluated in a single batched calc_spectra_batch call. Intervals are
+#   accepted when the change of the weighted average (max over wavelength,
+#   polarization and batch) is below tol times their share of the range.
+#   A cone of half angle alpha around an axis tilted by theta0 with uniform
+#   radiance reduces to the weight 2 phi(theta) sin(theta) cos(theta), where
+#   2 phi(theta) is the azimuth range inside the cone at incidence theta, and
+#   cos(theta) projects the flux onto the film. phi(theta) has square root
+#   edges at the kinks of the weight, so each segment between kinks is
+#   integrated in s with theta = p + (q-p)(1-cos(pi s))/2, which makes the
+#   integrand smooth there. s and p refer to the plane of incidence of each
+#   ray, so for a cone only their mean is polarization independent. Angles
+#   are in radians.
+
+ORDER = 4
+
+class Distribution:
+    '''Weight function of the incidence angle on [a, b]. breakpoints split
+    [a, b] into segments at kinks of the weight; with cluster=True the nodes
+    of every segment crowd toward its ends.'''
+    def __init__(self,weight,a,b,breakpoints=(),cluster=False):
+        if not 0 <= a < b < np.pi/2:
+            raise ValueError('angles must satisfy 0 <= a < b < pi/2')
+        self.weight = weight
+        self.edges = np.array([a]+sorted(x for x in breakpoints if a < x < b)+[b])
+        self.cluster = cluster
+
+    def segments(self):
+        return len(self.edges)-1
+
+    def angle(self,s):
+        '''Angle and d(angle)/ds at s in [0, segments): segment index plus the position inside it.'''
+        j = np.clip(np.floor(s).astype(int),0,self.segments()-1)
+        f = s-j
+        if self.cluster:
+            f,df = (1-np.cos(np.pi*f))/2,np.pi*np.sin(np.pi*f)/2
+        else:
+            df = 1.0
+        p,q = self.edges[j],self.edges[j+1]
+        return p+(q-p)*f,(q-p)*df
+
+def uniform(a,b):
+    return Distribution(lambda theta:np.ones_like(theta),a,b)
+
+def cone(half_angle,axis=0.0):
+    '''Cone of uniform radiance with the given half angle around an axis at incidence `axis`.'''
+    if half_angle <= 0:
+        raise ValueError('half_angle must be positive')
+    def weight(theta):
+        if axis == 0:
+            phi = np.where(theta <= half_angle,np.pi,0.0)
+        else:
+            with np.errstate(divide='ignore',invalid='ignore'):
+                c = (np.cos(half_angle)-np.cos(theta)*np.cos(axis))/(np.sin(theta)*np.sin(axis))
+            phi = np.arccos(np.clip(np.nan_to_num(c,nan=1.0,posinf=1.0,neginf=-1.0),-1,1))
+        return 2*phi*np.sin(theta)*np.cos(theta)
+    return Distribution(weight,max(0.0,axis-half_angle),axis+half_angle,[abs(half_angle-axis)],cluster=axis != 0)
+
+def _rule(intervals,distribution,order):
+    x,w = np.polynomial.legendre.leggauss(order)
+    a,b = intervals[:,:1],intervals[:,1:]
+    theta,jacobian = distribution.angle((a+b)/2+(b-a)/2*x)
+    return theta,(b-a)/2*w*distribution.weight(theta)*jacobian
+
+def _integrals(evaluate,intervals,distribution,order):
+    # (weight integral (k,), [integral of every output (k, batch, 2, L)]) per interval
+    theta,w = _rule(intervals,distribution,order)
+    spectra = evaluate(theta.ravel())
+    k = len(intervals)
+    return w.sum(axis=1),[np.einsum('kn,bknpl->kbpl',w,x.reshape((x.shape[0],k,order)+x.shape[2:]))
+                          for x in spectra]
+
+def average(evaluate,distribution,tol=1e-4,order=ORDER,max_rounds=12):
+    '''Weighted average of evaluate(theta) -> tuple of (batch, angle, 2, L)
+    arrays. Returns (averages shaped (batch, 2, L), number of angles evaluated).'''
+    count = distribution.segments()
+    intervals = np.column_stack([np.arange(count),np.arange(1,count+1)]).astype(float)
+    weights,values = _integrals(evaluate,intervals,distribution,order)
+    evaluations = intervals.size//2*order
+    total = weights.sum()
+    if total <= 0:
+        raise ValueError('the weight vanishes on the interval')
+    done_weight,done_values = 0.0,[0.0]*len(values)
+    for _ in range(max_rounds):
+        if len(intervals) == 0:
+            break
+        middle = intervals.mean(axis=1)
+        halves = np.concatenate([np.column_stack([intervals[:,0],middle]),np.column_stack([middle,intervals[:,1]])])
+        half_weights,half_values = _integrals(evaluate,halves,distribution,order)
+        evaluations += len(halves)*order
+        k = len(intervals)
+        refined_weights = half_weights[:k]+half_weights[k:]
+        refined = [x[:k]+x[k:] for x in half_values]
+        error = np.max([np.abs(r-x).reshape(k,-1).max(axis=1) for r,x in zip(refined,values)],axis=0)/total
+        accept = error <= tol*(intervals[:,1]-intervals[:,0])/count
+        done_weight += refined_weights[accept].sum()
+        done_values = [d+r[accept].sum(axis=0) for d,r in zip(done_values,refined)]
+        keep = np.concatenate([~accept,~accept])
+        intervals,weights,values = halves[keep],half_weights[keep],[x[keep] for x in half_values]
+    if len(intervals):
+        metrics.count('angular.unconverged')
+    done_weight += weights.sum()
+    done_values = [d+x.sum(axis=0) for d,x in zip(done_values,values)]
+    return tuple(x/done_weight for x in done_values),evaluations
+
+@metrics.timed('calc_spectra_averaged')
+def calc_spectra_averaged(n0,n1,n2,distribution,front_ns,front_ds,back_ns,back_ds,t_sub,lam,tol=1e-4,order=ORDER):
+    '''(r01, t01, r, t) of calc_spectra_batch averaged over the incidence angle
+    distribution, each shaped (batch, polarization, wavelength), and the
+    number of angles evaluated.'''
+    def evaluate(theta):
+        return calc_spectra_batch(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam)
+    spectra,evaluations = average(evaluate,distribution,tol,order)
+    metrics.value('calc_spectra_averaged.angles',evaluations)
+    return spectra,evaluations
@@ -0,0 +1,174 @@
+import sys
+import json
+import time
+import pathlib
+import argparse
+import itertools
+import numpy as np
+
+import opticalsimulation.grid as grid
+from opticalsimulation.opticalsimulation import calc_spectra_batch
+
+# Headless batch simulation
+#   Input is a JSON Lines file, one design per line:
+#     {"name": "AR-1", "layers": [["TiO2.txt", 12.5], ["SiO2.txt", 95]],
+#      "substrate": "BK7.txt", "substrate_thickness": 1000,
+#      "angles": [0, 45], "wavelength": {"start": 400, "end": 800, "step": 5}}
+#   "substrate_thickness", "angles" and "wavelength" are optional. Without a
+#   wavelength grid the common range of all materials is used with a 10 nm
+#   step, as on the main page. "wavelength" may also ask for a non-uniform
+#   grid, {"spacing": "energy" | "adaptive", "count": 200} with optional
+#   "start"/"end" (see opticalsimulation.grid). Consecutive designs that share
+#   materials, angles and grid are evaluated together in one batched call.
+
+DEFAULT_STEP = 10
+GRIDS = {'uniform':grid.uniform,'energy':grid.energy,'adaptive':grid.adaptive}
+
+def read_designs(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield json.loads(line)
+
+def _grid(wavelength):
+    if wavelength is None:
+        return grid.uniform(DEFAULT_STEP)
+    wavelength = dict(wavelength)
+    spacing = wavelength.pop('spacing','uniform')
+    if spacing not in GRIDS:
+        raise ValueError('unknown wavelength spacing: {}'.format(spacing))
+    return GRIDS[spacing](**wavelength)
+
+class Resolver:
+    def __init__(self):
+        import opticalsimulation.database as db
+        self.db = db
+        self.ids = {name:id for id,name in db.get_material_list()}
+
+    def id(self,name):
+        if name not in self.ids:
+            raise KeyError('unknown material: {}'.format(name))
+        return self.ids[name]
+
+    def resolve(self,names,wavelength):
+        '''(wavelengths, [n-ik per name]) on the grid given by `wavelength`.'''
+        ids = [self.id(name) for name in names]
+        builder = _grid(wavelength)
+        if wavelength is not None and 'start' in wavelength and 'end' in wavelength:
+            wl_min,wl_max = self.db.common_range(ids)
+            if wl_min is None or wavelength['start'] < wl_min or wavelength['end'] > wl_max:
+                raise ValueError('materials do not cover {}-{} nm'.format(wavelength['start'],wavelength['end']))
+        return self.db.resolve_stack(ids,builder)
+
+def _key(design):
+    return (tuple(layer[0] for layer in design['layers']),design['substrate'],design.get('substrate_thickness'),
+            tuple(design.get('angles',[0])),json.dumps(design.get('wavelength'),sort_keys=True))
+
+def _groups(designs,chunk):
+    index = itertools.count()
+    for key,group in itertools.groupby(((next(index),design) for design in designs),key=lambda x:_key(x[1])):
+        group = iter(group)
+        while True:
+            part = list(itertools.islice(group,chunk))
+            if not part:
+                break
+            yield key,part
+
+def simulate(designs,resolver=None,chunk=1024):
+    '''Yield one result dict per batch of designs with R and T shaped
+    (design, angle, polarization, wavelength).'''
+    resolver = resolver or Resolver()
+    for key,part in _groups(designs,chunk):
+        names,substrate,t_sub,angles,_ = key
+        first = part[0][1]
+        try:
+            lam,(n1,*ns) = resolver.resolve((substrate,)+names,first.get('wavelength'))
+        except (KeyError,ValueError) as e:
+            print('skipped {} design(s) from {}: {}'.format(len(part),first.get('name',part[0][0]),e),file=sys.stderr)
+            continue
+        ds = np.array([[layer[1] for layer in design['layers']] for _,design in part],dtype=float)
+        ds = ds.reshape(len(part),len(names))
+        r01,t01,r,t = calc_spectra_batch(1,n1,1,np.radians(angles),ns,ds,[],[],1 if t_sub is None else t_sub,lam)
+        if t_sub is None:
+            r,t = r01,t01
+        yield {'index':np.array([i for i,_ in part]),
+               'name':np.array([design.get('name',str(i)) for i,design in part]),
+               'thickness':ds,'angle':np.array(angles,dtype=float),'wavelength':lam,
+               'R':r.astype(np.float32),'T':t.astype(np.float32)}
+
+class NPZWriter:
+    def __init__(self,path):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True,exist_ok=True)
+        self.parts = 0
+
+    def write(self,result):
+        np.savez(self.path/'part-{:05d}.npz'.format(self.parts),**result)
+        self.parts += 1
+
+    def close(self):
+        pass
+
+class ParquetWriter:
+    def __init__(self,path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('parquet output requires pyarrow (pip install pyarrow)')
+        self.pa = pa
+        values = pa.list_(pa.float32())
+        self.schema = pa.schema([('design',pa.int64()),('name',pa.string()),('angle',pa.float64()),
+                                 ('wavelength',pa.list_(pa.float64())),
+                                 ('Rs',values),('Rp',values),('Ts',values),('Tp',values)])
+        self.writer = pq.ParquetWriter(str(path),self.schema)
+
+    def write(self,result):
+        pa = self.pa
+        designs,angles,_,length = result['R'].shape
+        rows = designs*angles
+
+        def _column(x,polarization):
+            flat = np.ascontiguousarray(x[:,:,polarization]).reshape(-1)
+            return pa.FixedSizeListArray.from_arrays(pa.array(flat),length).cast(pa.list_(pa.float32()))
+
+        wavelength = pa.FixedSizeListArray.from_arrays(pa.array(np.tile(result['wavelength'],rows)),length)
+        table = pa.table({'design':np.repeat(result['index'],angles),
+                          'name':np.repeat(result['name'],angles).tolist(),
+                          'angle':np.tile(result['angle'],designs),
+                          'wavelength':wavelength.cast(pa.list_(pa.float64())),
+                          'Rs':_column(result['R'],0),'Rp':_column(result['R'],1),
+                          'Ts':_column(result['T'],0),'Tp':_column(result['T'],1)},schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'npz':NPZWriter,'parquet':ParquetWriter}
+
+def run(input,output,format='npz',chunk=1024):
+    start = time.perf_counter()
+    writer = WRITERS[format](output)
+    designs = 0
+    try:
+        for result in simulate(read_designs(input),chunk=chunk):
+            writer.write(result)
+            designs += len(result['index'])
+    finally:
+        writer.close()
+    seconds = time.perf_counter()-start
+    return {'designs':designs,'seconds':seconds,'designs_per_second':designs/seconds if seconds > 0 else float('inf')}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a file of layer stacks without the Dash app')
+    parser.add_argument('input',help='JSON Lines file with one design per line')
+    parser.add_argument('-o','--output',required=True,help='output directory (npz) or file (parquet)')
+    parser.add_argument('-f','--format',choices=sorted(WRITERS),default='npz')
+    parser.add_argument('--chunk',type=int,default=1024,help='designs per batched evaluation')
+    args = parser.parse_args(argv)
+    report = run(args.input,args.output,args.format,args.chunk)
+    print('{designs} designs in {seconds:.1f} s ({designs_per_second:.0f}/s)'.format(**report),file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+def nbytes(value):
+    '''Bytes held by arrays in value (an array, an object with nbytes, or nested tuples/lists of them).'''
+    if isinstance(value,(tuple,list)):
+        return sum(nbytes(x) for x in value)
+    return getattr(value,'nbytes',0)
+
+class LRUCache:
+    '''Least recently used cache bounded by entry count and, with maxbytes,
+    by the nbytes() of its values. Values that grow after put() are
+    re-measured by putting them again.'''
+    def __init__(self,maxsize=128,maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self,key,default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def _remove(self,key):
+        del self._data[key]
+        self.nbytes -= self._sizes.pop(key)
+
+    def put(self,key,value):
+        size = nbytes(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while self._data and (len(self._data) > self.maxsize or
+                                  (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self,predicate):
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits':self.hits,'misses':self.misses,'evictions':self.evictions,
+                    'size':len(self._data),'maxsize':self.maxsize,'nbytes':self.nbytes,'maxbytes':self.maxbytes}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self,key):
+        return key in self._data
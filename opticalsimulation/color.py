@@ -0,0 +1,159 @@
+import re
+import hashlib
+import pathlib
+import numpy as np
+
+from opticalsimulation.cache import LRUCache
+
+# Colour and photometry of simulated spectra
+#   Spectra shaped (..., wavelength) on the simulation grid are reduced to CIE
+#   XYZ by one matrix multiply with a (wavelength, 3) weight matrix. The
+#   weights fold the observer, the illuminant and the quadrature of the
+#   (possibly non-uniform) grid together, are normalized so that a perfect
+#   reflector has Y = 100, and are cached per grid. Observer and daylight
+#   tables are the CIE 5 nm tables in data/cie.csv (360-830 nm); wavelengths
+#   outside them contribute nothing.
+
+OBSERVERS = {'1931':(1,2,3),'1964':(4,5,6)}
+# nominal daylight illuminants, CCT in K on the pre-1968 scale
+DAYLIGHT = {'D50':5000,'D55':5500,'D65':6500,'D75':7500}
+
+_table = None
+
+def _cie():
+    global _table
+    if _table is None:
+        _table = np.loadtxt(pathlib.Path(__file__).with_name('data')/'cie.csv',delimiter=',',skiprows=3)
+    return _table
+
+def observer(name='1931'):
+    '''(wavelength, xbar, ybar, zbar) of the CIE 1931 2 deg or 1964 10 deg observer.'''
+    table = _cie()
+    return (table[:,0],)+tuple(table[:,i] for i in OBSERVERS[name])
+
+def daylight(cct):
+    '''Relative spectral power of the CIE D-series illuminant of the given
+    (pre-1968) correlated colour temperature, on the table grid.'''
+    table = _cie()
+    t = cct*1.4388/1.4380
+    if t <= 7000:
+        x = -4.6070e9/t**3+2.9678e6/t**2+0.09911e3/t+0.244063
+    else:
+        x = -2.0064e9/t**3+1.9018e6/t**2+0.24748e3/t+0.237040
+    y = -3*x**2+2.870*x-0.275
+    m = 0.0241+0.2562*x-0.7341*y
+    m1 = round((-1.3515-1.7703*x+5.9114*y)/m,3)
+    m2 = round((0.0300-31.4424*x+30.0717*y)/m,3)
+    return table[:,0],table[:,7]+m1*table[:,8]+m2*table[:,9]
+
+def planck(lam,temperature):
+    c2 = 1.4388e7   # nm K
+    return 1/(lam**5*np.expm1(c2/(lam*temperature)))
+
+def illuminant(name,lam):
+    '''Spectral power of a named illuminant ('D65', 'D50', 'A', 'E', 'D<cct/100>') on lam.'''
+    lam = np.asarray(lam,dtype=float)
+    if name == 'E':
+        return np.ones(len(lam))
+    if name == 'A':
+        return 100*planck(lam,2856)/planck(560.0,2856)
+    match = re.fullmatch(r'D(\d\d)',name)
+    if match is None:
+        raise ValueError('unknown illuminant: {}'.format(name))
+    ws,spd = daylight(DAYLIGHT.get(name,int(match.group(1))*100))
+    return np.interp(lam,ws,spd)
+
+def _quadrature(lam):
+    # trapezoid weights of a (non-uniform) grid
+    if len(lam) < 2:
+        return np.ones(len(lam))
+    step = np.diff(lam)
+    return np.concatenate([[0],step/2])+np.concatenate([step/2,[0]])
+
+_weights = LRUCache(maxsize=32)
+
+def weights(lam,illuminant_name='D65',observer_name='1931'):
+    '''(wavelength, 3) matrix W so that spectra @ W is XYZ with Y = 100 for a
+    perfect reflector. Cached per grid, illuminant and observer.'''
+    lam = np.ascontiguousarray(lam,dtype=float)
+    key = (hashlib.blake2b(lam.tobytes(),digest_size=16).hexdigest(),illuminant_name,observer_name)
+    w = _weights.get(key)
+    if w is None:
+        ws,*cmfs = observer(observer_name)
+        spd = illuminant(illuminant_name,lam)*_quadrature(lam)
+        w = np.column_stack([np.interp(lam,ws,cmf,left=0,right=0)*spd for cmf in cmfs])
+        total = w[:,1].sum()
+        if total > 0:
+            w *= 100/total
+        w.setflags(write=False)
+        _weights.put(key,w)
+    return w
+
+def xyz(spectra,lam,illuminant_name='D65',observer_name='1931'):
+    '''CIE XYZ (..., 3) of R or T spectra (..., wavelength) in [0, 1].'''
+    return np.asarray(spectra)@weights(lam,illuminant_name,observer_name)
+
+def white(lam,illuminant_name='D65',observer_name='1931'):
+    return weights(lam,illuminant_name,observer_name).sum(axis=0)
+
+def luminous(spectra,lam,illuminant_name='D65',observer_name='1931'):
+    '''Photopic (Y weighted) R or T in [0, 1].'''
+    return np.asarray(spectra)@weights(lam,illuminant_name,observer_name)[:,1]/100
+
+def chromaticity(XYZ):
+    XYZ = np.asarray(XYZ)
+    total = XYZ.sum(axis=-1,keepdims=True)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.where(total > 0,XYZ[...,:2]/total,np.nan)
+
+def lab(XYZ,white_point):
+    '''CIE 1976 L*a*b* of XYZ relative to the white point XYZ.'''
+    t = np.asarray(XYZ)/np.asarray(white_point)
+    f = np.where(t > (6/29)**3,np.cbrt(t),t/(3*(6/29)**2)+4/29)
+    return np.stack([116*f[...,1]-16,500*(f[...,0]-f[...,1]),200*(f[...,1]-f[...,2])],axis=-1)
+
+def _locus(observer_name):
+    # spectrum locus 380-700 nm, angles around the white point increase toward short wavelength
+    ws,*cmfs = observer(observer_name)
+    keep = (ws >= 380) & (ws <= 700)
+    ws = ws[keep]
+    xyz_ = np.column_stack([c[keep] for c in cmfs])
+    return ws,xyz_[:,:2]/xyz_.sum(axis=1,keepdims=True)
+
+def dominant_wavelength(xy,white_xy,observer_name='1931'):
+    '''Dominant wavelength in nm of chromaticities xy (..., 2) seen against
+    white_xy. Purples get the negative complementary wavelength; the white
+    point itself gives nan.'''
+    xy = np.asarray(xy,dtype=float)
+    white_xy = np.asarray(white_xy,dtype=float)
+    ws,locus = _locus(observer_name)
+    ws,locus = ws[::-1],locus[::-1]
+    v = locus-white_xy
+    start = np.arctan2(v[0,1],v[0,0])
+    angles = np.mod(np.arctan2(v[:,1],v[:,0])-start,2*np.pi)
+    angles = np.maximum.accumulate(angles)
+
+    d = xy-white_xy
+    phi = np.mod(np.arctan2(d[...,1],d[...,0])-start,2*np.pi)
+    purple = phi > angles[-1]
+    phi = np.where(purple,np.mod(phi+np.pi,2*np.pi),phi)
+    i = np.clip(np.searchsorted(angles,phi),1,len(ws)-1)
+    # intersect the ray white + s*u with the locus segment a + t*(b-a)
+    u = np.where(purple[...,np.newaxis],-d,d)
+    a,b = v[i-1],v[i]
+    e = b-a
+    denominator = e[...,0]*u[...,1]-e[...,1]*u[...,0]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        t = np.clip((a[...,1]*u[...,0]-a[...,0]*u[...,1])/denominator,0,1)
+    result = ws[i-1]+t*(ws[i]-ws[i-1])
+    result = np.where(purple,-result,result)
+    return np.where(np.hypot(d[...,0],d[...,1]) > 1e-12,result,np.nan)
+
+def color(spectra,lam,illuminant_name='D65',observer_name='1931'):
+    '''XYZ, xy, L*a*b*, luminous value and dominant wavelength of spectra
+    (..., wavelength) in one pass.'''
+    XYZ = xyz(spectra,lam,illuminant_name,observer_name)
+    white_point = white(lam,illuminant_name,observer_name)
+    xy = chromaticity(XYZ)
+    return {'XYZ':XYZ,'xy':xy,'Lab':lab(XYZ,white_point),'luminous':XYZ[...,1]/100,
+            'dominant':dominant_wavelength(xy,chromaticity(white_point),observer_name)}
@@ -1,85 +1,338 @@
-import requests
+import io
+import os
+import time
+import contextlib
+import hashlib
+import pathlib
 import numpy as np
 
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import func
-from scipy import interpolate
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import insert, select, delete, func
 
 from opticalsimulation.settings import Engine
-from opticalsimulation.models import Material, OpticalIndex
+from opticalsimulation.models import Material, Dispersion, pack, unpack
+from opticalsimulation.cache import LRUCache
+from opticalsimulation import metrics
+from opticalsimulation import grid as grids
+from opticalsimulation.dispersion import Model, fit_model
 
-Session = sessionmaker(bind=Engine)
+# one session per thread; session_scope() is the unit of work of every function below
+Session = scoped_session(sessionmaker(bind=Engine))
+metrics.install_sqlalchemy()
+
+# fitted n/k arrays keyed by (material id, start, end, step) or (material id, grid digest)
+nk_cache = LRUCache(maxsize=256)
+# ({material id: (wl_min, wl_max)}, {material id: Model}) of every material, loaded by one query and
+# revalidated like _materials below
+_index = None
+# [(id, name)] of every material ordered by id, shared by all dropdowns until a material is added or deleted
+_materials = None
+# (count, max id) of the material table the caches above were loaded from (ids are never reused). Other
+# processes (Dash workers, import jobs, alembic) change the table too, so a cache older than
+# OPTSIM_DB_CHECK_SECONDS is compared with the table by one aggregate query before it is used.
+CHECK_SECONDS = float(os.environ.get('OPTSIM_DB_CHECK_SECONDS',1.0))
+_version = None
+_checked = 0.0
+# window used when every material of a stack is an analytic model
+MODEL_RANGE = (250.0,2500.0)
+
+@contextlib.contextmanager
+def session_scope():
+    '''Session of the current thread, committed on success and rolled back on
+    error. Nested scopes share the outer session and leave the commit and the
+    release of the connection to the outermost one.'''
+    if Session.registry.has():
+        yield Session()
+        return
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+def invalidate_opticalindex(id):
+    global _index,_materials
+    _index = _materials = None
+    return nk_cache.invalidate(lambda key:key[0] == id)
+
+def clear_cache():
+    global _index,_materials,_version,_checked
+    _index = _materials = _version = None
+    _checked = 0.0
+    nk_cache.clear()
+
+def _table_version(rows):
+    return (len(rows),max((row.id for row in rows),default=None))
+
+def _loaded(version):
+    '''Record the table version a cache is loaded from; caches of another version are dropped.'''
+    global _version,_checked,_index,_materials
+    if version != _version:
+        _version = version
+        _index = _materials = None
+    _checked = time.monotonic()
+
+def _validate():
+    if time.monotonic()-_checked < CHECK_SECONDS:
+        return
+    metrics.count('db.version_check')
+    with session_scope() as session:
+        count,last = session.execute(select(func.count(Material.id),func.max(Material.id))).one()
+    _loaded((count,last))
+
+def get_cache_stats():
+    return nk_cache.stats()
+
+def parse_opticalindex(text):
+    data = np.loadtxt(io.StringIO(text),skiprows=1,usecols=(0,1,2),ndmin=2)
+    return data[:,0],data[:,1],data[:,2]
+
+def dispersion_row(material_id,ws,ns,ks):
+    order = np.argsort(ws,kind='stable')
+    ws = ws[order]
+    wl_min,wl_max = (ws[0],ws[-1]) if len(ws) else (None,None)
+    return {'material_id':material_id,'wl_min':wl_min,'wl_max':wl_max,'count':len(ws),
+            'wavelength':pack(ws),'n':pack(ns[order]),'k':pack(ks[order])}
+
+def _material_exists(session,name):
+    return session.execute(select(Material.id).where(Material.name == name)).first() is not None
+
+def _insert_material(session,name,text):
+    if _material_exists(session,name):
+        return None
+    ws,ns,ks = parse_opticalindex(text)
+    material = Material(name=name)
+    session.add(material)
+    session.flush()
+    return dispersion_row(material.id,ws,ns,ks)
 
 def add_opticalindex(url):
+    import requests
     response = requests.get(url)
     if response.status_code == 200:
-        
         name = url.split('/')[-1]
-        text = response.text
-        
-        session = Session()
-
-        material = session.query(Material).filter_by(name=name).one_or_none()
-        if material is None:
-            material = Material(name=name)
-            session.add(material)
-            material = session.query(Material).filter_by(name=name).one()
-            lines = text.splitlines()
-            lines.pop(0)
-            opticalindexes = [OpticalIndex(material_id=material.id,wavelength=line.split()[0],
-                                           n=line.split()[1],k=line.split()[2]) for line in lines]
-            session.add_all(opticalindexes)
-            session.commit()
-        session.close()
+        with session_scope() as session:
+            row = _insert_material(session,name,response.text)
+            if row is not None:
+                session.execute(insert(Dispersion),[row])
+        if row is not None:
+            invalidate_opticalindex(row['material_id'])
     return response.status_code
 
+def import_opticalindex_texts(items):
+    '''Add (name, nk file text) pairs in one transaction; names that already exist are skipped.'''
+    start = time.perf_counter()
+    items = list(items)
+    dispersions = []
+    with session_scope() as session:
+        for name,text in items:
+            row = _insert_material(session,name,text)
+            if row is not None:
+                dispersions.append(row)
+        if dispersions:
+            session.execute(insert(Dispersion),dispersions)
+    for row in dispersions:
+        invalidate_opticalindex(row['material_id'])
+    rows = sum(row['count'] for row in dispersions)
+    seconds = time.perf_counter()-start
+    return {'files':len(items),'materials':len(dispersions),'rows':rows,'seconds':seconds,
+            'rows_per_second':rows/seconds if seconds > 0 else float('inf')}
+
+def import_opticalindex_files(paths):
+    return import_opticalindex_texts((path.name,path.read_text()) for path in map(pathlib.Path,paths))
+
+def add_model(name,kind,params):
+    '''Add a material described by an analytic dispersion model; returns its id.'''
+    params = {k:list(map(float,v)) if np.ndim(v) else float(v) for k,v in params.items()}
+    Model(kind,**params)(np.array([500.0]))
+    with session_scope() as session:
+        if _material_exists(session,name):
+            raise ValueError('material {} already exists'.format(name))
+        material = Material(name=name,kind=kind,params=params)
+        session.add(material)
+        session.flush()
+        id = material.id
+    invalidate_opticalindex(id)
+    return id
+
+def fit_material(id,kind,params,name=None,**kwargs):
+    '''Fit a model to the tabulated n/k of material `id` and store it as a new
+    material. Returns (new id, rms error).'''
+    ws,nks = get_opticalindex(id)
+    model,error = fit_model(kind,ws,nks,params,**kwargs)
+    name = name or '{} ({})'.format(get_material_name(id),kind)
+    return add_model(name,kind,model.params),error
+
+def import_opticalindex_directory(directory,pattern='*.txt'):
+    return import_opticalindex_files(sorted(pathlib.Path(directory).glob(pattern)))
+
+@metrics.timed('db.get_material_list')
 def get_material_list():
-    session = Session()
-    qs = session.query(Material).all()
-    session.close()
-    return [(q.id,q.name) for q in qs]
+    global _materials
+    if _materials is not None:
+        _validate()
+    materials = _materials
+    if materials is None:
+        metrics.count('db.material_list.miss')
+        with session_scope() as session:
+            rows = session.execute(select(Material.id,Material.name).order_by(Material.id)).all()
+        _loaded(_table_version(rows))
+        materials = _materials = tuple((row.id,row.name) for row in rows)
+    return list(materials)
 
 def get_material_name(id):
-    session = Session()
-    q = session.query(Material).filter_by(id=id).one_or_none()
-    return q.name
+    with session_scope() as session:
+        return session.execute(select(Material.name).where(Material.id == id)).scalar_one_or_none()
+
+@metrics.timed('db.load_opticalindex')
+def _load_opticalindex(id):
+    with session_scope() as session:
+        q = session.execute(select(Dispersion.wavelength,Dispersion.n,Dispersion.k)
+                            .where(Dispersion.material_id == id)).one_or_none()
+    if q is None:
+        return np.array([]),np.array([]),np.array([])
+    return unpack(q.wavelength),unpack(q.n),unpack(q.k)
 
 def get_opticalindex(id):
-    session = Session()
-    qs = session.query(OpticalIndex).filter_by(material_id=id).order_by(OpticalIndex.wavelength).all()
-    session.close()
-    ws = [q.wavelength for q in qs]
-    nks = [complex(q.n,-q.k) for q in qs]
-    return [ws,nks]
+    model = get_model(id)
+    if model is not None:
+        ws = np.arange(*MODEL_RANGE,1.0)
+        return [ws,model(ws)]
+    ws,ns,ks = _load_opticalindex(id)
+    return [ws,ns-1j*ks]
 
-def fitted_opticalindex(id,start,end,step):    
-    session = Session()
-    qs = session.query(OpticalIndex).filter_by(material_id=id).order_by(OpticalIndex.wavelength).all()
-    session.close()
-    if len(qs) > 1:
-        ws = [q.wavelength for q in qs]
-        if ws[0] <= start and ws[-1] >= end:
-            ns = [q.n for q in qs]
-            ks = [q.k for q in qs]
-            n_fitted = interpolate.interp1d(ws,ns)
-            k_fitted = interpolate.interp1d(ws,ks)
-            x = np.arange(start,end,step)
-            return np.array([complex(n,-k) for n,k in zip(n_fitted(x),k_fitted(x))])
-    return np.array([])
+@metrics.timed('db.fitted_opticalindex')
+def fitted_opticalindex(id,start,end,step):
+    key = (id,start,end,step)
+    nks = nk_cache.get(key)
+    if nks is None:
+        metrics.count('db.nk_cache.miss')
+        nks = _fitted_opticalindex(id,start,end,step)
+        nks.setflags(write=False)
+        nk_cache.put(key,nks)
+    return nks
+
+def _fitted_opticalindex(id,start,end,step):
+    model = get_model(id)
+    if model is not None:
+        return model(np.arange(start,end,step))
+    ws,ns,ks = _load_opticalindex(id)
+    if len(ws) > 1 and ws[0] <= start and ws[-1] >= end:
+        x = np.arange(start,end,step)
+        metrics.value('db.interp.points',len(x))
+        return np.interp(x,ws,ns)-1j*np.interp(x,ws,ks)
+    return np.array([],dtype=complex)
 
 def delete_opticalindex(id):
-    session = Session()
-    q = session.query(Material).filter_by(id=id).one_or_none()
-    if q is not None:
-        session.query(OpticalIndex).filter_by(material_id=q.id).delete()
-        session.delete(q)
-        session.commit()
-    session.close()
+    with session_scope() as session:
+        session.execute(delete(Dispersion).where(Dispersion.material_id == id))
+        deleted = session.execute(delete(Material).where(Material.id == id)).rowcount
+    if deleted:
+        invalidate_opticalindex(id)
 
+@metrics.timed('db.get_range')
 def get_range(id):
-    session = Session()
-    q = session.query(func.min(OpticalIndex.wavelength).label('min'),func.max(OpticalIndex.wavelength).label('max')).filter_by(material_id=id).one_or_none()
-    session.close()
-    if q is not None:
-        return q.min,q.max
-    return None,None
\ No newline at end of file
+    return get_ranges().get(id,(None,None))
+
+def _material_index():
+    global _index
+    if _index is not None:
+        _validate()
+    index = _index
+    if index is None:
+        with session_scope() as session:
+            rows = session.execute(select(Material.id,Material.kind,Material.params,Dispersion.wl_min,Dispersion.wl_max)
+                                   .outerjoin(Dispersion,Dispersion.material_id == Material.id)).all()
+        _loaded(_table_version(rows))
+        # n/k of materials deleted by another process
+        ids = {row.id for row in rows}
+        nk_cache.invalidate(lambda key:key[0] not in ids)
+        ranges,models = {},{}
+        for row in rows:
+            if row.kind != 'table':
+                models[row.id] = Model(row.kind,**(row.params or {}))
+                ranges[row.id] = (None,None)
+            elif row.wl_min is not None:
+                ranges[row.id] = (row.wl_min,row.wl_max)
+        index = _index = (ranges,models)
+    return index
+
+def get_ranges():
+    '''{material id: (wl_min, wl_max)}; analytic models have no range (None, None).'''
+    return _material_index()[0]
+
+def get_model(id):
+    return _material_index()[1].get(id)
+
+def common_range(ids):
+    '''Wavelength window covered by every material, (None, None) if one has no
+    data. Analytic models do not narrow the window.'''
+    ranges = get_ranges()
+    wl_min,wl_max = None,None
+    for id in ids:
+        if id not in ranges:
+            return None,None
+        a_min,a_max = ranges[id]
+        if a_min is None:
+            continue
+        wl_min = a_min if wl_min is None else max(wl_min,a_min)
+        wl_max = a_max if wl_max is None else min(wl_max,a_max)
+    if wl_min is None:
+        return MODEL_RANGE
+    return wl_min,wl_max
+
+def _load_opticalindices(ids):
+    with session_scope() as session:
+        rows = session.execute(select(Dispersion.material_id,Dispersion.wavelength,Dispersion.n,Dispersion.k)
+                               .where(Dispersion.material_id.in_(ids))).all()
+    return {row.material_id:(unpack(row.wavelength),unpack(row.n),unpack(row.k)) for row in rows}
+
+@metrics.timed('db.resolve_stack')
+def resolve_stack(ids,grid=None):
+    '''Wavelengths and n-ik of every material in ids on one shared grid.
+    grid is a builder from opticalsimulation.grid (default: 10 nm steps over
+    the common window) or an array of wavelengths. Ranges come from the
+    cached range index and all missing tables are read by a single query.'''
+    ids = list(ids)
+    wl_min,wl_max = common_range(ids)
+    if wl_min is None:
+        raise ValueError('no dispersion data for material {}'.format(
+            [id for id in ids if id not in get_ranges()]))
+    tables = {}
+    def load(missing=None):
+        missing = [id for id in dict.fromkeys(ids if missing is None else missing)
+                   if id not in tables and get_model(id) is None]
+        if missing:
+            tables.update(_load_opticalindices(missing))
+        return tables
+    if grid is None:
+        grid = grids.uniform(10)
+    if callable(grid):
+        wl = np.asarray(grid(wl_min,wl_max,load),dtype=float)
+    else:
+        wl = np.asarray(grid,dtype=float)
+        if len(wl) and (wl.min() < wl_min or wl.max() > wl_max):
+            raise ValueError('grid {}-{} nm is outside the common range {}-{} nm'.format(
+                wl.min(),wl.max(),wl_min,wl_max))
+    digest = hashlib.blake2b(wl.tobytes(),digest_size=16).hexdigest()
+    nks = {id:nk_cache.get((id,digest)) for id in ids}
+    for id in nks:
+        model = get_model(id)
+        if model is not None:
+            nks[id] = model(wl)
+    missing = [id for id,x in nks.items() if x is None]
+    if missing:
+        metrics.count('db.nk_cache.miss',len(missing))
+        load(missing)
+        for id in missing:
+            ws,ns,ks = tables[id]
+            x = np.interp(wl,ws,ns)-1j*np.interp(wl,ws,ks)
+            x.setflags(write=False)
+            nk_cache.put((id,digest),x)
+            nks[id] = x
+    metrics.value('db.interp.points',len(wl))
+    return wl,[nks[id] for id in ids]
@@ -0,0 +1,129 @@
+import numpy as np
+
+from opticalsimulation.opticalsimulation import (_angles,_apply,_product,_wavenumber,admittance_batch,
+                                                 calc_gradient_batch,characteristic_elements,suffix_vectors,
+                                                 reflectance_batch,transmittance_batch,
+                                                 reflectance_derivative,transmittance_derivative)
+
+# Thin-film design
+#   The merit is the weighted mean squared error between R or T of the coated
+#   front surface (semi-infinite substrate) and a target, over angles and
+#   wavelengths. Layers are given as keys into an `indexes` dict of n arrays so
+#   that needle insertion can pick new materials from the same table.
+
+def _polarize(x,polarization):
+    if polarization == 's':
+        return x[...,0,:]
+    if polarization == 'p':
+        return x[...,1,:]
+    return x.mean(axis=-2)
+
+def _prepare(lam,target,theta,weight):
+    theta = np.atleast_1d(np.asarray(theta,dtype=float))
+    target = np.broadcast_to(target,(len(theta),len(lam)))
+    weight = np.broadcast_to(1.0 if weight is None else weight,target.shape)
+    return theta,target,weight
+
+def merit(ns,ds,n0,n1,lam,target,theta=0.0,quantity='R',polarization='average',weight=None):
+    theta,target,weight = _prepare(lam,target,theta,weight)
+    r,t,dr,dt = calc_gradient_batch(ns,np.asarray(ds,dtype=float),n0,n1,theta,lam)
+    x,dx = (r,dr) if quantity == 'R' else (t,dt)
+    residual = _polarize(x[0],polarization)-target
+    total = np.sum(weight)
+    value = np.sum(weight*residual**2)/total
+    gradient = 2*np.sum(weight*residual*_polarize(dx[:,0],polarization),axis=(1,2))/total
+    return value,gradient
+
+def optimize_thickness(ns,ds,n0,n1,lam,target,theta=0.0,quantity='R',polarization='average',weight=None,
+                       bounds=(0,None),maxiter=500):
+    from scipy import optimize
+    result = optimize.minimize(lambda x:merit(ns,x,n0,n1,lam,target,theta,quantity,polarization,weight),
+                               np.asarray(ds,dtype=float),jac=True,method='L-BFGS-B',bounds=[bounds]*len(ds),
+                               options={'maxiter':maxiter,'ftol':1e-12,'gtol':1e-10})
+    return result.x,result.fun
+
+def needle_derivative(ns,ds,candidates,n0,n1,lam,target,theta=0.0,quantity='R',polarization='average',
+                      weight=None,points=8):
+    '''Merit derivative for a zero-thickness needle of each candidate index,
+    inserted at `points` depths inside every layer, the last one being the
+    interface below the layer. Returns an array shaped
+    (candidate, layer, point) and the depths inside each layer.'''
+    theta,target,weight = _prepare(lam,target,theta,weight)
+    angles = _angles(theta)
+    ds = np.asarray(ds,dtype=float)
+    eta0 = admittance_batch(n0,n0,angles)
+    eta_s = admittance_batch(n1,n0,angles)
+    ms = [characteristic_elements(n,d,n0,angles,lam) for n,d in zip(ns,ds)]
+    suffix = suffix_vectors(ms,eta_s)
+    param = suffix[0]
+    if quantity == 'R':
+        x = reflectance_batch(param,eta0)
+    else:
+        x = transmittance_batch(param,eta0,eta_s)
+    residual = _polarize(x,polarization)-target
+    total = np.sum(weight)
+
+    needles = []
+    for n in candidates:
+        eta = admittance_batch(n,n0,angles)
+        k = _wavenumber(n,n0,angles,lam)
+        needles.append((0,1j*k/eta,1j*k*eta,0))
+
+    offsets = (np.arange(points)+1.0)/points
+    depths = ds[:,np.newaxis]*offsets
+    result = np.zeros((len(candidates),len(ns),points))
+    prefix = (1,0,0,1)
+    for i,n in enumerate(ns):
+        upper = _product(prefix,characteristic_elements(n,depths[i],n0,angles,lam))
+        lower = _apply(characteristic_elements(n,ds[i]-depths[i],n0,angles,lam),suffix[i+1])
+        for j,dm in enumerate(needles):
+            dparam = _apply(upper,_apply(dm,lower))
+            if quantity == 'R':
+                dx = reflectance_derivative(param,dparam,eta0)
+            else:
+                dx = transmittance_derivative(param,dparam,eta0,eta_s)
+            result[j,i] = 2*np.sum(weight*residual*_polarize(dx,polarization),axis=(1,2))/total
+        prefix = _product(prefix,ms[i])
+    return result,depths
+
+def _merge(materials,ds,min_thickness):
+    layers = []
+    for material,d in zip(materials,ds):
+        if d <= min_thickness:
+            continue
+        if layers and layers[-1][0] == material:
+            layers[-1][1] += d
+        else:
+            layers.append([material,d])
+    return [layer[0] for layer in layers],np.array([layer[1] for layer in layers])
+
+def design(materials,ds,indexes,n0,n1,lam,target,theta=0.0,quantity='R',polarization='average',weight=None,
+           candidates=(),needles=0,points=8,min_thickness=0.5,maxiter=500):
+    '''Refine the thicknesses of `materials` (keys of `indexes`) and, when
+    `needles` > 0, alternate refinement with needle insertion of `candidates`.
+    Returns (materials, thicknesses, merit).'''
+    options = dict(theta=theta,quantity=quantity,polarization=polarization,weight=weight)
+    materials = list(materials)
+    ds,value = optimize_thickness([indexes[m] for m in materials],ds,n0,n1,lam,target,maxiter=maxiter,**options)
+    materials,ds = _merge(materials,ds,min_thickness)
+    for _ in range(needles):
+        if not len(ds) or not candidates:
+            break
+        derivative,depths = needle_derivative([indexes[m] for m in materials],ds,
+                                              [indexes[m] for m in candidates],
+                                              n0,n1,lam,target,points=points,**options)
+        for j,candidate in enumerate(candidates):
+            derivative[j,[m == candidate for m in materials]] = np.inf
+        j,i,k = np.unravel_index(np.argmin(derivative),derivative.shape)
+        if derivative[j,i,k] >= 0:
+            break
+        materials[i+1:i+1] = [candidates[j],materials[i]]
+        ds = np.concatenate([ds[:i],[depths[i,k],0.0,ds[i]-depths[i,k]],ds[i+1:]])
+        trial,trial_value = optimize_thickness([indexes[m] for m in materials],ds,n0,n1,lam,target,
+                                               maxiter=maxiter,**options)
+        if trial_value >= value:
+            materials,ds = _merge(materials,ds,min_thickness)
+            break
+        materials,ds = _merge(materials,trial,min_thickness)
+        value = trial_value
+    return materials,ds,value
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Analytic dispersion models
+#   Every model takes wavelengths in nm and returns the complex index n-ik on
+#   that grid, with no range clipping. Sellmeier and Cauchy coefficients use
+#   wavelengths in um (as in glass catalogues), Tauc-Lorentz and Drude use
+#   photon energies in eV. A Model instance is a callable that the transfer
+#   matrix functions accept in place of an n array.
+
+HC = 1239.841984    # eV nm
+
+def _index(eps):
+    # eps = eps1+i*eps2 (eps2 >= 0) -> n-ik
+    return np.conj(np.sqrt(eps+0j))
+
+def sellmeier(lam,B=(),C=(),k=0.0):
+    '''n^2 = 1 + sum B_i lam^2/(lam^2-C_i), lam in um.'''
+    x = (np.asarray(lam,dtype=float)/1000)**2
+    n2 = 1+sum(b*x/(x-c) for b,c in zip(B,C))
+    return np.sqrt(n2+0j).real-1j*k
+
+def cauchy(lam,A=1.5,B=0.0,C=0.0,k=0.0):
+    '''n = A + B/lam^2 + C/lam^4, lam in um.'''
+    x = (np.asarray(lam,dtype=float)/1000)**2
+    return A+B/x+C/x**2-1j*k
+
+def tauc_lorentz(lam,A=100.0,E0=4.0,C=1.5,Eg=3.0,eps_inf=1.0):
+    '''Tauc-Lorentz oscillator (Jellison and Modine), eps2 with the closed form
+    Kramers-Kronig eps1. A, E0, C and Eg in eV.'''
+    E = HC/np.asarray(lam,dtype=float)
+    eps2 = np.where(E > Eg,A*E0*C*(E-Eg)**2/(((E**2-E0**2)**2+C**2*E**2)*E),0.0)
+    alpha = np.sqrt(4*E0**2-C**2)
+    gamma2 = E0**2-C**2/2
+    zeta4 = (E**2-gamma2)**2+alpha**2*C**2/4
+    a_ln = (Eg**2-E0**2)*E**2+Eg**2*C**2-E0**2*(E0**2+3*Eg**2)
+    a_atan = (E**2-E0**2)*(E0**2+Eg**2)+Eg**2*C**2
+    eps1 = (eps_inf
+            +A*C*a_ln/(2*np.pi*zeta4*alpha*E0)*np.log((E0**2+Eg**2+alpha*Eg)/(E0**2+Eg**2-alpha*Eg))
+            -A*a_atan/(np.pi*zeta4*E0)*(np.pi-np.arctan((2*Eg+alpha)/C)+np.arctan((alpha-2*Eg)/C))
+            +2*A*E0*Eg*(E**2-gamma2)/(np.pi*zeta4*alpha)*(np.pi+2*np.arctan(2*(gamma2-Eg**2)/(alpha*C)))
+            -A*E0*C*(E**2+Eg**2)/(np.pi*zeta4*E)*np.log(np.abs(E-Eg)/(E+Eg))
+            +2*A*E0*C*Eg/(np.pi*zeta4)*np.log(np.abs(E-Eg)*(E+Eg)/np.sqrt((E0**2-Eg**2)**2+Eg**2*C**2)))
+    return _index(eps1+1j*eps2)
+
+def drude(lam,eps_inf=1.0,wp=9.0,gamma=0.05):
+    '''Free-electron metal, eps = eps_inf - wp^2/(E^2 + i gamma E), wp and gamma in eV.'''
+    E = HC/np.asarray(lam,dtype=float)
+    return _index(eps_inf-wp**2/(E**2+1j*gamma*E))
+
+MODELS = {'sellmeier':sellmeier,'cauchy':cauchy,'tauc_lorentz':tauc_lorentz,'drude':drude}
+
+class Model:
+    def __init__(self,kind,**params):
+        if kind not in MODELS:
+            raise ValueError('unknown dispersion model: {}'.format(kind))
+        self.kind = kind
+        self.params = params
+
+    def __call__(self,lam):
+        return MODELS[self.kind](lam,**self.params)
+
+    def __repr__(self):
+        return 'Model({!r}, {})'.format(self.kind,', '.join('{}={!r}'.format(k,v) for k,v in self.params.items()))
+
+def _flatten(params):
+    # {'B':(1,2),'A':3} -> names [('A',None),('B',0),('B',1)], values
+    names,values = [],[]
+    for name,value in sorted(params.items()):
+        if np.ndim(value):
+            names += [(name,i) for i in range(len(value))]
+            values += list(value)
+        else:
+            names.append((name,None))
+            values.append(value)
+    return names,np.array(values,dtype=float)
+
+def _unflatten(names,values):
+    params = {}
+    for (name,i),value in zip(names,values):
+        if i is None:
+            params[name] = float(value)
+        else:
+            params.setdefault(name,[]).append(float(value))
+    return params
+
+def fit_model(kind,lam,nks,params,fixed=(),bounds=None):
+    '''Least squares fit of a model to tabulated n-ik. params are the starting
+    values (sequences for Sellmeier B/C), `fixed` names parameters to keep.
+    bounds maps parameter names to (low, high). Returns (Model, rms error).'''
+    from scipy import optimize
+    lam = np.asarray(lam,dtype=float)
+    nks = np.asarray(nks,dtype=complex)
+    names,x0 = _flatten({k:v for k,v in params.items() if k not in fixed})
+    constants = {k:v for k,v in params.items() if k in fixed}
+    low = [-np.inf]*len(names)
+    high = [np.inf]*len(names)
+    for i,(name,_) in enumerate(names):
+        if bounds and name in bounds:
+            low[i],high[i] = bounds[name]
+
+    def residual(x):
+        y = MODELS[kind](lam,**constants,**_unflatten(names,x))
+        return np.concatenate([y.real-nks.real,y.imag-nks.imag])
+
+    result = optimize.least_squares(residual,x0,bounds=(low,high),x_scale='jac')
+    model = Model(kind,**constants,**_unflatten(names,result.x))
+    return model,float(np.sqrt(np.mean(result.fun**2)))
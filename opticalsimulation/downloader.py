@@ -0,0 +1,191 @@
+import os
+import json
+import uuid
+import warnings
+import asyncio
+import hashlib
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from opticalsimulation import metrics
+from opticalsimulation.cache import LRUCache
+
+# Concurrent import of nk files from URLs
+#   download() fetches many URLs at once from asyncio: every blocking GET runs
+#   on a thread pool sized to `concurrency`, a semaphore bounds the requests
+#   in flight, and one requests.Session shares a connection pool with urllib3
+#   retries (backoff on connection errors and 429/5xx) and a timeout per
+#   request. Files that parse as nk tables are kept in a content-addressed
+#   cache (objects/<sha256>), with urls.json mapping each URL to its digest,
+#   so a re-import reads the disk instead of the network. start_import() runs
+#   download + database import as a background job whose progress the /nk
+#   page polls with job_status(); the last JOB_HISTORY jobs are kept.
+
+CACHE_DIR = pathlib.Path(os.environ.get('OPTSIM_CACHE_DIR',pathlib.Path.home()/'.cache'/'opticalsimulation'/'nk'))
+RETRY_STATUS = (429,500,502,503,504)
+JOB_HISTORY = 64
+
+class Cache:
+    '''Content-addressed store of downloaded files.'''
+    def __init__(self,directory=None):
+        self.directory = pathlib.Path(directory or CACHE_DIR)
+        self._lock = threading.Lock()
+        self._urls = None
+
+    def _index(self):
+        if self._urls is None:
+            path = self.directory/'urls.json'
+            self._urls = json.loads(path.read_text()) if path.exists() else {}
+        return self._urls
+
+    def _object(self,digest):
+        return self.directory/'objects'/digest[:2]/digest
+
+    def lookup(self,url):
+        with self._lock:
+            digest = self._index().get(url)
+        if digest is None:
+            return None
+        path = self._object(digest)
+        return path.read_text() if path.exists() else None
+
+    def store(self,url,text):
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        path = self._object(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True,exist_ok=True)
+            temp = path.with_name(path.name+'.'+uuid.uuid4().hex)
+            temp.write_text(text)
+            os.replace(temp,path)
+        with self._lock:
+            urls = self._index()
+            urls[url] = digest
+            temp = self.directory/'urls.json.{}'.format(uuid.uuid4().hex)
+            temp.write_text(json.dumps(urls,indent=1))
+            os.replace(temp,self.directory/'urls.json')
+        return digest
+
+def make_session(pool=8,retries=3,backoff=0.5):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(total=retries,backoff_factor=backoff,status_forcelist=RETRY_STATUS,allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=pool,pool_maxsize=pool,max_retries=retry)
+    session = requests.Session()
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    return session
+
+def material_name(url):
+    return url.rstrip('/').split('/')[-1]
+
+def _fetch(session,url,cache,timeout):
+    from opticalsimulation.database import parse_opticalindex
+    text = cache.lookup(url) if cache is not None else None
+    if text is not None:
+        metrics.count('download.cache_hit')
+        return text,'cached'
+    with metrics.timer('download.get'):
+        response = session.get(url,timeout=timeout)
+    response.raise_for_status()
+    text = response.text
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')     # loadtxt warns on empty tables
+        ws,_,_ = parse_opticalindex(text)
+    if len(ws) == 0:
+        raise ValueError('no nk data in {}'.format(url))     # only nk tables are cached and imported
+    if cache is not None:
+        cache.store(url,text)
+    return text,'downloaded'
+
+async def download(urls,concurrency=8,timeout=(5,30),retries=3,backoff=0.5,cache=None,progress=None):
+    '''Fetch every URL concurrently. Returns one dict per URL, in order, with
+    name, status ('downloaded', 'cached' or 'error'), text and error.
+    progress(result) is called as each URL completes.'''
+    session = make_session(concurrency,retries,backoff)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def fetch(url):
+        result = {'url':url,'name':material_name(url),'status':'error','text':None,'error':None}
+        async with semaphore:
+            try:
+                result['text'],result['status'] = await loop.run_in_executor(executor,_fetch,session,url,cache,timeout)
+            except Exception as e:
+                result['error'] = '{}: {}'.format(type(e).__name__,e)
+        if progress is not None:
+            progress(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency,thread_name_prefix='download') as executor:
+        try:
+            return await asyncio.gather(*(fetch(url) for url in urls))
+        finally:
+            session.close()
+
+def import_urls(urls,cache=None,progress=None,**options):
+    '''Download the URLs and add every nk file to the database in one
+    transaction. Returns (per-URL results without text, import report).'''
+    import opticalsimulation.database as db
+    urls = list(dict.fromkeys(urls))
+    results = asyncio.run(download(urls,cache=Cache() if cache is None else cache,progress=progress,**options))
+    report = db.import_opticalindex_texts((r['name'],r['text']) for r in results if r['text'] is not None)
+    for r in results:
+        del r['text']
+    return results,report
+
+class Job:
+    def __init__(self,urls):
+        self.id = uuid.uuid4().hex
+        self.urls = urls
+        self.state = 'queued'
+        self.done = 0
+        self.failed = []
+        self.report = None
+        self._lock = threading.Lock()
+
+    def update(self,result):
+        with self._lock:
+            self.done += 1
+            if result['error'] is not None:
+                self.failed.append((result['url'],result['error']))
+
+    def run(self,cache,options):
+        with self._lock:
+            self.state = 'running'
+        try:
+            _,report = import_urls(self.urls,cache,self.update,**options)
+            with self._lock:
+                self.report = report
+                self.state = 'finished'
+        except Exception as e:
+            with self._lock:
+                self.failed.append((None,'{}: {}'.format(type(e).__name__,e)))
+                self.state = 'failed'
+
+    def status(self):
+        with self._lock:
+            return {'id':self.id,'state':self.state,'total':len(self.urls),'done':self.done,
+                    'failed':list(self.failed),'report':self.report}
+
+# least recently polled jobs are dropped first, a job still being polled stays
+_jobs = LRUCache(maxsize=JOB_HISTORY)
+_executor = None
+_executor_lock = threading.Lock()
+
+def start_import(urls,cache=None,**options):
+    '''Queue a background import of the URLs; returns the job id for job_status().'''
+    global _executor
+    job = Job(list(dict.fromkeys(urls)))
+    with _executor_lock:
+        if _executor is None:
+            # one job at a time, each job downloads concurrently
+            _executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix='nk-import')
+        _jobs.put(job.id,job)
+    _executor.submit(job.run,cache,options)
+    return job.id
+
+def job_status(id):
+    job = _jobs.get(id)
+    return None if job is None else job.status()
@@ -0,0 +1,84 @@
+import numpy as np
+
+from opticalsimulation.opticalsimulation import (Y0,_angles,_apply,_batch,_dispersive,_thicknesses,_wavenumber,
+                                                 admittance_batch,
+                                                 characteristic_elements,reflectance_batch,suffix_vectors,
+                                                 transmittance_batch)
+
+# Fields and absorption inside a coherent stack
+#   suffix_vectors gives the tangential (E, H) at every interface for a unit
+#   tangential E in the substrate. The net flux Re(E H*) at each interface,
+#   relative to the incident flux, drops by the absorptance of each layer:
+#     A_i = F_i - F_{i+1},  F_0 = 1 - R,  F_N = T
+#   Inside layer i the field at depth z is M_i(d_i - z) applied to the
+#   interface vector below it, so depth samples reuse the same suffix vectors.
+#   |E|^2 is relative to the incident |E|^2; for p it includes the normal
+#   component n0 sin(theta) H / (Y0 n^2). With the real-angle Snell law of
+#   this engine the s absorption density is 4 pi n k cos^2(phi) |E|^2 /
+#   (lam n0 cos(theta)), exact at normal incidence.
+
+def _interfaces(ns,ds,n0,n1,theta,lam):
+    theta = _angles(theta)
+    ds = _thicknesses(ds,len(ns))
+    eta0 = admittance_batch(n0,n0,theta)
+    eta_s = admittance_batch(n1,n0,theta)
+    ms = [characteristic_elements(n,ds[:,i],n0,theta,lam) for i,n in enumerate(ns)]
+    return theta,ds,eta0,eta_s,suffix_vectors(ms,eta_s)
+
+def _flux(v,eta0,param):
+    return 4*eta0.real*np.real(v[0]*np.conj(v[1]))/np.abs(eta0*param[0]+param[1])**2
+
+def calc_absorption_batch(ns,ds,n0,n1,theta,lam):
+    '''R, T and the absorptance of every layer, (layer, batch, angle,
+    polarization, wavelength). R + T + sum(A) = 1.'''
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n1 = _dispersive(n0,lam),_dispersive(n1,lam)
+    theta,ds,eta0,eta_s,suffix = _interfaces(ns,ds,n0,n1,theta,lam)
+    param = suffix[0]
+    shape = (ds.shape[0],theta.shape[0],2,len(lam))
+    flux = [np.broadcast_to(_flux(v,eta0,param),shape) for v in suffix]
+    r = np.broadcast_to(reflectance_batch(param,eta0),shape)
+    t = np.broadcast_to(transmittance_batch(param,eta0,eta_s),shape)
+    absorption = np.array([upper-lower for upper,lower in zip(flux[:-1],flux[1:])]).reshape((len(ns),)+shape)
+    return r,t,absorption
+
+def _intensity(v,n,n0,theta,incident,p_scale):
+    normal = np.abs(np.real(n0)*np.sin(theta)*v[1]/(Y0*n**2))**2
+    normal[...,0,:] = 0
+    return (np.abs(v[0])**2+normal)*p_scale/incident
+
+def iter_field(ns,ds,n0,n1,theta,lam,depths,chunk=256):
+    '''Yield (depths, |E|^2) for consecutive chunks of `depths` (nm from the
+    top of the stack; depths below the stack are in the substrate), |E|^2
+    shaped (depth, angle, polarization, wavelength). Only one chunk of field
+    values is held at a time.'''
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n1 = _dispersive(n0,lam),_dispersive(n1,lam)
+    ds = np.asarray(ds,dtype=float)
+    theta,_,eta0,eta_s,suffix = _interfaces(ns,ds,n0,n1,theta,lam)
+    param = suffix[0]
+    incident = np.abs((eta0*param[0]+param[1])/(2*eta0))**2
+    # tangential -> total incident field for p
+    p_scale = np.concatenate(np.broadcast_arrays(np.ones_like(theta),np.cos(theta)**2),axis=-2)
+    tops = np.concatenate([[0],np.cumsum(ds)])
+    depths = np.asarray(depths,dtype=float)
+    for start in range(0,len(depths),chunk):
+        z = depths[start:start+chunk]
+        layer = np.clip(np.searchsorted(tops,z,side='right')-1,0,len(ns))
+        field = np.empty((len(z),theta.shape[0],2,len(lam)))
+        for i in np.unique(layer):
+            mask = layer == i
+            if i == len(ns):
+                # transmitted wave in the substrate
+                phase = np.exp(-1j*_wavenumber(n1,n0,theta,lam)*_batch(z[mask]-tops[-1]))
+                field[mask] = _intensity((phase,eta_s*phase),n1,n0,theta,incident,p_scale)
+                continue
+            rest = np.clip(tops[i+1]-z[mask],0,None)
+            m = characteristic_elements(ns[i],rest,n0,theta,lam)
+            v = _apply(m,suffix[i+1])
+            field[mask] = _intensity(v,ns[i],n0,theta,incident,p_scale)
+        yield z,field
+
+def calc_field(ns,ds,n0,n1,theta,lam,depths,chunk=256):
+    '''|E|^2 at all depths, (depth, angle, polarization, wavelength).'''
+    return np.concatenate([field for _,field in iter_field(ns,ds,n0,n1,theta,lam,depths,chunk)])
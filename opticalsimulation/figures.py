@@ -0,0 +1,61 @@
+import numpy as np
+import plotly.graph_objects as go
+
+from opticalsimulation import metrics
+
+# Figure builders for the Dash pages
+#   Traces are built from float32 NumPy arrays, which plotly serializes as
+#   base64 typed arrays instead of lists of floats. With `width` (pixels) each
+#   curve is reduced on its own to the min and max sample of every pixel
+#   column, which keeps peaks visible while bounding every trace to 2*width+2
+#   points (the extremes of each column and both ends).
+
+POLARIZATIONS = ('average','s-polarized','p-polarized')
+
+def downsample(y,width):
+    '''Indices of the min-max decimation of one series y to `width` buckets.'''
+    length = len(y)
+    if width is None or length <= 2*width:
+        return np.arange(length)
+    bucket = np.arange(length)*width//length
+    first = np.r_[0,np.flatnonzero(np.diff(bucket))+1]
+    last = np.r_[first[1:]-1,length-1]
+    order = np.lexsort((y,bucket))
+    return np.unique(np.concatenate([[0,length-1],order[first],order[last]]))
+
+def _traces(wl,values,names,width):
+    x = np.asarray(wl,dtype=np.float32)
+    traces = []
+    for name,y in zip(names,values):
+        index = downsample(y,width)
+        traces.append(go.Scatter(x=x[index],y=y[index],mode='lines',name=name))
+    return traces
+
+@metrics.timed('figure.spectra')
+def spectra_figure(wl,spectra,width=None):
+    '''Average, s and p traces of spectra shaped (polarization, wavelength).'''
+    values = np.empty((3,len(wl)),dtype=np.float32)
+    values[1:] = spectra
+    values[0] = values[1:].mean(axis=0)
+    return go.Figure(_traces(wl,values,POLARIZATIONS,width))
+
+@metrics.timed('figure.nk')
+def nk_figure(wl,nks,width=None):
+    values = np.array([nks.real,-nks.imag],dtype=np.float32)
+    return go.Figure(_traces(wl,values,('n','k'),width))
+
+def message_figure(text):
+    fig = go.Figure()
+    fig.add_annotation(text=text,showarrow=False,xref='paper',yref='paper',x=0.5,y=0.5)
+    fig.update_xaxes(visible=False)
+    fig.update_yaxes(visible=False)
+    return fig
+
+@metrics.timed('figure.heatmap')
+def heatmap_figure(x,y,z,xtitle,ytitle,title=None):
+    '''Heat map of z shaped (y, x); missing (nan) cells stay blank.'''
+    fig = go.Figure(go.Heatmap(x=np.asarray(x,dtype=np.float32),y=np.asarray(y,dtype=np.float32),
+                               z=np.asarray(z,dtype=np.float32),colorscale='Viridis',colorbar={'title':title}))
+    fig.update_xaxes(title=xtitle)
+    fig.update_yaxes(title=ytitle)
+    return fig
@@ -0,0 +1,175 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from opticalsimulation.opticalsimulation import _dispersive,calc_spectra_batch,calc_spectra_jacobian
+
+# Inverse fitting of layer thicknesses to measured spectra
+#   The parameters are the thicknesses of the layers (nm) and, optionally, a
+#   scale factor on the complex index of each layer. Every residual evaluation
+#   is one calc_spectra_batch call. The thickness columns of the Jacobian are
+#   analytic (calc_spectra_jacobian); the index scale columns are forward
+#   differences, evaluated with the base point as one batch. For a lot of
+#   parts, chunks of parts are solved in parallel and every part starts from
+#   the solution of the previous part of its chunk.
+
+STEP_SCALE = 1e-7
+
+def read_measurement(text):
+    '''Wavelength (nm) and value columns of a measured spectrum. Values given
+    in percent are converted to fractions. Extra columns are returned as well
+    (value shaped (column, wavelength)).'''
+    lines = [line.replace(',',' ').replace(';',' ') for line in text.splitlines()]
+    rows = []
+    for line in lines:
+        try:
+            rows.append([float(x) for x in line.split()])
+        except ValueError:
+            continue        # header or comment
+    data = np.array([row for row in rows if len(row) >= 2 and len(row) == len(rows[-1])])
+    if data.ndim != 2 or len(data) < 2:
+        raise ValueError('no spectrum found')
+    data = data[np.argsort(data[:,0],kind='stable')]
+    values = data[:,1:].T
+    if np.nanmax(values) > 1.5:
+        values = values/100
+    return data[:,0],values if len(values) > 1 else values[0]
+
+def _polarize(x,polarization):
+    if polarization == 's':
+        return x[...,0,:]
+    if polarization == 'p':
+        return x[...,1,:]
+    return x.mean(axis=-2)
+
+class Problem:
+    '''A stack with fixed materials whose thicknesses (and index scales) are fitted.'''
+    def __init__(self,ns,n0,n1,lam,quantity='R',theta=0.0,polarization='average',t_sub=None,fit_index=False,
+                 weight=None):
+        self.lam = np.asarray(lam,dtype=float)
+        self.ns = [np.broadcast_to(_dispersive(n,self.lam),self.lam.shape) for n in ns]
+        self.n0 = n0
+        self.n1 = _dispersive(n1,self.lam)
+        self.quantity = quantity
+        self.theta = np.atleast_1d(np.asarray(theta,dtype=float))
+        self.polarization = polarization
+        self.t_sub = t_sub
+        self.fit_index = fit_index
+        self.weight = np.sqrt(np.broadcast_to(1.0 if weight is None else weight,self.lam.shape))
+
+    def split(self,x):
+        x = np.atleast_2d(x)
+        count = len(self.ns)
+        return x[:,:count],(x[:,count:] if self.fit_index else np.ones((len(x),count)))
+
+    def model(self,x):
+        '''R or T for parameter sets x (batch, parameter) -> (batch, angle, wavelength).'''
+        ds,scale = self.split(x)
+        ns = [n*scale[:,i].reshape(-1,1,1,1) for i,n in enumerate(self.ns)]
+        r01,t01,r,t = calc_spectra_batch(self.n0,self.n1,1,self.theta,ns,ds,[],[],
+                                         1 if self.t_sub is None else self.t_sub,self.lam)
+        if self.t_sub is None:
+            r,t = r01,t01
+        return _polarize(r if self.quantity == 'R' else t,self.polarization)
+
+    def residual(self,x,measured):
+        return ((self.model(x)[0]-measured)*self.weight).ravel()
+
+    def jacobian(self,x,measured):
+        count = len(self.ns)
+        ds,scale = self.split(x)
+        ns = [n*scale[0,i] for i,n in enumerate(self.ns)]
+        _,derivatives = calc_spectra_jacobian(self.n0,self.n1,1,self.theta,ns,ds,
+                                              1 if self.t_sub is None else self.t_sub,self.lam)
+        k = (0 if self.quantity == 'R' else 1)+(0 if self.t_sub is None else 2)
+        columns = [(_polarize(derivatives[k][:,0],self.polarization)*self.weight).reshape(count,-1)]
+        if self.fit_index:
+            points = x+np.vstack([np.zeros(len(x)),np.eye(len(x))[count:]*STEP_SCALE])
+            y = self.model(points)*self.weight
+            columns.append(((y[1:]-y[0])/STEP_SCALE).reshape(count,-1))
+        return np.concatenate(columns).T
+
+    def start(self,ds):
+        ds = np.asarray(ds,dtype=float)
+        return np.concatenate([ds,np.ones(len(ds))]) if self.fit_index else ds
+
+    def bounds(self,max_thickness=None,max_scale=0.2):
+        count = len(self.ns)
+        low = [0.0]*count+([1-max_scale]*count if self.fit_index else [])
+        high = [max_thickness or np.inf]*count+([1+max_scale]*count if self.fit_index else [])
+        return low,high
+
+def fit(problem,measured,ds,max_thickness=None,max_scale=0.2,x0=None):
+    '''Least squares fit of one measured spectrum (wavelength,) or (angle, wavelength).
+    Returns a dict with the thicknesses, index scales, rms residual and the fitted spectrum.'''
+    from scipy import optimize
+    measured = np.broadcast_to(measured,(len(problem.theta),len(problem.lam)))
+    low,high = problem.bounds(max_thickness,max_scale)
+    x0 = problem.start(ds) if x0 is None else np.asarray(x0,dtype=float)
+    x0 = np.clip(x0,np.nextafter(low,np.inf),np.nextafter(high,-np.inf))
+    result = optimize.least_squares(problem.residual,x0,jac=problem.jacobian,bounds=(low,high),
+                                    args=(measured,),x_scale='jac',method='trf')
+    ds,scale = problem.split(result.x)
+    return {'x':result.x,'thickness':ds[0],'scale':scale[0],
+            'rms':float(np.sqrt(np.mean(result.fun**2))),'success':bool(result.success),'nfev':result.nfev,
+            'spectrum':problem.model(result.x)[0]}
+
+_worker = {}
+
+def _attach(problem,ds,options,tolerance):
+    _worker['args'] = (problem,ds,options,tolerance)
+
+def _fit_chunk(measurements,args=None):
+    problem,ds,options,tolerance = args or _worker['args']
+    return _fit_sequence(problem,measurements,ds,options,tolerance)
+
+def _fit_sequence(problem,measurements,ds,options,tolerance):
+    results = []
+    x0 = None
+    for measured in measurements:
+        result = fit(problem,measured,ds,x0=x0,**options)
+        if x0 is not None and result['rms'] > tolerance:
+            # the previous part led into another minimum, retry from the nominal design
+            retry = fit(problem,measured,ds,**options)
+            if retry['rms'] < result['rms']:
+                result = retry
+        x0 = result['x'] if result['success'] else None
+        results.append(result)
+    return results
+
+def fit_lot(problem,measurements,ds,workers=None,chunk=None,tolerance=1e-3,executor=None,**options):
+    '''Fit every measured spectrum of a lot (part, wavelength). Parts are split
+    into one chunk per worker; each chunk is solved in order, warm-started
+    from the previous part. A part whose rms residual stays above `tolerance`
+    is fitted again from the nominal thicknesses `ds`. With `executor` the
+    chunks run on that shared pool (the problem is sent with every chunk)
+    instead of a pool of `workers` processes started for this lot; pass its
+    worker count as `workers`.'''
+    measurements = np.asarray(measurements)
+    workers = workers or os.cpu_count()
+    chunk = chunk or max(1,-(-len(measurements)//workers))
+    chunks = [measurements[i:i+chunk] for i in range(0,len(measurements),chunk)]
+    if workers == 1 or len(chunks) == 1:
+        return [r for c in chunks for r in _fit_sequence(problem,c,ds,options,tolerance)]
+    if executor is not None:
+        futures = [executor.submit(_fit_chunk,c,(problem,ds,options,tolerance)) for c in chunks]
+        return [r for future in futures for r in future.result()]
+    with ProcessPoolExecutor(max_workers=workers,initializer=_attach,
+                             initargs=(problem,ds,options,tolerance)) as executor:
+        return [r for results in executor.map(_fit_chunk,chunks) for r in results]
+
+def stack_problem(layers,substrate,lam,**kwargs):
+    '''Problem for material ids from opticalsimulation.database, evaluated on
+    the measured wavelengths inside the common range of the materials.
+    Returns (problem, mask of the measured wavelengths used).'''
+    import opticalsimulation.database as db
+    ids = [substrate]+list(layers)
+    wl_min,wl_max = db.common_range(ids)
+    if wl_min is None:
+        raise ValueError('no dispersion data for the stack')
+    lam = np.asarray(lam,dtype=float)
+    keep = (lam >= wl_min) & (lam <= wl_max)
+    if np.count_nonzero(keep) < 2:
+        raise ValueError('measurement is outside {:.0f}-{:.0f} nm'.format(wl_min,wl_max))
+    wl,(n1,*ns) = db.resolve_stack(ids,lam[keep])
+    return Problem(ns,1,n1,wl,**kwargs),keep
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Wavelength grids for database.resolve_stack
+#   Each builder returns a function (wl_min, wl_max, tables) -> wavelengths in
+#   nm inside the common window of the stack. tables() loads the tabulated
+#   {id: (ws, ns, ks)} of every material of the stack; only adaptive() uses it.
+#   start/end narrow the window; they are not allowed to widen it.
+
+HC = 1239.841984    # eV nm
+
+def _window(wl_min,wl_max,start,end):
+    a = wl_min if start is None else max(start,wl_min)
+    b = wl_max if end is None else min(end,wl_max)
+    return a,b
+
+def uniform(step,start=None,end=None):
+    '''np.arange(start, end, step), as the pages have always used.'''
+    def build(wl_min,wl_max,tables):
+        a,b = _window(wl_min,wl_max,start,end)
+        return np.arange(a,b,step)
+    return build
+
+def energy(count,start=None,end=None):
+    '''count points evenly spaced in photon energy (denser in the UV).'''
+    def build(wl_min,wl_max,tables):
+        a,b = _window(wl_min,wl_max,start,end)
+        if not a < b:
+            return np.array([])
+        return np.clip(HC/np.linspace(HC/a,HC/b,count),a,b)
+    return build
+
+def adaptive(count,start=None,end=None,floor=0.3,resolution=4096):
+    '''count points placed with a density that follows |dn/dlam|+|dk/dlam| of
+    every material, so absorption edges and resonances get most of them. A
+    fraction `floor` of the points is spread uniformly.'''
+    def build(wl_min,wl_max,tables):
+        a,b = _window(wl_min,wl_max,start,end)
+        if not a < b:
+            return np.array([])
+        x = np.linspace(a,b,resolution)
+        density = np.zeros(resolution)
+        for ws,ns,ks in tables().values():
+            for y in (ns,ks):
+                slope = np.abs(np.gradient(np.interp(x,ws,y),x))
+                total = np.trapezoid(slope,x)
+                if total > 0:
+                    density += slope/total
+        total = np.trapezoid(density,x)
+        density = floor/(b-a)+((1-floor)*density/total if total > 0 else (1-floor)/(b-a))
+        cdf = np.concatenate([[0],np.cumsum((density[1:]+density[:-1])/2*np.diff(x))])
+        return np.interp(np.linspace(0,cdf[-1],count),cdf,x)
+    return build
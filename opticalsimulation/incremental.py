@@ -0,0 +1,133 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+from opticalsimulation.cache import LRUCache,nbytes
+from opticalsimulation.opticalsimulation import (_angles,_dispersive,_full,_product,characteristic_elements,
+                                                 reversed_product,spectra_from_products)
+
+# Incremental evaluation of a stack edited one layer at a time
+#   The evaluator keeps the products of the layers in front of and behind an
+#   edit position (prefix[i] = M_1..M_i, suffix[j] = product of the last j
+#   layers). Setting, inserting or deleting layer c keeps prefix[:c+1] and the
+#   suffixes that do not contain c, so the new stack costs two products per
+#   wavelength when the same layer is edited again; moving to another layer j
+#   extends one of the lists by |j-c| products. Layer matrices are cached by
+#   (material, thickness, angles/grid). About N+1 products are held at a time,
+#   each 4 complex arrays of (angle, 2, wavelength); callers holding many
+#   evaluators bound them by their nbytes.
+#   The reversed stack (seen from the substrate) is the same product with its
+#   diagonal swapped, so it is never multiplied again.
+
+IDENTITY = (1,0,0,1)
+# characteristic matrices keyed by (material, thickness, digest of n0, angles and grid),
+# bounded by OPTSIM_LAYER_CACHE_MB megabytes
+LAYER_CACHE_BYTES = int(float(os.environ.get('OPTSIM_LAYER_CACHE_MB',64))*2**20)
+layer_cache = LRUCache(maxsize=4096,maxbytes=LAYER_CACHE_BYTES)
+
+def fingerprint(*arrays):
+    h = hashlib.blake2b(digest_size=16)
+    for x in arrays:
+        x = np.ascontiguousarray(x)
+        h.update(str((x.dtype,x.shape)).encode())
+        h.update(x.tobytes())
+    return h.hexdigest()
+
+class StackEvaluator:
+    '''Characteristic matrix product of a stack on fixed angles and grid.
+    Layers are (material, n, thickness); material is any hashable key of n.
+    Callers sharing an evaluator between threads hold `lock`.'''
+    def __init__(self,n0,theta,lam):
+        self.lam = np.asarray(lam,dtype=float)
+        self.n0 = _dispersive(n0,self.lam)
+        self.theta = _angles(theta)
+        self.digest = fingerprint(np.asarray(self.n0,dtype=complex),self.theta,self.lam)
+        self.layers = []
+        self.products = 0       # matrix products done, for tests and benchmarks
+        self.lock = threading.Lock()
+        self._prefix = [IDENTITY]
+        self._suffix = [IDENTITY]
+        self._cursor = 0
+
+    def _mul(self,a,b):
+        if a is IDENTITY:
+            return b
+        if b is IDENTITY:
+            return a
+        self.products += 1
+        return _product(a,b)
+
+    @property
+    def nbytes(self):
+        '''Bytes held by the prefix and suffix products.'''
+        return nbytes(self._prefix)+nbytes(self._suffix)
+
+    def matrix(self,i):
+        material,n,d = self.layers[i]
+        key = (material,d,self.digest)
+        m = layer_cache.get(key)
+        if m is None:
+            m = characteristic_elements(_dispersive(n,self.lam),[d],self.n0,self.theta,self.lam)
+            for x in m:
+                x.setflags(write=False)
+            layer_cache.put(key,m)
+        return m
+
+    def splice(self,start,stop,layers):
+        '''Replace layers[start:stop] by `layers`.'''
+        count = len(self.layers)
+        self.layers[start:stop] = [(material,n,float(d)) for material,n,d in layers]
+        del self._prefix[start+1:]
+        del self._suffix[count-stop+1:]
+        self._cursor = start
+
+    def set(self,i,material,n,d):
+        self.splice(i,i+1,[(material,n,d)])
+
+    def insert(self,i,material,n,d):
+        self.splice(i,i,[(material,n,d)])
+
+    def delete(self,i):
+        self.splice(i,i+1,[])
+
+    def update(self,layers):
+        '''Change the stack to `layers`, splicing only the layers that differ.'''
+        layers = [(material,n,float(d)) for material,n,d in layers]
+        old = [(material,d) for material,_,d in self.layers]
+        new = [(material,d) for material,_,d in layers]
+        if old == new:
+            return
+        a = 0
+        while a < min(len(old),len(new)) and old[a] == new[a]:
+            a += 1
+        b = 0
+        while b < min(len(old),len(new))-a and old[-1-b] == new[-1-b]:
+            b += 1
+        self.splice(a,len(old)-b,layers[a:len(layers)-b])
+
+    def product(self):
+        '''(m11, m12, m21, m22) of the whole stack, first layer first.'''
+        count = len(self.layers)
+        a,b = len(self._prefix)-1,len(self._suffix)-1
+        if a+b >= count:
+            k = min(a,count)
+            return self._mul(self._prefix[k],self._suffix[count-k])
+        # fill the gap between the lists up to the last edited layer c
+        c = min(max(self._cursor,a),count-b-1)
+        for i in range(a,c):
+            self._prefix.append(self._mul(self._prefix[-1],self.matrix(i)))
+        for i in range(count-b-1,c,-1):
+            self._suffix.append(self._mul(self.matrix(i),self._suffix[-1]))
+        return self._mul(self._mul(self._prefix[c],self.matrix(c)),self._suffix[count-c-1])
+
+    def reversed(self):
+        '''Product of the layers in reverse order (incidence from the substrate).'''
+        return reversed_product(self.product())
+
+    def spectra(self,n1,n2,t_sub):
+        '''(r01, t01, r, t) as calc_spectra_batch for this stack on substrate n1
+        with exit medium n2 and no back coating.'''
+        n1,n2 = _dispersive(n1,self.lam),_dispersive(n2,self.lam)
+        spectra = spectra_from_products(self.product(),IDENTITY,self.n0,n1,n2,self.theta,t_sub,self.lam)
+        return tuple(_full(x,(1,self.theta.shape[0],2,len(self.lam))) for x in spectra)
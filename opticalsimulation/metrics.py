@@ -0,0 +1,183 @@
+import os
+import time
+import functools
+import threading
+import contextvars
+from collections import deque
+
+# Opt-in instrumentation
+#   Set OPTSIM_METRICS=1 (or call enable()) to collect per-stage timers, call
+#   counts, array sizes and database round trips. Everything is kept in one
+#   in-process registry; snapshot() returns it as plain dicts for the
+#   /debug/metrics endpoint and the /metrics page. Stages that run inside a
+#   traced Dash callback are also charged to that callback's record. When
+#   disabled, timer() returns a shared no-op context and timed() adds one
+#   attribute check per call.
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_null = _Null()
+
+class Registry:
+    def __init__(self,enabled=False,history=50):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.values = {}
+        self.callbacks = deque(maxlen=history)
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.values.clear()
+            self.callbacks.clear()
+
+    def add_time(self,name,seconds):
+        with self._lock:
+            entry = self.timers.get(name)
+            if entry is None:
+                self.timers[name] = [1,seconds,seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2],seconds)
+        record = _record.get()
+        if record is not None:
+            stages = record['stages']
+            stages[name] = stages.get(name,0.0)+seconds
+
+    def count(self,name,n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name,0)+n
+        record = _record.get()
+        if record is not None:
+            counters = record['counters']
+            counters[name] = counters.get(name,0)+n
+
+    def value(self,name,x):
+        # sizes and similar magnitudes: count, total and max
+        with self._lock:
+            entry = self.values.get(name)
+            if entry is None:
+                self.values[name] = [1,x,x]
+            else:
+                entry[0] += 1
+                entry[1] += x
+                entry[2] = max(entry[2],x)
+
+    def snapshot(self):
+        with self._lock:
+            return {'enabled':self.enabled,
+                    'timers':{name:{'count':c,'total':t,'mean':t/c,'max':m}
+                              for name,(c,t,m) in sorted(self.timers.items())},
+                    'counters':dict(sorted(self.counters.items())),
+                    'values':{name:{'count':c,'total':t,'mean':t/c,'max':m}
+                              for name,(c,t,m) in sorted(self.values.items())},
+                    'callbacks':list(self.callbacks)}
+
+registry = Registry(enabled=os.environ.get('OPTSIM_METRICS','') not in ('','0'))
+
+# record of the traced callback running in the current context
+_record = contextvars.ContextVar('metrics_record',default=None)
+
+def enable(flag=True):
+    registry.enabled = flag
+
+def enabled():
+    return registry.enabled
+
+def reset():
+    registry.reset()
+
+def snapshot():
+    return registry.snapshot()
+
+class _Timer:
+    __slots__ = ('name','start')
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        registry.add_time(self.name,time.perf_counter()-self.start)
+        return False
+
+def timer(name):
+    return _Timer(name) if registry.enabled else _null
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not registry.enabled:
+                return func(*args,**kwargs)
+            with _Timer(name):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def count(name,n=1):
+    if registry.enabled:
+        registry.count(name,n)
+
+def value(name,x):
+    if registry.enabled:
+        registry.value(name,x)
+
+def _payload(result):
+    # Dash serializes the callback outputs after we return; encode them once
+    # more here to see what that costs
+    from plotly.io.json import to_json_plotly
+    with _Timer('callback.serialize'):
+        size = len(to_json_plotly(result))
+    value('callback.payload_bytes',size)
+
+def traced(name):
+    '''Decorator for Dash callbacks: keeps a per-call record of stage times,
+    counters (e.g. database round trips) and the serialized output size.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not registry.enabled:
+                return func(*args,**kwargs)
+            record = {'name':name,'time':time.time(),'seconds':None,'stages':{},'counters':{}}
+            token = _record.set(record)
+            start = time.perf_counter()
+            try:
+                result = func(*args,**kwargs)
+                _payload(result)
+                return result
+            finally:
+                record['seconds'] = time.perf_counter()-start
+                _record.reset(token)
+                registry.add_time(name,record['seconds'])
+                with registry._lock:
+                    registry.callbacks.append(record)
+        return wrapper
+    return decorator
+
+def _before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+    if registry.enabled:
+        registry.count('db.round_trips')
+
+_installed = False
+
+def install_sqlalchemy():
+    '''Count every statement sent by any SQLAlchemy engine as db.round_trips.'''
+    global _installed
+    if not _installed:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine,'before_cursor_execute',_before_cursor_execute)
+        _installed = True
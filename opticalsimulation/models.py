@@ -1,31 +1,45 @@
-from sqlalchemy import Column, Integer, Float, String
+import numpy as np
+from sqlalchemy import Column, Integer, Float, String, LargeBinary, ForeignKey, JSON
 
 from opticalsimulation.settings import Base
 
 class Material(Base):
     __tablename__ = 'material'
+    # ids are never reused, so (count, max id) identifies the table contents for the caches in database.py
+    __table_args__ = {'sqlite_autoincrement':True}
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
+    # 'table' (n/k in dispersion) or a model of opticalsimulation.dispersion
+    kind = Column(String, nullable=False, default='table', server_default='table')
+    params = Column(JSON)
 
     def __repr__(self):
         return "<Material(name={})>".format(
             self.name,
         )
 
-class OpticalIndex(Base):
-    __tablename__ = 'opticalindex'
+def pack(values):
+    return np.ascontiguousarray(values,dtype='<f8').tobytes()
 
-    id = Column(Integer, primary_key=True)
-    material_id = Column(Integer)
-    wavelength = Column(Float)
-    n = Column(Float)
-    k = Column(Float)
+def unpack(blob):
+    return np.frombuffer(blob,dtype='<f8')
+
+class Dispersion(Base):
+    __tablename__ = 'dispersion'
+
+    material_id = Column(Integer, ForeignKey('material.id'), primary_key=True)
+    wl_min = Column(Float)
+    wl_max = Column(Float)
+    count = Column(Integer)
+    wavelength = Column(LargeBinary)
+    n = Column(LargeBinary)
+    k = Column(LargeBinary)
 
     def __repr__(self):
-        return "<Optical Index(material id={}, wavelength={}, n={}, k={})>".format(
+        return "<Dispersion(material id={}, wavelength={}-{}, count={})>".format(
             self.material_id,
-            self.wavelength,
-            self.n,
-            self.k
-        )
\ No newline at end of file
+            self.wl_min,
+            self.wl_max,
+            self.count
+        )
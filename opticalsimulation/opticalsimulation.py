@@ -1,7 +1,8 @@
 import numpy as np
-from copy import copy
 
-Y0 = np.sqrt(8.8541878128/1.25663706212)*1e-3
+from opticalsimulation import metrics
+
+Y0 = float(np.sqrt(8.8541878128/1.25663706212)*1e-3)
 
 def snell(n1,n0,theta):
     return np.arcsin(n0.real/n1.real*np.sin(theta))
@@ -34,25 +35,14 @@ def reflectance(param, eta0):
 #         mat = tuple(map(lambda m1,m2:np.dot(m1,m2),mat,characteristic_matrix(layer[lam],layer['d'],n0[lam],angle,lam)))
 #     return mat
 
-def calc_matrix(ns,ds,n0,n1,theta,lam):
-    length = len(lam)
-    eta = admittance(n1,n0,theta)
-    
-    v_s = tuple([np.array([np.ones(length),eta[0]]),
-                 np.array([np.ones(length),eta[1]])])
-    
-    mat = tuple([np.array([[np.ones(length),np.zeros(length)],[np.zeros(length),np.ones(length)]]),
-                 np.array([[np.ones(length),np.zeros(length)],[np.zeros(length),np.ones(length)]])])
-    for n,d in zip(ns,ds):
-        m = characteristic_matrix(n, d, n0,theta,lam)
-        mat = tuple([np.array([[mat[0][0,0]*m[0][0,0]+mat[0][0,1]*m[0][1,0], mat[0][0,0]*m[0][0,1]+mat[0][0,1]*m[0][1,1]],
-                               [mat[0][1,0]*m[0][0,0]+mat[0][1,1]*m[0][1,0], mat[0][1,0]*m[0][0,1]+mat[0][1,1]*m[0][1,1]]]),
-                     np.array([[mat[1][0,0]*m[1][0,0]+mat[1][0,1]*m[1][1,0], mat[1][0,0]*m[1][0,1]+mat[1][0,1]*m[1][1,1]],
-                               [mat[1][1,0]*m[1][0,0]+mat[1][1,1]*m[1][1,0], mat[1][1,0]*m[1][0,1]+mat[1][1,1]*m[1][1,1]]])])
-
-    param = tuple([np.array([[mat[0][0,0]*v_s[0][0]+mat[0][0,1]*v_s[0][1]],[mat[0][1,0]*v_s[0][0]+mat[0][1,1]*v_s[0][1]]]),
-                   np.array([[mat[1][0,0]*v_s[1][0]+mat[1][0,1]*v_s[1][1]],[mat[1][1,0]*v_s[1][0]+mat[1][1,1]*v_s[1][1]]])])
-    return param
+def calc_matrix(ns,ds,n0,n1,theta,lam,jacobian=False,index=False):
+    if not jacobian:
+        param = calc_matrix_batch(ns,ds,n0,n1,_per_wavelength(theta),lam)
+        return tuple(param[:,0,0,i,np.newaxis] for i in range(2))
+    # jacobian: {'d'|'n'|'k':(dR,dT)}, each (layer, polarization, wavelength)
+    param,jac = calc_jacobian_batch(ns,ds,n0,n1,_per_wavelength(theta),lam,index)
+    return (tuple(param[:,0,0,i,np.newaxis] for i in range(2)),
+            {key:(dr[:,0,0],dt[:,0,0]) for key,(dr,dt) in jac.items()})
 
 def transmittance(param,eta0,eta_s):
     def _transmittance(param,eta0,eta_s):
@@ -63,42 +53,400 @@ def absorb(n1,thickness,n0,theta,lam):
     phi = snell(n1,n0,theta)
     return np.exp(-8*np.pi*np.abs(n1.imag)*thickness*1000/(lam*np.cos(phi)))
 
-def calc_spectra(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub, lam):
-     f_ns = copy(front_ns)
-     f_ds = copy(front_ds)
-     b_ns = copy(back_ns)
-     b_ds = copy(back_ds)
-     
-     phi1 = snell(n1,n0,theta)
-     # phi2 = snell(n2,n0,theta)
-    
-     eta0 = admittance(n0,n0,theta)
-     eta1 = admittance(n1,n0,theta)
-     eta2 = admittance(n2,n0,theta)
-     
-     front_forward = calc_matrix(f_ns,f_ds,n0,n1,theta,lam)
-     f_ns.reverse()
-     f_ds.reverse()
-     front_backward = calc_matrix(f_ns,f_ds,n1,n0,phi1,lam)
-     
-     # back_forward = calc_matrix(b_ns,b_ds,n2,n1,phi2,lam)
-     b_ns.reverse()
-     b_ds.reverse()
-     back_backward = calc_matrix(b_ns,b_ds,n1,n2,phi1,lam)
-     
-     r01 = reflectance(front_forward,eta0)
-     r10 = reflectance(front_backward,eta1)
-     t01 = transmittance(front_forward,eta0,eta1)
-     t10 = transmittance(front_backward,eta1,eta0)
-     
-     r12 = reflectance(back_backward,eta1)
-     t12 = transmittance(back_backward,eta1,eta2) 
-
-     beta = absorb(n1,t_sub,n0,theta,lam)
-
-     r = (r01[0]+ (t01[0]*r12[0]*t10[0]*beta)/(1-r10[0]*r12[0]*beta), 
-          r01[1]+ (t01[1]*r12[1]*t10[1]*beta)/(1-r10[1]*r12[1]*beta))
-     t = (t01[0]*t12[0]*np.sqrt(beta)/(1-r10[0]*r12[0]*beta),
-          t01[1]*t12[1]*np.sqrt(beta)/(1-r10[1]*r12[1]*beta))
-
-     return (r01,t01,r,t)
\ No newline at end of file
+def calc_spectra(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub, lam, chunk=None, dtype=np.complex128):
+    if chunk is not None or dtype != np.complex128:
+        spectra = calc_spectra_chunked(n0,n1,n2,_per_wavelength(theta),front_ns,front_ds,back_ns,back_ds,t_sub,lam,
+                                       chunk or CHUNK,dtype)
+    else:
+        spectra = calc_spectra_batch(n0,n1,n2,_per_wavelength(theta),front_ns,front_ds,back_ns,back_ds,t_sub,lam)
+    return tuple(tuple(x[0,0]) for x in spectra)
+
+# Batched engine
+#   results are arrays shaped (batch, angle, polarization, wavelength),
+#   polarization axis is (s, p).
+
+def _per_wavelength(theta):
+    if np.ndim(theta) == 0:
+        return theta
+    return np.reshape(theta,(1,1,-1))
+
+def _real(x):
+    # float32 inputs stay float32 (chunked complex64 mode)
+    x = np.asarray(x)
+    return x if x.dtype.kind == 'f' else x.astype(float)
+
+def _angles(theta):
+    # (angle, 1, wavelength); (batch, 1, 1, 1) gives every batch entry its own angle
+    theta = _real(theta)
+    if theta.ndim >= 3:
+        return theta
+    return np.reshape(theta,(-1,1,1) if theta.ndim < 2 else (theta.shape[0],1,-1))
+
+def _thicknesses(ds,count):
+    ds = _real(ds)
+    if ds.ndim == 2:
+        return ds
+    return np.reshape(ds,(-1,count)) if count else np.zeros((1,0))
+
+def _dispersive(n,lam):
+    # analytic dispersion models (opticalsimulation.dispersion) are callables of the wavelength
+    return n(lam) if callable(n) else n
+
+def _batch(x):
+    x = _real(x)
+    return np.reshape(x,(-1,1,1,1)) if x.ndim else x
+
+def admittance_batch(n1,n0,theta):
+    phi = snell(np.asarray(n1),np.asarray(n0),theta)
+    return np.concatenate(np.broadcast_arrays(Y0*n1*np.cos(phi),Y0*n1/np.cos(phi)),axis=-2)
+
+def _product(a,b):
+    return (a[0]*b[0]+a[1]*b[2], a[0]*b[1]+a[1]*b[3],
+            a[2]*b[0]+a[3]*b[2], a[2]*b[1]+a[3]*b[3])
+
+def characteristic_elements(n,d,n0,theta,lam):
+    phi = snell(np.asarray(n),np.asarray(n0),theta)
+    eta = admittance_batch(n,n0,theta)
+    delta = phasedifference(n,_batch(d),phi,lam)
+    c = np.cos(delta)
+    s = np.sin(delta)
+    return (c, 1j*s/eta, 1j*s*eta, c)
+
+def characteristic_product(ns,ds,n0,theta,lam):
+    mat = (1,0,0,1)
+    for i,n in enumerate(ns):
+        mat = _product(mat,characteristic_elements(n,ds[:,i],n0,theta,lam))
+    return mat
+
+def reversed_product(mat):
+    # every layer matrix has equal diagonal elements (P M^T P = M with P = [[0,1],[1,0]]),
+    # so the layers multiplied in reverse order give the product with its diagonal swapped
+    return (mat[3],mat[1],mat[2],mat[0])
+
+def characteristic_param(mat,eta):
+    return (mat[0]+mat[1]*eta, mat[2]+mat[3]*eta)
+
+@metrics.timed('calc_matrix')
+def calc_matrix_batch(ns,ds,n0,n1,theta,lam):
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n1 = _dispersive(n0,lam),_dispersive(n1,lam)
+    theta = _angles(theta)
+    ds = _thicknesses(ds,len(ns))
+    mat = characteristic_product(ns,ds,n0,theta,lam)
+    eta = admittance_batch(n1,n0,theta)
+    param = characteristic_param(mat,eta)
+    shape = np.broadcast_shapes((ds.shape[0],theta.shape[0],2,len(lam)),*[np.shape(p) for p in param])
+    metrics.value('calc_matrix.layers',len(ns))
+    metrics.value('calc_matrix.points',int(np.prod(shape)))
+    return np.array([np.broadcast_to(p,shape) for p in param])
+
+def reflectance_batch(param,eta0):
+    return np.abs((eta0*param[0]-param[1])/(eta0*param[0]+param[1]))**2
+
+def transmittance_batch(param,eta0,eta_s):
+    return 4*eta0.real*eta_s.real/np.abs(eta0*param[0]+param[1])**2
+
+@metrics.timed('calc_spectra')
+def calc_spectra_batch(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam):
+    front_ns = [_dispersive(n,lam) for n in front_ns]
+    back_ns = [_dispersive(n,lam) for n in back_ns]
+    n0,n1,n2 = (_dispersive(n,lam) for n in (n0,n1,n2))
+    theta = _angles(theta)
+    front_ds = _thicknesses(front_ds,len(front_ns))
+    back_ds = _thicknesses(back_ds,len(back_ns))
+    front = characteristic_product(front_ns,front_ds,n0,theta,lam)
+    back = characteristic_product(back_ns,back_ds,n0,theta,lam)
+    shape = (max(front_ds.shape[0],back_ds.shape[0]),theta.shape[-3],2,len(lam))
+    return tuple(_full(x,shape) for x in spectra_from_products(front,back,n0,n1,n2,theta,t_sub,lam))
+
+def _full(x,shape):
+    # empty stacks leave the batch axis out
+    shape = np.broadcast_shapes(np.shape(x),shape)
+    return x if np.shape(x) == shape else np.broadcast_to(x,shape).copy()
+
+def spectra_from_products(front,back,n0,n1,n2,theta,t_sub,lam):
+    '''calc_spectra_batch from the characteristic matrix products of the front
+    and back stacks, layers multiplied in list order. The substrate side
+    views of both stacks are their reversed products.'''
+    eta0 = admittance_batch(n0,n0,theta)
+    eta1 = admittance_batch(n1,n0,theta)
+    eta2 = admittance_batch(n2,n0,theta)
+
+    front_forward = characteristic_param(front,eta1)
+    front_backward = characteristic_param(reversed_product(front),eta0)
+    back_backward = characteristic_param(reversed_product(back),eta2)
+
+    r01 = reflectance_batch(front_forward,eta0)
+    r10 = reflectance_batch(front_backward,eta1)
+    t01 = transmittance_batch(front_forward,eta0,eta1)
+    t10 = transmittance_batch(front_backward,eta1,eta0)
+
+    r12 = reflectance_batch(back_backward,eta1)
+    t12 = transmittance_batch(back_backward,eta1,eta2)
+
+    beta = absorb(n1,_batch(t_sub),n0,theta,lam)
+
+    r = r01 + (t01*r12*t10*beta)/(1-r10*r12*beta)
+    t = t01*t12*np.sqrt(beta)/(1-r10*r12*beta)
+    return (r01,t01,r,t)
+
+# Chunked evaluation of very large grids
+#   calc_spectra_chunked runs calc_spectra_batch on consecutive slices of the
+#   wavelength axis and writes into preallocated (batch, angle, polarization,
+#   wavelength) outputs, so the temporaries of the matrix products scale with
+#   `chunk` instead of the grid. Callable indices are evaluated per chunk.
+#   In complex64 every input is cast once per chunk and the whole chain stays
+#   in single precision (outputs float32). Its error grows with the number of
+#   layers and their optical thickness (about 1e-6 for 2 layers, 2e-5 for 20
+#   and 2e-4 for 100 quarter-wave-like layers in R and T), so before a complex64
+#   run a strided sample of the grid is evaluated in both precisions and the
+#   run falls back to complex128 when the difference exceeds `tolerance`.
+
+CHUNK = 8192        # wavelengths per chunk, a few MB of temporaries per layer
+CHECK_POINTS = 512
+
+def _slice(x,sl,length,lam,dtype):
+    if callable(x):
+        return np.asarray(x(lam[sl]),dtype=dtype)
+    x = np.asarray(x)
+    if x.ndim and x.shape[-1] == length:
+        x = x[...,sl]
+    return x.astype(dtype,copy=False) if dtype == np.complex64 else x
+
+def _chunk_args(sl,n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam,dtype):
+    real = np.float32 if dtype == np.complex64 else np.float64
+    length = len(lam)
+    index = lambda n:_slice(n,sl,length,lam,dtype)
+    theta = np.asarray(theta)
+    if theta.ndim == 3 and theta.shape[-1] == length:
+        theta = theta[...,sl]
+    return (index(n0),index(n1),index(n2),theta.astype(real),[index(n) for n in front_ns],_real(front_ds).astype(real),
+            [index(n) for n in back_ns],_real(back_ds).astype(real),_real(t_sub).astype(real),lam[sl].astype(real))
+
+def precision_error(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam,dtype=np.complex64,points=CHECK_POINTS):
+    '''Largest |difference| of R and T between dtype and complex128 on a strided
+    sample of at most `points` wavelengths.'''
+    lam = np.asarray(lam,dtype=float)
+    sl = slice(None,None,max(1,len(lam)//points))
+    args = (n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam)
+    low = calc_spectra_batch(*_chunk_args(sl,*args,dtype))
+    high = calc_spectra_batch(*_chunk_args(sl,*args,np.complex128))
+    return max(float(np.nanmax(np.abs(a-b),initial=0)) for a,b in zip(low,high))
+
+@metrics.timed('calc_spectra_chunked')
+def calc_spectra_chunked(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam,chunk=CHUNK,dtype=np.complex128,
+                         out=None,tolerance=1e-4):
+    '''calc_spectra_batch evaluated `chunk` wavelengths at a time into `out`
+    (four float arrays shaped (batch, angle, polarization, wavelength), allocated
+    if None). dtype=np.complex64 halves the memory when precision_error stays
+    within `tolerance` (tolerance=None skips the check).'''
+    lam = np.asarray(lam,dtype=float)
+    args = (n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam)
+    if dtype == np.complex64 and tolerance is not None and precision_error(*args) > tolerance:
+        metrics.count('calc_spectra_chunked.fallback')
+        dtype = np.complex128
+    first = calc_spectra_batch(*_chunk_args(slice(0,min(chunk,len(lam))),*args,dtype))
+    if out is None:
+        real = np.float32 if dtype == np.complex64 else np.float64
+        out = tuple(np.empty(x.shape[:-1]+(len(lam),),dtype=real) for x in first)
+    for start in range(0,len(lam),chunk):
+        sl = slice(start,start+chunk)
+        spectra = first if start == 0 else calc_spectra_batch(*_chunk_args(sl,*args,dtype))
+        for o,x in zip(out,spectra):
+            o[...,sl] = x
+    metrics.value('calc_spectra_chunked.points',len(lam))
+    return out
+
+# Mixed coherent/incoherent stacks
+#   Layers flagged incoherent (thick substrates, laminates) split the stack
+#   into coherent groups. Every group between incoherent media a and b is
+#   reduced to intensity R/T from both sides and combined with the intensity
+#   matrix method (Katsidis and Siapkas, Appl. Opt. 41, 3978 (2002)):
+#     I_ab = 1/T_ab [[1, -R_ba], [R_ab, T_ab T_ba - R_ab R_ba]],  P = diag(1/tau, tau)
+#   The matrices are kept scaled by T_ab and tau so that opaque layers give
+#   T = 0 instead of inf/inf. All thicknesses are in nm here.
+
+def _attenuation(n,d,n0,theta,lam):
+    # single pass intensity transmission of an incoherent layer
+    phi = snell(np.asarray(n),np.asarray(n0),theta)
+    return np.exp(-4*np.pi*np.abs(np.imag(n))*_batch(d)/(lam*np.cos(phi)))
+
+def _intensity_groups(ns,coherent):
+    # -> incoherent layer indices, coherent layer indices between consecutive media
+    media = [i for i,c in enumerate(coherent) if not c]
+    bounds = [-1]+media+[len(ns)]
+    return media,[list(range(a+1,b)) for a,b in zip(bounds[:-1],bounds[1:])]
+
+def calc_stack_batch(n0,n_exit,theta,ns,ds,coherent,lam):
+    '''R and T of layers ns/ds (nm) between two semi-infinite media, with
+    coherent[i] False for layers to be treated incoherently. Returns (R, T)
+    shaped (batch, angle, polarization, wavelength).'''
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n_exit = _dispersive(n0,lam),_dispersive(n_exit,lam)
+    theta = _angles(theta)
+    ds = _thicknesses(ds,len(ns))
+    coherent = list(coherent) if coherent is not None else [True]*len(ns)
+    media,groups = _intensity_groups(ns,coherent)
+    indexes = [n0]+[ns[i] for i in media]+[n_exit]
+    angles = [theta]+[snell(np.asarray(ns[i]),np.asarray(n0),theta) for i in media]+[None]
+    angles[-1] = snell(np.asarray(n_exit),np.asarray(n0),theta)
+
+    mat = (1,0,0,1)
+    scale = 1
+    for g,group in enumerate(groups):
+        na,nb = indexes[g],indexes[g+1]
+        phia,phib = angles[g],angles[g+1]
+        etaa = admittance_batch(na,na,phia)
+        etab = admittance_batch(nb,nb,phib)
+        gns = [ns[i] for i in group]
+        gds = ds[:,group]
+        forward = calc_matrix_batch(gns,gds,na,nb,phia,lam)
+        backward = calc_matrix_batch(gns[::-1],gds[:,::-1],nb,na,phib,lam)
+        rf,tf = reflectance_batch(forward,etaa),transmittance_batch(forward,etaa,etab)
+        rb,tb = reflectance_batch(backward,etab),transmittance_batch(backward,etab,etaa)
+        mat = _product(mat,(1,-rb,rf,tf*tb-rf*rb))
+        scale = scale*tf
+        if g < len(media):
+            i = media[g]
+            tau = _attenuation(ns[i],ds[:,i],n0,theta,lam)
+            mat = _product(mat,(1,0,0,tau**2))
+            scale = scale*tau
+    shape = (ds.shape[0],theta.shape[0],2,len(lam))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        r = np.broadcast_to(np.where(mat[0] != 0,mat[2]/mat[0],0),shape)
+        t = np.broadcast_to(np.where(mat[0] != 0,scale/mat[0],0),shape)
+    return r,t
+
+def calc_stack(n0,n_exit,theta,ns,ds,coherent,lam):
+    r,t = calc_stack_batch(n0,n_exit,_per_wavelength(theta),ns,ds,coherent,lam)
+    return tuple(r[0,0]),tuple(t[0,0])
+
+# Jacobians
+#   suffix[i] holds M_i...M_N [1,eta_s] so that the derivative for layer i
+#   is prefix_i dM_i suffix[i+1], O(N) per wavelength. Derivatives with
+#   respect to n and k are taken per wavelength, i.e. dR(lam)/dn_i(lam).
+#   calc_spectra_jacobian keeps the suffix products as matrices: the
+#   derivative of the reversed product is the reversed derivative, which
+#   gives r10/t10 for the incoherent substrate terms without a second pass.
+
+def _apply(m,v):
+    return (m[0]*v[0]+m[1]*v[1], m[2]*v[0]+m[3]*v[1])
+
+def _wavenumber(n,n0,theta,lam):
+    phi = snell(np.asarray(n),np.asarray(n0),theta)
+    return 2*np.pi*n*np.cos(phi)/lam
+
+def _matrix_derivative(c,s,eta,ddelta,deta):
+    return (-s*ddelta, 1j*(c*ddelta/eta-s*deta/eta**2), 1j*(c*ddelta*eta+s*deta), -s*ddelta)
+
+def characteristic_derivatives(n,d,n0,theta,lam,index=False):
+    n = np.asarray(n)
+    phi = snell(n,np.asarray(n0),theta)
+    cos = np.cos(phi)
+    eta = admittance_batch(n,n0,theta)
+    k = 2*np.pi*n*cos/lam
+    d = _batch(d)
+    delta = k*d
+    c = np.cos(delta)
+    s = np.sin(delta)
+    derivatives = {'d':_matrix_derivative(c,s,eta,k,0)}
+    if index:
+        dcos = np.sin(phi)**2/(n.real*cos)
+        deta = np.concatenate(np.broadcast_arrays(Y0*(cos+n*dcos),Y0*(1/cos-n*dcos/cos**2)),axis=-2)
+        derivatives['n'] = _matrix_derivative(c,s,eta,2*np.pi*d*(cos+n*dcos)/lam,deta)
+        deta = np.concatenate(np.broadcast_arrays(-1j*Y0*cos,-1j*Y0/cos),axis=-2)
+        derivatives['k'] = _matrix_derivative(c,s,eta,-2j*np.pi*d*cos/lam,deta)
+    return derivatives
+
+def suffix_vectors(ms,eta):
+    suffix = [(1,eta)]
+    for m in reversed(ms):
+        suffix.append(_apply(m,suffix[-1]))
+    suffix.reverse()
+    return suffix
+
+def reflectance_derivative(param,dparam,eta0):
+    y = eta0*param[0]+param[1]
+    r = (eta0*param[0]-param[1])/y
+    dr = 2*eta0*(dparam[0]*param[1]-param[0]*dparam[1])/y**2
+    return 2*np.real(np.conj(r)*dr)
+
+def transmittance_derivative(param,dparam,eta0,eta_s):
+    y = eta0*param[0]+param[1]
+    dy = eta0*dparam[0]+dparam[1]
+    t = transmittance_batch(param,eta0,eta_s)
+    return -2*t*np.real(np.conj(y)*dy)/np.abs(y)**2
+
+def calc_jacobian_batch(ns,ds,n0,n1,theta,lam,index=False):
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n1 = _dispersive(n0,lam),_dispersive(n1,lam)
+    theta = _angles(theta)
+    ds = _thicknesses(ds,len(ns))
+    eta0 = admittance_batch(n0,n0,theta)
+    eta_s = admittance_batch(n1,n0,theta)
+    ms = [characteristic_elements(n,ds[:,i],n0,theta,lam) for i,n in enumerate(ns)]
+    suffix = suffix_vectors(ms,eta_s)
+    shape = np.broadcast_shapes((ds.shape[0],theta.shape[0],2,len(lam)),*[np.shape(p) for p in suffix[0]])
+    param = np.array([np.broadcast_to(p,shape) for p in suffix[0]])
+    jacobian = {key:(np.zeros((len(ns),)+shape),np.zeros((len(ns),)+shape))
+                for key in (('d','n','k') if index else ('d',))}
+    prefix = (1,0,0,1)
+    for i,n in enumerate(ns):
+        for key,dm in characteristic_derivatives(n,ds[:,i],n0,theta,lam,index).items():
+            dparam = _apply(prefix,_apply(dm,suffix[i+1]))
+            jacobian[key][0][i] = reflectance_derivative(param,dparam,eta0)
+            jacobian[key][1][i] = transmittance_derivative(param,dparam,eta0,eta_s)
+        prefix = _product(prefix,ms[i])
+    return param,jacobian
+
+def calc_spectra_jacobian(n0,n1,n2,theta,ns,ds,t_sub,lam):
+    '''(r01, t01, r, t) of calc_spectra_batch for a front stack without back
+    coating, and their derivatives by the layer thicknesses, each shaped
+    (layer, batch, angle, polarization, wavelength).'''
+    ns = [_dispersive(n,lam) for n in ns]
+    n0,n1,n2 = (_dispersive(n,lam) for n in (n0,n1,n2))
+    theta = _angles(theta)
+    ds = _thicknesses(ds,len(ns))
+    eta0,eta1,eta2 = (admittance_batch(n,n0,theta) for n in (n0,n1,n2))
+    ms = [characteristic_elements(n,ds[:,i],n0,theta,lam) for i,n in enumerate(ns)]
+    suffix = [(1,0,0,1)]
+    for m in reversed(ms):
+        suffix.append(_product(m,suffix[-1]))
+    suffix.reverse()
+
+    forward = characteristic_param(suffix[0],eta1)
+    backward = characteristic_param(reversed_product(suffix[0]),eta0)
+    r01,t01 = reflectance_batch(forward,eta0),transmittance_batch(forward,eta0,eta1)
+    r10,t10 = reflectance_batch(backward,eta1),transmittance_batch(backward,eta1,eta0)
+    r12,t12 = reflectance_batch((1,eta2),eta1),transmittance_batch((1,eta2),eta1,eta2)
+    beta = absorb(n1,_batch(t_sub),n0,theta,lam)
+    denominator = 1-r10*r12*beta
+    r = r01+t01*r12*t10*beta/denominator
+    t = t01*t12*np.sqrt(beta)/denominator
+
+    shape = (ds.shape[0],theta.shape[-3],2,len(lam))
+    jacobian = np.zeros((4,len(ns))+shape)
+    prefix = (1,0,0,1)
+    for i,n in enumerate(ns):
+        dm = characteristic_derivatives(n,ds[:,i],n0,theta,lam)['d']
+        dmat = _product(prefix,_product(dm,suffix[i+1]))
+        dforward = characteristic_param(dmat,eta1)
+        dbackward = characteristic_param(reversed_product(dmat),eta0)
+        dr01 = reflectance_derivative(forward,dforward,eta0)
+        dt01 = transmittance_derivative(forward,dforward,eta0,eta1)
+        dr10 = reflectance_derivative(backward,dbackward,eta1)
+        dt10 = transmittance_derivative(backward,dbackward,eta1,eta0)
+        dr = dr01+r12*beta*(dt01*t10+t01*dt10+t01*t10*r12*beta*dr10/denominator)/denominator
+        dt = t12*np.sqrt(beta)*(dt01+t01*r12*beta*dr10/denominator)/denominator
+        for j,x in enumerate((dr01,dt01,dr,dt)):
+            jacobian[j,i] = x
+        prefix = _product(prefix,ms[i])
+    return tuple(np.broadcast_to(x,shape) for x in (r01,t01,r,t)),tuple(jacobian)
+
+def calc_gradient_batch(ns,ds,n0,n1,theta,lam):
+    param,jacobian = calc_jacobian_batch(ns,ds,n0,n1,theta,lam)
+    n0,n1 = _dispersive(n0,lam),_dispersive(n1,lam)
+    theta = _angles(theta)
+    eta0 = admittance_batch(n0,n0,theta)
+    eta_s = admittance_batch(n1,n0,theta)
+    return (reflectance_batch(param,eta0),transmittance_batch(param,eta0,eta_s))+jacobian['d']
@@ -0,0 +1,72 @@
+import threading
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from opticalsimulation.cache import LRUCache
+
+# Background computation for the Dash pages
+#   Requests are identified by a session id and a hashable key. Results are
+#   memoized by key, identical keys share one computation, and a newer request
+#   from the same session cancels the older one if it has not started yet (or
+#   makes the older caller return Superseded once it finishes). The latest key
+#   is kept for the `sessions` most recently active sessions; a request of a
+#   session dropped from there returns Superseded.
+
+# every value of the main page angle slider (0-89.9 deg, 0.1 deg steps)
+ANGLES = np.arange(900)/10
+
+def angle_index(angle):
+    return int(np.clip(round(angle*10),0,len(ANGLES)-1))
+
+class Superseded(Exception):
+    pass
+
+class ComputeService:
+    def __init__(self,workers=2,maxsize=16,sessions=4096,maxbytes=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers,thread_name_prefix='compute')
+        self.cache = LRUCache(maxsize=maxsize,maxbytes=maxbytes)
+        self._lock = threading.Lock()
+        self._latest = LRUCache(maxsize=sessions)
+        self._running = {}
+
+    def _release(self,key,future):
+        with self._lock:
+            entry = self._running.get(key)
+            if entry is not None and entry[0] is future:
+                entry[1] -= 1
+                if entry[1] == 0 or future.done():
+                    del self._running[key]
+
+    def get(self,session,key,compute):
+        result = self.cache.get(key)
+        with self._lock:
+            previous = self._latest.get(session)
+            self._latest.put(session,key)
+            if previous is not None and previous != key and previous in self._running:
+                future,waiting = self._running[previous]
+                if waiting == 1 and future.cancel():
+                    del self._running[previous]
+            if result is not None:
+                return result
+            if key in self._running:
+                self._running[key][1] += 1
+                future = self._running[key][0]
+            else:
+                # copy the context so stage timers reach the caller's metrics record
+                future = self.executor.submit(contextvars.copy_context().run,compute)
+                self._running[key] = [future,1]
+        try:
+            result = future.result()
+        except CancelledError:
+            raise Superseded()
+        finally:
+            self._release(key,future)
+        self.cache.put(key,result)
+        if self._latest.get(session) != key:
+            raise Superseded()
+        return result
+
+    def forget(self,session):
+        with self._lock:
+            self._latest.invalidate(lambda s:s == session)
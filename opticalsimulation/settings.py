@@ -1,11 +1,32 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+import os
+import pathlib
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import declarative_base
+
+# データベースの URL (環境変数 OPTSIM_DATABASE_URL で変更できる)
+#   The default is test.db in the repository root, independent of the working directory.
+path = os.environ.get('OPTSIM_DATABASE_URL',
+                      'sqlite:///{}'.format(pathlib.Path(__file__).resolve().parent.parent/'test.db'))
+
+def _sqlite_pragmas(dbapi_connection,connection_record):
+    # WAL lets readers run while a writer commits; writers wait instead of failing with "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.close()
+
+def create(url,echo=False):
+    if url.startswith('sqlite'):
+        engine = create_engine(url,echo=echo,connect_args={'check_same_thread':False,'timeout':30})
+        event.listen(engine,'connect',_sqlite_pragmas)
+    else:
+        engine = create_engine(url,echo=echo,pool_size=5,max_overflow=10,pool_pre_ping=True,pool_recycle=3600)
+    return engine
 
-path = 'sqlite:///test.db'
- 
 # Engine の作成
-Engine = create_engine(
-  path,
-  echo=False
-)
-Base = declarative_base()
\ No newline at end of file
+Engine = create(path)
+# pooled connections must not be shared with forked worker processes
+if hasattr(os,'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda:Engine.dispose(close=False))
+Base = declarative_base()
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import uuid
+import hashlib
+import pathlib
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from opticalsimulation.opticalsimulation import calc_spectra_batch
+
+# Parameter sweeps with an on-disk result store
+#   A sweep evaluates R and T on the product grid of its axes: layer
+#   thicknesses 'd0', 'd1', ... (nm, counted from the incident side), the
+#   incidence angle 'angle' (deg) and the substrate thickness 't_sub' (um).
+#   Parameters without an axis keep their nominal value. Grid points are
+#   numbered in C order and split into chunks of `chunk` points; each chunk is
+#   one batched calc_spectra_batch call in a worker process, saved as
+#   R-<chunk>.npy and T-<chunk>.npy (point, polarization, wavelength; float32)
+#   next to meta.json. Chunk files are renamed into place when complete, so an
+#   interrupted sweep resumes by skipping the chunks already on disk.
+#   SweepStore reads slices of the grid lazily from memory-mapped chunks.
+
+QUANTITIES = ('R','T')
+SWEEP_DIR = pathlib.Path(os.environ.get('OPTSIM_SWEEP_DIR',pathlib.Path(__file__).resolve().parent.parent/'sweeps'))
+
+def _check_axes(axes,layers,t_sub):
+    names = ['d{}'.format(i) for i in range(layers)]+['angle','t_sub']
+    for name,values in axes:
+        if name not in names:
+            raise ValueError('unknown sweep axis: {} (use {})'.format(name,', '.join(names)))
+        if name == 't_sub' and t_sub is None:
+            raise ValueError('a t_sub axis needs a nominal substrate thickness')
+        if len(values) == 0:
+            raise ValueError('axis {} has no values'.format(name))
+    if len({name for name,_ in axes}) != len(axes):
+        raise ValueError('duplicate sweep axis')
+
+def _fingerprint(ns,ds,n1,lam,axes,theta,t_sub,chunk):
+    h = hashlib.blake2b(digest_size=16)
+    for x in [lam,n1,ds]+list(ns)+[values for _,values in axes]:
+        h.update(np.ascontiguousarray(x).tobytes())
+    h.update(json.dumps([[name for name,_ in axes],theta,t_sub,chunk]).encode())
+    return h.hexdigest()
+
+_worker = {}
+
+def _attach(path,ns,ds,n1,lam,axes,theta,t_sub,chunk):
+    _worker.update(path=pathlib.Path(path),ns=ns,ds=ds,n1=n1,lam=lam,axes=axes,theta=theta,t_sub=t_sub,chunk=chunk)
+
+def _save(path,x):
+    temp = path.with_name(path.name+'.'+uuid.uuid4().hex)
+    with open(temp,'wb') as f:
+        np.save(f,x)
+    os.replace(temp,path)
+
+def evaluate(points,ns,ds,n1,lam,axes,theta,t_sub):
+    '''R and T (point, polarization, wavelength) at flat grid indices `points`.'''
+    shape = tuple(len(values) for _,values in axes)
+    index = np.unravel_index(points,shape)
+    ds = np.tile(np.asarray(ds,dtype=float),(len(points),1))
+    angle = np.full(len(points),float(theta))
+    sub = np.full(len(points),1.0 if t_sub is None else float(t_sub))
+    for (name,values),i in zip(axes,index):
+        if name == 'angle':
+            angle = values[i]
+        elif name == 't_sub':
+            sub = values[i]
+        else:
+            ds[:,int(name[1:])] = values[i]
+    r01,t01,r,t = calc_spectra_batch(1,n1,1,np.radians(angle).reshape(-1,1,1,1),ns,ds,[],[],sub,lam)
+    if t_sub is None:
+        r,t = r01,t01
+    return r[:,0].astype(np.float32),t[:,0].astype(np.float32)
+
+def _evaluate(index):
+    w = _worker
+    points = np.arange(index*w['chunk'],min((index+1)*w['chunk'],int(np.prod([len(v) for _,v in w['axes']]))))
+    r,t = evaluate(points,w['ns'],w['ds'],w['n1'],w['lam'],w['axes'],w['theta'],w['t_sub'])
+    _save(w['path']/'T-{:06d}.npy'.format(index),t)
+    _save(w['path']/'R-{:06d}.npy'.format(index),r)
+    return index
+
+def iter_sweep(path,ns,ds,n1,lam,axes,theta=0.0,t_sub=None,chunk=1024,workers=None,names=None):
+    '''Run the sweep into directory `path`, yielding (chunks done, chunks) as
+    chunks finish. An existing store of the same sweep is resumed; a store of
+    a different sweep raises ValueError.'''
+    path = pathlib.Path(path)
+    lam = np.asarray(lam,dtype=float)
+    ns = [np.asarray(n,dtype=complex)*np.ones(len(lam)) for n in ns]
+    n1 = np.asarray(n1,dtype=complex)*np.ones(len(lam))
+    ds = np.asarray(ds,dtype=float)
+    axes = [(name,np.asarray(values,dtype=float)) for name,values in axes]
+    _check_axes(axes,len(ns),t_sub)
+    fingerprint = _fingerprint(ns,ds,n1,lam,axes,theta,t_sub,chunk)
+    meta = {'fingerprint':fingerprint,'axes':[{'name':name,'values':values.tolist()} for name,values in axes],
+            'layers':names or ['d{}'.format(i) for i in range(len(ns))],'thickness':ds.tolist(),
+            'angle':theta,'t_sub':t_sub,'chunk':chunk,'wavelength':lam.tolist(),'quantities':QUANTITIES}
+    if (path/'meta.json').exists():
+        if json.loads((path/'meta.json').read_text())['fingerprint'] != fingerprint:
+            raise ValueError('{} holds a different sweep'.format(path))
+    else:
+        path.mkdir(parents=True,exist_ok=True)
+        (path/'meta.json').write_text(json.dumps(meta))
+    store = SweepStore(path)
+    todo = [i for i in range(store.chunks) if i not in store.done()]
+    done = store.chunks-len(todo)
+    yield done,store.chunks
+    args = (str(path),ns,ds,n1,lam,axes,theta,t_sub,chunk)
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(todo) <= 1:
+        _attach(*args)
+        for index in todo:
+            _evaluate(index)
+            done += 1
+            yield done,store.chunks
+        return
+    executor = ProcessPoolExecutor(max_workers=workers,initializer=_attach,initargs=args)
+    try:
+        tasks = iter(todo)
+        pending = set()
+        while True:
+            for index in tasks:
+                pending.add(executor.submit(_evaluate,index))
+                if len(pending) >= 2*workers:
+                    break
+            if not pending:
+                break
+            finished,pending = wait(pending,return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done += 1
+            yield done,store.chunks
+    finally:
+        executor.shutdown(wait=True,cancel_futures=True)
+
+def sweep(path,ns,ds,n1,lam,axes,**kwargs):
+    for _ in iter_sweep(path,ns,ds,n1,lam,axes,**kwargs):
+        pass
+    return SweepStore(path)
+
+class SweepStore:
+    '''Read access to a sweep directory; missing chunks read as nan.'''
+    def __init__(self,path):
+        self.path = pathlib.Path(path)
+        self.meta = json.loads((self.path/'meta.json').read_text())
+        self.axes = [(axis['name'],np.array(axis['values'])) for axis in self.meta['axes']]
+        self.shape = tuple(len(values) for _,values in self.axes)
+        self.wavelength = np.array(self.meta['wavelength'])
+        self.chunk = self.meta['chunk']
+        self.points = int(np.prod(self.shape))
+        self.chunks = -(-self.points//self.chunk)
+
+    def axis(self,name):
+        return dict(self.axes)[name]
+
+    def done(self):
+        # T is written before R, so an R file marks a complete chunk
+        return {int(p.stem.split('-')[1]) for p in self.path.glob('R-*.npy')}
+
+    def progress(self):
+        return len(self.done())/self.chunks
+
+    def select(self,quantity='R',polarization='average',wavelength=slice(None),**index):
+        '''Values of quantity on the grid, each axis indexed by an int, a
+        slice or a list of indices (default all), e.g. select('R', wavelength=20,
+        angle=0). Shaped (non-int axes..., wavelengths).'''
+        unknown = set(index)-{name for name,_ in self.axes}
+        if unknown:
+            raise KeyError('unknown sweep axis: {}'.format(', '.join(sorted(unknown))))
+        keep = []
+        lists = []
+        for name,values in self.axes:
+            selection = index.get(name,slice(None))
+            positions = np.arange(len(values))[selection]
+            keep.append(np.ndim(positions) > 0)
+            lists.append(np.atleast_1d(positions))
+        flat = np.ravel_multi_index(np.ix_(*lists),self.shape)
+        columns = np.atleast_1d(np.arange(len(self.wavelength))[wavelength])
+        result = np.full(flat.shape+(len(columns),),np.nan,dtype=np.float32)
+        done = self.done()
+        for c in np.unique(flat//self.chunk):
+            if c not in done:
+                continue
+            mask = flat//self.chunk == c
+            data = np.load(self.path/'{}-{:06d}.npy'.format(quantity,c),mmap_mode='r')
+            rows = data[flat[mask]-c*self.chunk][:,:,columns]
+            if polarization == 's':
+                result[mask] = rows[:,0]
+            elif polarization == 'p':
+                result[mask] = rows[:,1]
+            else:
+                result[mask] = rows.mean(axis=1)
+        result = result.reshape(tuple(len(l) for l,k in zip(lists,keep) if k)+(len(columns),))
+        return result if np.ndim(np.arange(len(self.wavelength))[wavelength]) else result[...,0]
+
+def stores(directory=None):
+    '''Sweep directories under `directory` (default SWEEP_DIR), newest first.'''
+    directory = pathlib.Path(directory or SWEEP_DIR)
+    paths = [p.parent for p in directory.glob('*/meta.json')]
+    return sorted(paths,key=lambda p:(p/'meta.json').stat().st_mtime,reverse=True)
+
+def _axis(text):
+    # d0=50:150:51 (start:end:count) or angle=0,15,30
+    name,values = text.split('=',1)
+    if ':' in values:
+        start,end,count = values.split(':')
+        return name,np.linspace(float(start),float(end),int(count))
+    return name,np.array([float(v) for v in values.split(',')])
+
+def main(argv=None):
+    from opticalsimulation.tolerance import _load_stack
+    parser = argparse.ArgumentParser(description='Sweep layer thicknesses, angle and substrate thickness')
+    parser.add_argument('--substrate',required=True)
+    parser.add_argument('--layer',action='append',default=[],metavar='NAME:THICKNESS')
+    parser.add_argument('--substrate-thickness',type=float,metavar='UM')
+    parser.add_argument('--angle',type=float,default=0.0,metavar='DEG')
+    parser.add_argument('--axis',action='append',type=_axis,required=True,metavar='NAME=START:END:COUNT')
+    parser.add_argument('--step',type=float,default=10)
+    parser.add_argument('--chunk',type=int,default=1024)
+    parser.add_argument('--workers',type=int)
+    parser.add_argument('-o','--output',required=True,help='sweep directory (re-run to resume)')
+    args = parser.parse_args(argv)
+
+    names = [layer.rsplit(':',1)[0] for layer in args.layer]
+    ds = [float(layer.rsplit(':',1)[1]) for layer in args.layer]
+    lam,n1,ns = _load_stack(names,args.substrate,args.step)
+    try:
+        for done,total in iter_sweep(args.output,ns,ds,n1,lam,args.axis,theta=args.angle,
+                                     t_sub=args.substrate_thickness,chunk=args.chunk,workers=args.workers,
+                                     names=names):
+            print('\r{}/{} chunks'.format(done,total),end='',file=sys.stderr)
+        print(file=sys.stderr)
+    except KeyboardInterrupt:
+        print('\nstopped, run again to resume',file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
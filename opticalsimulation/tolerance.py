@@ -0,0 +1,186 @@
+import os
+import sys
+import argparse
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from opticalsimulation.opticalsimulation import (_angles,admittance_batch,calc_matrix_batch,calc_spectra_batch,
+                                                 reflectance_batch,transmittance_batch)
+
+# Monte Carlo tolerance analysis
+#   Every sample perturbs the thickness of each layer by N(0, sigma_d) nm and
+#   scales its refractive index by 1+N(0, sigma_n). Workers read the n/k arrays
+#   from one shared memory block and send back per-wavelength histograms of
+#   R and T, so the parent keeps O(wavelength x bins) state for any sample count.
+
+QUANTITIES = ('R','T')
+
+def _share(arrays):
+    size = sum(a.nbytes for a in arrays)
+    shm = shared_memory.SharedMemory(create=True,size=max(size,1))
+    layout = []
+    offset = 0
+    for a in arrays:
+        np.ndarray(a.shape,dtype=a.dtype,buffer=shm.buf,offset=offset)[...] = a
+        layout.append((offset,a.shape,a.dtype.str))
+        offset += a.nbytes
+    return shm,layout
+
+_worker = {}
+
+def _attach(name,layout,options):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['arrays'] = [np.ndarray(shape,dtype=dtype,buffer=shm.buf,offset=offset)
+                         for offset,shape,dtype in layout]
+    _worker['options'] = options
+
+def _polarize(x,polarization):
+    if polarization == 's':
+        return x[:,:,0]
+    if polarization == 'p':
+        return x[:,:,1]
+    return x.mean(axis=2)
+
+def _histogram(x,bins):
+    # x: (sample, wavelength) in [0,1] -> counts (wavelength, bins)
+    length = x.shape[1]
+    index = np.clip((x*bins).astype(int),0,bins-1)+np.arange(length)*bins
+    return np.bincount(index.ravel(),minlength=length*bins).reshape(length,bins)
+
+def evaluate(seed,count,lam,n1,ns,ds,theta,t_sub,sigma_d,sigma_n,polarization,bins):
+    rng = np.random.default_rng(seed)
+    ds = np.clip(ds+sigma_d*rng.standard_normal((count,len(ds))),0,None)
+    scale = 1+sigma_n*rng.standard_normal((count,len(ns)))
+    ns = [n*scale[:,i].reshape(-1,1,1,1) for i,n in enumerate(ns)]
+    if t_sub is None:
+        angles = _angles(theta)
+        param = calc_matrix_batch(ns,ds,1,n1,angles,lam)
+        eta0 = admittance_batch(1,1,angles)
+        r = reflectance_batch(param,eta0)
+        t = transmittance_batch(param,eta0,admittance_batch(n1,1,angles))
+    else:
+        _,_,r,t = calc_spectra_batch(1,n1,1,theta,ns,ds,[],[],t_sub,lam)
+    x = np.array([_polarize(r,polarization).mean(axis=1),_polarize(t,polarization).mean(axis=1)])
+    return (count,np.array([_histogram(q,bins) for q in x]),x.sum(axis=1),(x**2).sum(axis=1))
+
+def _evaluate(seed,count):
+    lam,n1,ds,*ns = _worker['arrays']
+    return evaluate(seed,count,lam,n1,ns,ds,**_worker['options'])
+
+def percentiles(counts,ps):
+    # counts: (..., bins) -> (len(ps), ...)
+    bins = counts.shape[-1]
+    cdf = np.cumsum(counts,axis=-1)
+    total = cdf[...,-1:]
+    result = []
+    for p in ps:
+        target = p/100*total
+        index = np.argmax(cdf >= target,axis=-1)[...,np.newaxis]
+        previous = np.where(index > 0,np.take_along_axis(cdf,np.maximum(index-1,0),axis=-1),0)
+        width = np.maximum(np.take_along_axis(counts,index,axis=-1),1)
+        result.append(((index+(target-previous)/width)/bins)[...,0])
+    return np.array(result)
+
+def _snapshot(lam,samples,counts,total,square,ps):
+    mean = total/samples
+    return {'wavelength':lam,'samples':samples,'quantities':QUANTITIES,
+            'mean':mean,'std':np.sqrt(np.maximum(square/samples-mean**2,0)),
+            'percentiles':dict(zip(ps,percentiles(counts,ps)))}
+
+def iter_tolerance(ns,ds,n1,lam,theta=0.0,t_sub=None,sigma_d=1.0,sigma_n=0.0,samples=10000,chunk=256,
+                   workers=None,percentile=(5,50,95),polarization='average',bins=1000,seed=None):
+    '''Yield a statistics snapshot after every finished chunk of samples.
+    Closing the generator (e.g. breaking out of the loop) cancels the
+    remaining chunks.'''
+    lam = np.asarray(lam,dtype=float)
+    arrays = [lam,np.asarray(n1,dtype=complex)*np.ones(len(lam)),np.asarray(ds,dtype=float)]
+    arrays += [np.asarray(n,dtype=complex)*np.ones(len(lam)) for n in ns]
+    options = {'theta':np.atleast_1d(theta),'t_sub':t_sub,'sigma_d':np.asarray(sigma_d,dtype=float),
+               'sigma_n':np.asarray(sigma_n,dtype=float),'polarization':polarization,'bins':bins}
+    sizes = [min(chunk,samples-start) for start in range(0,samples,chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    counts = np.zeros((len(QUANTITIES),len(lam),bins),dtype=np.int64)
+    total = np.zeros((len(QUANTITIES),len(lam)))
+    square = np.zeros((len(QUANTITIES),len(lam)))
+    done = 0
+
+    shm,layout = _share(arrays)
+    workers = workers or os.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=workers,initializer=_attach,initargs=(shm.name,layout,options))
+    try:
+        tasks = iter(zip(seeds,sizes))
+        pending = set()
+        while True:
+            for s,size in tasks:
+                pending.add(executor.submit(_evaluate,s,size))
+                if len(pending) >= 2*workers:
+                    break
+            if not pending:
+                break
+            finished,pending = wait(pending,return_when=FIRST_COMPLETED)
+            for future in finished:
+                count,c,t,q = future.result()
+                done += count
+                counts += c
+                total += t
+                square += q
+            yield _snapshot(lam,done,counts,total,square,percentile)
+    finally:
+        executor.shutdown(wait=True,cancel_futures=True)
+        shm.close()
+        shm.unlink()
+
+def tolerance_analysis(ns,ds,n1,lam,**kwargs):
+    snapshot = None
+    for snapshot in iter_tolerance(ns,ds,n1,lam,**kwargs):
+        pass
+    return snapshot
+
+def _load_stack(names,substrate,step):
+    import opticalsimulation.database as db
+    from opticalsimulation.grid import uniform
+    ids = {name:id for id,name in db.get_material_list()}
+    missing = [name for name in names+[substrate] if name not in ids]
+    if missing:
+        raise SystemExit('unknown material: {}'.format(', '.join(missing)))
+    lam,(n1,*ns) = db.resolve_stack([ids[substrate]]+[ids[name] for name in names],uniform(step))
+    return lam,n1,ns
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo tolerance analysis of a layer stack')
+    parser.add_argument('--substrate',required=True)
+    parser.add_argument('--layer',action='append',default=[],metavar='NAME:THICKNESS')
+    parser.add_argument('--substrate-thickness',type=float,metavar='UM')
+    parser.add_argument('--angle',type=float,default=0.0,metavar='DEG')
+    parser.add_argument('--step',type=float,default=10)
+    parser.add_argument('--sigma-d',type=float,default=1.0,metavar='NM')
+    parser.add_argument('--sigma-n',type=float,default=0.0)
+    parser.add_argument('--samples',type=int,default=10000)
+    parser.add_argument('--chunk',type=int,default=256)
+    parser.add_argument('--workers',type=int)
+    parser.add_argument('--seed',type=int)
+    parser.add_argument('--output',help='write the final statistics to an .npz file')
+    args = parser.parse_args(argv)
+
+    names = [layer.rsplit(':',1)[0] for layer in args.layer]
+    ds = [float(layer.rsplit(':',1)[1]) for layer in args.layer]
+    lam,n1,ns = _load_stack(names,args.substrate,args.step)
+    snapshot = None
+    try:
+        for snapshot in iter_tolerance(ns,ds,n1,lam,theta=args.angle*np.pi/180,t_sub=args.substrate_thickness,
+                                       sigma_d=args.sigma_d,sigma_n=args.sigma_n,samples=args.samples,
+                                       chunk=args.chunk,workers=args.workers,seed=args.seed):
+            band = snapshot['percentiles'][95]-snapshot['percentiles'][5]
+            print('{:>9d} samples  R 5-95% band max {:.4f}  T 5-95% band max {:.4f}'.format(
+                snapshot['samples'],band[0].max(),band[1].max()),file=sys.stderr)
+    except KeyboardInterrupt:
+        print('stopped',file=sys.stderr)
+    if snapshot is not None and args.output:
+        np.savez(args.output,wavelength=snapshot['wavelength'],samples=snapshot['samples'],
+                 mean=snapshot['mean'],std=snapshot['std'],
+                 **{'p{}'.format(p):v for p,v in snapshot['percentiles'].items()})
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,32 @@
-import requests
 import dash
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import opticalsimulation.database as db
-from dash import html,dcc,dash_table,Input,Output,State,ctx,callback
+import opticalsimulation.figures as fg
+import opticalsimulation.downloader as dl
+from opticalsimulation import metrics
+from dash import html,dcc,dash_table,Input,Output,State,ctx,callback,clientside_callback
 
 dash.register_page(__name__,path='/nk')
 
+SOURCE = 'https://www.filmetricsinc.jp/technology/refractive-index-database/download'
+
 layout = dbc.Container([
     html.H2("Optical Index Database"),
     html.Hr(),
     dbc.Alert('Illigal URL',id='url_alert',is_open=False,duration=2000),
+    dcc.Store(id='nk-plot-width'),
+    dcc.Store(id='import_job'),
+    dcc.Interval(id='import_interval',interval=500,disabled=True),
     dbc.Col(dcc.Graph(id='nk_graph')),
     dbc.Row([
-        dbc.Col([dbc.Input(id='input_url',placeholder='Input URL',type='url')]),
+        dbc.Col([dbc.Textarea(id='input_url',placeholder='Input URLs (one per line)')]),
         dbc.Col([dbc.Button('Load',id='input_button',color='primary',n_clicks=0)]),
     ]),
     html.Br(),
+    dbc.Progress(id='import_progress',value=0,label=''),
+    html.Div(id='import_errors'),
+    html.Br(),
     dash_table.DataTable(id='material_list_table',
                          data = [],
                          columns=[{"id":"name","name":"Material"}],
@@ -26,39 +36,63 @@ layout = dbc.Container([
 ])
 
 @callback(
-    Output('material_list_table','data'),
+    Output('import_job','data'),
     Output('input_url','value'),
     Output('url_alert','is_open'),
+    Output('import_interval','disabled'),
     Input('input_button','n_clicks'),
-    State('input_url','value')
+    State('input_url','value'),
+    prevent_initial_call=True
+)
+@metrics.traced('callback.load_new_material')
+def load_new_material(n_clicks,text):
+    # the download runs as a background job, import_interval polls it
+    urls = (text or '').split()
+    if not urls or any(url.rsplit('/',1)[0] != SOURCE for url in urls):
+        return dash.no_update,text,True,True
+    return dl.start_import(urls),'',False,False
+
+@callback(
+    Output('material_list_table','data'),
+    Output('import_progress','value'),
+    Output('import_progress','label'),
+    Output('import_errors','children'),
+    Output('import_interval','disabled',allow_duplicate=True),
+    Input('import_interval','n_intervals'),
+    Input('import_job','data'),
+    prevent_initial_call='initial_duplicate'
+)
+def poll_import(n_intervals,job):
+    status = dl.job_status(job) if job else None
+    materials = [{'id':d[0],'name':d[1]} for d in db.get_material_list()]
+    if status is None:
+        return materials,0,'',[],True
+    running = status['state'] in ('queued','running')
+    if running and ctx.triggered_id == 'import_interval':
+        materials = dash.no_update      # the table changes only when the job finishes
+    progress = 100*status['done']/max(status['total'],1)
+    label = '{}/{}'.format(status['done'],status['total'])
+    errors = [html.Div('{} {}'.format(url or '',error)) for url,error in status['failed']]
+    return materials,progress,label,errors,not running
+
+clientside_callback(
+    'function(url) {return window.innerWidth;}',
+    Output('nk-plot-width','data'),
+    Input('input_url','id')
 )
-def load_new_material(n_clicks,url):
-    is_open = False
-    if 'input_button' == ctx.triggered_id:
-        if url.rsplit('/',1)[0] == 'https://www.filmetricsinc.jp/technology/refractive-index-database/download':
-            try:
-                db.add_opticalindex(url)
-            except requests.exceptions.RequestException as e:
-                is_open = True
-        else:
-            is_open = True
-    return [{'id':d[0],'name':d[1]} for d in db.get_material_list()],'',is_open
 
 @callback(
     Output('nk_graph','figure'),
     Output('material_list_table','selected_rows'),
     Input('material_list_table','selected_rows'),
-    State('material_list_table','data')
+    State('material_list_table','data'),
+    State('nk-plot-width','data')
 )
-def show_selected_nk(selected_rows,tbl):
+@metrics.traced('callback.show_selected_nk')
+def show_selected_nk(selected_rows,tbl,width):
     if tbl:
         id = tbl[selected_rows[0]]['id']
-        nks = db.get_opticalindex(id)
-        ns = [nk.real for nk in nks[1]]
-        ks = [-nk.imag for nk in nks[1]]
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(x=nks[0],y=ns,mode='lines',name='n'))
-        fig.add_trace(go.Scatter(x=nks[0],y=ks,mode='lines',name='k'))
-        return fig,selected_rows
+        ws,nks = db.get_opticalindex(id)
+        return fg.nk_figure(ws,nks,width),selected_rows
     else:
         return go.Figure(),[]
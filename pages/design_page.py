@@ -0,0 +1,132 @@
+import dash
+import dash_bootstrap_components as dbc
+import plotly.graph_objects as go
+import numpy as np
+from dash import html,dcc,callback,Input,Output,State,dash_table
+
+import opticalsimulation.database as db
+import opticalsimulation.opticalsimulation as op
+import opticalsimulation.design as ds
+import opticalsimulation.grid as grid
+from opticalsimulation import metrics
+
+dash.register_page(__name__,path='/design')
+
+
+def serve_layout():
+    materials = [{'label':mat[1],'value':mat[0]} for mat in db.get_material_list()]
+    layout = dbc.Container([
+        html.H2('Design'),
+        dbc.Row(
+        [
+            dbc.Col([
+                dcc.Graph(id='design-graph'),
+                dbc.Label(id='design-merit'),
+            ]),
+            dbc.Col([
+                html.Div([
+                    dbc.Label('Target'),
+                    dbc.RadioItems(id='design-quantity',options=[{'label':'Reflectance','value':'R'},
+                                                                 {'label':'Transmittance','value':'T'}],
+                                   value='R',inline=True),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Value'),
+                        dbc.Input(id='design-target',type='number',min=0,max=100,value=0),
+                        dbc.InputGroupText('%')
+                    ]),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Wavelength'),
+                        dbc.Input(id='design-wl-min',type='number',min=0,value=400),
+                        dbc.Input(id='design-wl-max',type='number',min=0,value=700),
+                        dbc.InputGroupText('nm')
+                    ], style={'padding-top':10}),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Angle'),
+                        dbc.Input(id='design-angle',type='number',min=0,max=89.9,value=0),
+                        dbc.InputGroupText('deg')
+                    ], style={'padding-top':10}),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Needles'),
+                        dbc.Input(id='design-needles',type='number',min=0,step=1,value=0),
+                    ], style={'padding-top':10}),
+                ]),
+                html.Br(),
+                html.Div([
+                    dbc.Label('Layers'),
+                    dash_table.DataTable(id='design-table-layer',
+                                         data=[],
+                                         columns=[{'id':'id','name':'Material','presentation':'dropdown'},
+                                                  {'id':'thickness','name':'Thickness','type':'numeric'}],
+                                         style_header={'textAlign':'left'},
+                                         style_cell={'height':0},
+                                         editable=True,
+                                         row_deletable=True,
+                                         dropdown={'id':{'options':materials}}
+                    ),
+                    html.Div([dbc.Button('Add Layer',id='design-button-add-layer',n_clicks=0,style={'margin-top':10})],
+                             className="d-md-flex justify-content-md-end"),
+                ]),
+                html.Br(),
+                html.Div([
+                    dbc.Label('Substrate'),
+                    dcc.Dropdown(id='design-substrate',options=materials),
+                ]),
+                html.Br(),
+                html.Div([dbc.Button('Optimize',id='design-button-optimize',n_clicks=0,color='primary')],
+                         className="d-md-flex justify-content-md-end"),
+            ],width=3)
+        ]
+        )
+    ])
+    return layout
+
+layout = serve_layout
+
+@callback(
+    Output('design-table-layer','data'),
+    Output('design-graph','figure'),
+    Output('design-merit','children'),
+    Input('design-button-optimize','n_clicks'),
+    Input('design-button-add-layer','n_clicks'),
+    State('design-table-layer','data'),
+    State('design-table-layer','columns'),
+    State('design-substrate','value'),
+    State('design-quantity','value'),
+    State('design-target','value'),
+    State('design-wl-min','value'),
+    State('design-wl-max','value'),
+    State('design-angle','value'),
+    State('design-needles','value'),
+)
+@metrics.traced('callback.optimize_design')
+def optimize_design(n_optimize,n_add,layers,columns,substrate,quantity,target,wl_start,wl_end,angle,needles):
+    if dash.ctx.triggered_id == 'design-button-add-layer':
+        layers.append({c['id']:'' for c in columns})
+        return layers,dash.no_update,dash.no_update
+    layers = [layer for layer in layers if layer['id'] != '' and layer['thickness'] != '']
+    if dash.ctx.triggered_id != 'design-button-optimize' or substrate is None or not layers:
+        return layers,go.Figure(),''
+
+    ids = list(dict.fromkeys(layer['id'] for layer in layers))
+    try:
+        wl,(n1,*nks) = db.resolve_stack([substrate]+ids,grid.uniform(5))
+    except ValueError as e:
+        return layers,go.Figure(),str(e)
+    indexes = dict(zip(ids,nks))
+    weight = ((wl >= (wl_start or 0)) & (wl <= (wl_end or np.inf))).astype(float)
+    if not weight.any():
+        return layers,go.Figure(),'Target wavelength is outside {:.0f}-{:.0f} nm'.format(*db.common_range([substrate]+ids))
+
+    materials,thicknesses,value = ds.design([layer['id'] for layer in layers],
+                                            [layer['thickness'] for layer in layers],
+                                            indexes,1,n1,wl,(target or 0)/100,theta=(angle or 0)*np.pi/180,
+                                            quantity=quantity,weight=weight,candidates=ids,needles=needles or 0)
+
+    r,t,_,_ = op.calc_spectra(1,n1,1,(angle or 0)*np.pi/180,[indexes[m] for m in materials],list(thicknesses),
+                              [],[],1,wl)
+    x = r if quantity == 'R' else t
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=wl,y=(x[0]+x[1])/2,mode='lines',name='average'))
+    fig.add_trace(go.Scatter(x=wl,y=np.where(weight > 0,(target or 0)/100,np.nan),mode='lines',name='target'))
+    data = [{'id':m,'thickness':round(float(d),2)} for m,d in zip(materials,thicknesses)]
+    return data,fig,'Merit: {:.3e}  Layers: {}'.format(value,len(data))
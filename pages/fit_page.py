@@ -0,0 +1,174 @@
+import os
+import base64
+import threading
+import dash
+import dash_bootstrap_components as dbc
+import plotly.graph_objects as go
+import numpy as np
+from dash import html,dcc,callback,Input,Output,State,dash_table
+
+import opticalsimulation.database as db
+import opticalsimulation.fitting as ft
+from opticalsimulation import metrics
+
+dash.register_page(__name__,path='/fit')
+
+# one process pool shared by every fit request, OPTSIM_FIT_WORKERS processes (default 2), started on first use
+FIT_WORKERS = int(os.environ.get('OPTSIM_FIT_WORKERS',min(2,os.cpu_count() or 1)))
+_pool = None
+_pool_lock = threading.Lock()
+
+def fit_pool(broken=None):
+    '''The shared pool; a new one replaces `broken`, a pool that raised BrokenProcessPool.'''
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool is broken:
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(max_workers=FIT_WORKERS)
+        return _pool
+
+
+def serve_layout():
+    materials = [{'label':mat[1],'value':mat[0]} for mat in db.get_material_list()]
+    layout = dbc.Container([
+        html.H2('Fit'),
+        dbc.Row(
+        [
+            dbc.Col([
+                dcc.Graph(id='fit-graph'),
+                dbc.Label(id='fit-message'),
+                dash_table.DataTable(id='fit-table-result',data=[],columns=[],style_cell={'textAlign':'left'},
+                                     page_size=20),
+            ]),
+            dbc.Col([
+                html.Div([
+                    dcc.Upload(html.Div(['Drop or ',html.A('select'),' measured spectra']),id='fit-upload',
+                               multiple=True,style={'borderWidth':'1px','borderStyle':'dashed','borderRadius':'5px',
+                                                    'textAlign':'center','padding':10}),
+                    dbc.Label(id='fit-files'),
+                ]),
+                html.Div([
+                    dbc.RadioItems(id='fit-quantity',options=[{'label':'Reflectance','value':'R'},
+                                                              {'label':'Transmittance','value':'T'}],
+                                   value='R',inline=True),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Angle'),
+                        dbc.Input(id='fit-angle',type='number',min=0,max=89.9,value=0),
+                        dbc.InputGroupText('deg')
+                    ], style={'padding-top':10}),
+                    dbc.Checklist(id='fit-index',options=[{'label':'Fit n/k scale','value':'index'}],value=[],
+                                  style={'padding-top':10}),
+                ]),
+                html.Br(),
+                html.Div([
+                    dbc.Label('Layers'),
+                    dash_table.DataTable(id='fit-table-layer',
+                                         data=[],
+                                         columns=[{'id':'id','name':'Material','presentation':'dropdown'},
+                                                  {'id':'thickness','name':'Thickness','type':'numeric'}],
+                                         style_header={'textAlign':'left'},
+                                         style_cell={'height':0},
+                                         editable=True,
+                                         row_deletable=True,
+                                         dropdown={'id':{'options':materials}}
+                    ),
+                    html.Div([dbc.Button('Add Layer',id='fit-button-add-layer',n_clicks=0,style={'margin-top':10})],
+                             className="d-md-flex justify-content-md-end"),
+                ]),
+                html.Br(),
+                html.Div([
+                    dbc.Label('Substrate'),
+                    dcc.Dropdown(id='fit-substrate',options=materials),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Thcikness'),
+                        dbc.Input(id='fit-substrate-thickness',type='number',min=0),
+                        dbc.InputGroupText('um')
+                    ], style={'padding-top':10}),
+                ]),
+                html.Br(),
+                html.Div([dbc.Button('Fit',id='fit-button-fit',n_clicks=0,color='primary')],
+                         className="d-md-flex justify-content-md-end"),
+            ],width=3)
+        ]
+        )
+    ])
+    return layout
+
+layout = serve_layout
+
+@callback(
+    Output('fit-table-layer','data'),
+    Input('fit-button-add-layer','n_clicks'),
+    State('fit-table-layer','data'),
+    State('fit-table-layer','columns')
+)
+def add_fit_layer(n_clicks,data,columns):
+    if n_clicks > 0:
+        data.append({c['id']:'' for c in columns})
+    return data
+
+@callback(
+    Output('fit-files','children'),
+    Input('fit-upload','filename')
+)
+def show_files(filenames):
+    return ', '.join(filenames or [])
+
+def _decode(contents):
+    return base64.b64decode(contents.split(',',1)[1]).decode(errors='replace')
+
+@callback(
+    Output('fit-graph','figure'),
+    Output('fit-message','children'),
+    Output('fit-table-result','data'),
+    Output('fit-table-result','columns'),
+    Input('fit-button-fit','n_clicks'),
+    State('fit-upload','contents'),
+    State('fit-upload','filename'),
+    State('fit-table-layer','data'),
+    State('fit-substrate','value'),
+    State('fit-substrate-thickness','value'),
+    State('fit-quantity','value'),
+    State('fit-angle','value'),
+    State('fit-index','value'),
+)
+@metrics.traced('callback.fit_measurement')
+def fit_measurement(n_clicks,contents,filenames,layers,substrate,thickness,quantity,angle,index):
+    layers = [layer for layer in layers if layer['id'] != '' and layer['thickness'] != '']
+    if not n_clicks or not contents or substrate is None or not layers:
+        return go.Figure(),'',[],[]
+    try:
+        measurements = [ft.read_measurement(_decode(c)) for c in contents]
+        lam = measurements[0][0]
+        if any(len(w) != len(lam) or np.any(w != lam) for w,_ in measurements):
+            return go.Figure(),'All files of a lot need the same wavelengths',[],[]
+        problem,keep = ft.stack_problem([layer['id'] for layer in layers],substrate,lam,quantity=quantity,
+                                        theta=(angle or 0)*np.pi/180,t_sub=thickness,fit_index='index' in index)
+    except ValueError as e:
+        return go.Figure(),str(e),[],[]
+    values = np.array([np.atleast_2d(v)[0][keep] for _,v in measurements])
+    ds = [layer['thickness'] for layer in layers]
+    if len(values) > 1 and FIT_WORKERS > 1:
+        from concurrent.futures.process import BrokenProcessPool
+        pool = fit_pool()
+        try:
+            results = ft.fit_lot(problem,values,ds,workers=FIT_WORKERS,executor=pool)
+        except BrokenProcessPool:
+            # a worker died and the pool stays broken, fit again on a new one
+            results = ft.fit_lot(problem,values,ds,workers=FIT_WORKERS,executor=fit_pool(pool))
+    else:
+        results = ft.fit_lot(problem,values,ds,workers=1)
+
+    names = [db.get_material_name(layer['id']) for layer in layers]
+    columns = [{'id':'file','name':'File'}]+[{'id':str(i),'name':'{} {}'.format(i+1,name)}
+                                             for i,name in enumerate(names)]+[{'id':'rms','name':'RMS'}]
+    data = []
+    for filename,result in zip(filenames,results):
+        row = {'file':filename,'rms':'{:.2e}'.format(result['rms'])}
+        for i,(d,s) in enumerate(zip(result['thickness'],result['scale'])):
+            row[str(i)] = '{:.2f} nm'.format(d)+(' x{:.4f}'.format(s) if problem.fit_index else '')
+        data.append(row)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=problem.lam,y=values[0],mode='markers',name='measured'))
+    fig.add_trace(go.Scatter(x=problem.lam,y=results[0]['spectrum'][0],mode='lines',name='fitted'))
+    return fig,'{} part(s) fitted'.format(len(results)),data,columns
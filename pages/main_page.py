@@ -1,17 +1,37 @@
+import os
+import uuid
 import dash
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import numpy as np
-from dash import html,dcc,callback,Input,Output,State,dash_table
+from dash import html,dcc,callback,clientside_callback,Input,Output,State,dash_table
+from dash.exceptions import PreventUpdate
 
 import opticalsimulation.database as db
-import opticalsimulation.opticalsimulation as op
+import opticalsimulation.figures as fg
+import opticalsimulation.grid as grid
+import opticalsimulation.angular as angular
+from opticalsimulation import metrics
+from opticalsimulation.cache import LRUCache
+from opticalsimulation.incremental import StackEvaluator,fingerprint
+from opticalsimulation.service import ComputeService,Superseded,ANGLES,angle_index
 
 dash.register_page(__name__,path='/')
 
+# spectra of every slider angle per stack, bounded by OPTSIM_SPECTRA_CACHE_MB megabytes
+SPECTRA_BYTES = int(float(os.environ.get('OPTSIM_SPECTRA_CACHE_MB',128))*2**20)
+service = ComputeService(maxbytes=SPECTRA_BYTES)
+# incremental evaluators keyed by (session, digest of angles and grid), so a table edit only redoes the
+# edited layer; bounded by OPTSIM_EVALUATOR_CACHE_MB megabytes of held products
+EVALUATOR_BYTES = int(float(os.environ.get('OPTSIM_EVALUATOR_CACHE_MB',256))*2**20)
+evaluators = LRUCache(maxsize=1024,maxbytes=EVALUATOR_BYTES)
+
 
 def serve_layout():
+    materials = [{'label':mat[1],'value':mat[0]} for mat in db.get_material_list()]
     layout = dbc.Container([
+        dcc.Store(id='session-id',data=str(uuid.uuid4())),
+        dcc.Store(id='plot-width'),
         html.H2('Spectra'),
         dbc.Row(
         [
@@ -26,6 +46,11 @@ def serve_layout():
                 html.Div([
                     dbc.Label(id='label-angle'),
                     dcc.Slider(id='slider-angle',min=0,max=89.9,step=0.1,value=0,marks={0:'0',5:'5',12:'12',45:'45'}),
+                    dbc.InputGroup([
+                        dbc.InputGroupText('Cone half-angle'),
+                        dbc.Input(id='cone-angle',type='number',min=0,max=45,step=0.1,value=0),
+                        dbc.InputGroupText('deg')
+                    ]),
                 ]),
                 html.Br(),
                 html.Div([
@@ -43,7 +68,7 @@ def serve_layout():
                                          row_deletable=True,
                                          dropdown={
                                             'id':{
-                                                'options':[{'label':mat[1],'value':mat[0]} for mat in db.get_material_list()]
+                                                'options':materials
                                             }
                                          }
                     ),
@@ -53,7 +78,7 @@ def serve_layout():
                 html.Br(),
                 html.Div([
                     dbc.Label('Substrate'),
-                    dcc.Dropdown(id='substrate',options=[{'label':mat[1],'value':mat[0]} for mat in db.get_material_list()]),
+                    dcc.Dropdown(id='substrate',options=materials),
                     dbc.InputGroup([
                         dbc.InputGroupText('Thcikness'),
                         dbc.Input(id='substrate-thickness',type='number',min=0),
@@ -77,58 +102,82 @@ layout = serve_layout
     Input('slider-angle','value'),
     Input('substrate','value'),
     Input('substrate-thickness','value'),
-    Input('table-layer','data')
+    Input('table-layer','data'),
+    Input('plot-width','data'),
+    Input('cone-angle','value'),
+    State('session-id','data')
 )
-def update_spectra(angle,substrate,thickness,layers):
+@metrics.traced('callback.update_spectra')
+def update_spectra(angle,substrate,thickness,layers,width,cone,session):
     fig_ref1 = go.Figure()
     fig_ref2 = go.Figure()
     fig_trans = go.Figure()
-    ns = []
-    ds = []
+    if cone and angle+cone >= 90:
+        message = fg.message_figure('The cone must stay below 90 deg incidence')
+        return 'Incident Angle: {:.1f}'.format(angle),message,message,message
     if substrate is not None:
-        step=10
-        wl_min,wl_max = db.get_range(substrate)
-        if layers is not None:
-            for layer in layers:
-                if layer['id']  != '' and layer['thickness'] != '':
-                    a_min,a_max = db.get_range(layer['id'])
-                    wl_min = max(wl_min,a_min)
-                    wl_max = min(wl_max,a_max)
-            wl = np.arange(wl_min,wl_max,step)
-            for layer in layers:
-                if layer['id']  != '' and layer['thickness'] != '':
-                    ns.append(db.fitted_opticalindex(layer['id'],wl_min,wl_max,step))
-                    ds.append(layer['thickness'])
+        stack = tuple((layer['id'],layer['thickness']) for layer in layers or []
+                      if layer['id']  != '' and layer['thickness'] != '')
+        try:
+            if cone:
+                # converging beam around the slider angle
+                axis = ANGLES[angle_index(angle)]
+                wl,spectra = service.get(session,(stack,substrate,thickness,'cone',axis,cone),
+                                         lambda:calc_cone(stack,substrate,thickness,axis,cone,session))
+            else:
+                # every slider angle at once, moving the slider only indexes the cached spectra
+                wl,spectra = service.get(session,(stack,substrate,thickness),
+                                         lambda:calc_angle_family(stack,substrate,thickness,session))
+                spectra = tuple(x[angle_index(angle)] for x in spectra)
+        except Superseded:
+            raise PreventUpdate
+        ref1,trans_front,ref2,trans = spectra
+        fig_ref1 = fg.spectra_figure(wl,ref1,width)
+        if thickness is None:
+            fig_trans = fg.spectra_figure(wl,trans_front,width)
+            fig_ref2 = fg.message_figure('Enter the substrate thickness to include the back reflection')
         else:
-            wl = np.arange(wl_min,wl_max,step)
-        n1 = db.fitted_opticalindex(substrate,wl_min,wl_max,step)
-        n0=1
-        n2=1
-        if thickness is not None:            
-            ref1,_,ref2,trans = op.calc_spectra(n0,n1,n2,angle*np.pi/180 ,ns,ds,[],[],thickness,wl)
-            fig_ref1.add_trace(go.Scatter(x=wl,y=(ref1[0]+ref1[1])/2, mode='lines',name='average'))
-            fig_ref1.add_trace(go.Scatter(x=wl,y=ref1[0], mode='lines',name='s-polarized'))
-            fig_ref1.add_trace(go.Scatter(x=wl,y=ref1[1], mode='lines',name='p-polarized'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=(trans[0]+trans[1])/2, mode='lines',name='average'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=trans[0], mode='lines',name='s-polarized'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=trans[1], mode='lines',name='p-polarized'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=(ref2[0]+ref2[1])/2, mode='lines',name='average'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=ref2[0], mode='lines',name='s-polarized'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=ref2[1], mode='lines',name='p-polarized'))
-        else:
-            thickness=1
-            ref1,trans,_,_ = op.calc_spectra(n0,n1,n2,angle*np.pi/180 ,ns,ds,[],[],thickness,wl)
-            fig_ref1.add_trace(go.Scatter(x=wl,y=(ref1[0]+ref1[1])/2, mode='lines',name='average'))
-            fig_ref1.add_trace(go.Scatter(x=wl,y=ref1[0], mode='lines',name='s-polarized'))
-            fig_ref1.add_trace(go.Scatter(x=wl,y=ref1[1], mode='lines',name='p-polarized'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=(trans[0]+trans[1])/2, mode='lines',name='average'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=trans[0], mode='lines',name='s-polarized'))
-            fig_trans.add_trace(go.Scatter(x=wl,y=trans[1], mode='lines',name='p-polarized'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=(ref1[0]+ref1[1])/2, mode='lines',name='average'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=ref1[0], mode='lines',name='s-polarized'))
-            fig_ref2.add_trace(go.Scatter(x=wl,y=ref1[1], mode='lines',name='p-polarized'))
+            fig_trans = fg.spectra_figure(wl,trans,width)
+            fig_ref2 = fg.spectra_figure(wl,ref2,width)
     return 'Incident Angle: {:.1f}'.format(angle),fig_ref1,fig_trans,fig_ref2
 
+def evaluate_stack(session,theta,stack,ns,n1,thickness,wl):
+    '''Spectra of the stack at angles theta (rad) from the evaluator of this
+    session for these angles, shaped (1, angle, polarization, wavelength).'''
+    key = (session,fingerprint(theta,wl))
+    evaluator = evaluators.get(key)
+    if evaluator is None:
+        evaluator = StackEvaluator(1,theta,wl)
+    with evaluator.lock:
+        evaluator.update([((id,fingerprint(n)),n,d) for (id,d),n in zip(stack,ns)])
+        spectra = evaluator.spectra(n1,1,1 if thickness is None else thickness)
+    # put again after every evaluation, the products held grow with the stack
+    evaluators.put(key,evaluator)
+    return spectra
+
+def calc_angle_family(stack,substrate,thickness,session=None):
+    # spectra for every slider angle in one batched call, shaped (angle, polarization, wavelength)
+    wl,(n1,*ns) = db.resolve_stack([substrate]+[id for id,_ in stack],grid.uniform(10))
+    spectra = evaluate_stack(session,ANGLES*np.pi/180,stack,ns,n1,thickness,wl)
+    return wl,tuple(x[0] for x in spectra)
+
+def calc_cone(stack,substrate,thickness,axis,half_angle,session=None):
+    # spectra averaged over a cone around the slider angle, shaped (polarization, wavelength); the
+    # quadrature nodes of a round repeat between edits, so each round reuses its evaluator
+    wl,(n1,*ns) = db.resolve_stack([substrate]+[id for id,_ in stack],grid.uniform(10))
+    distribution = angular.cone(half_angle*np.pi/180,axis*np.pi/180)
+    spectra,evaluations = angular.average(lambda theta:evaluate_stack(session,theta,stack,ns,n1,thickness,wl),
+                                          distribution)
+    metrics.value('calc_spectra_averaged.angles',evaluations)
+    return wl,tuple(x[0] for x in spectra)
+
+# plot area is about 3/4 of the window
+clientside_callback(
+    'function(session) {return Math.round(window.innerWidth*0.75);}',
+    Output('plot-width','data'),
+    Input('session-id','data')
+)
+
 @callback(
     Output('table-layer','data'),
     Input('button-add-layer','n_clicks'),
@@ -0,0 +1,53 @@
+import dash
+import dash_bootstrap_components as dbc
+from dash import html,dcc,dash_table,callback,Input,Output
+
+from opticalsimulation import metrics
+
+dash.register_page(__name__,path='/metrics')
+
+def _table(id,columns):
+    return dash_table.DataTable(id=id,data=[],columns=[{'id':c,'name':c} for c in columns],
+                                style_cell={'textAlign':'left'},sort_action='native')
+
+layout = dbc.Container([
+    html.H2('Metrics'),
+    dbc.Alert('Metrics are disabled. Start the app with OPTSIM_METRICS=1.',id='metrics-disabled',
+              color='secondary',is_open=False),
+    dcc.Interval(id='metrics-interval',interval=2000),
+    html.Div([dbc.Button('Reset',id='metrics-reset',n_clicks=0)],className="d-md-flex justify-content-md-end"),
+    html.H4('Callbacks'),
+    _table('metrics-callbacks',['time','name','seconds','stages','round trips']),
+    html.Br(),
+    html.H4('Timers (ms)'),
+    _table('metrics-timers',['name','count','total','mean','max']),
+    html.Br(),
+    html.H4('Counters and sizes'),
+    _table('metrics-values',['name','count','total','mean','max']),
+])
+
+def _ms(x):
+    return round(x*1000,3)
+
+@callback(
+    Output('metrics-disabled','is_open'),
+    Output('metrics-callbacks','data'),
+    Output('metrics-timers','data'),
+    Output('metrics-values','data'),
+    Input('metrics-interval','n_intervals'),
+    Input('metrics-reset','n_clicks')
+)
+def show_metrics(n_intervals,n_reset):
+    if dash.ctx.triggered_id == 'metrics-reset':
+        metrics.reset()
+    snapshot = metrics.snapshot()
+    callbacks = [{'time':'{:.3f}'.format(c['time']),'name':c['name'],'seconds':round(c['seconds'],4),
+                  'stages':', '.join('{} {:.1f} ms'.format(k,v*1000) for k,v in c['stages'].items()),
+                  'round trips':c['counters'].get('db.round_trips',0)}
+                 for c in reversed(snapshot['callbacks'])]
+    timers = [{'name':name,'count':t['count'],'total':_ms(t['total']),'mean':_ms(t['mean']),'max':_ms(t['max'])}
+              for name,t in snapshot['timers'].items()]
+    values = [{'name':name,'count':n,'total':n,'mean':'','max':''} for name,n in snapshot['counters'].items()]
+    values += [{'name':name,'count':v['count'],'total':v['total'],'mean':round(v['mean'],1),'max':v['max']}
+               for name,v in snapshot['values'].items()]
+    return not snapshot['enabled'],callbacks,timers,values
@@ -0,0 +1,126 @@
+import dash
+import dash_bootstrap_components as dbc
+from dash import html,dcc,callback,Input,Output,State,ALL
+
+from opticalsimulation import sweep
+from opticalsimulation.figures import heatmap_figure,message_figure
+
+dash.register_page(__name__,path='/sweep')
+
+LABELS = {'angle':'Angle (deg)','t_sub':'Substrate (um)'}
+
+def _label(store,name):
+    if name in LABELS:
+        return LABELS[name]
+    return '{} (nm)'.format(store.meta['layers'][int(name[1:])])
+
+def serve_layout():
+    paths = sweep.stores()
+    layout = dbc.Container([
+        html.H2('Sweep'),
+        dbc.Row([
+            dbc.Col([
+                dcc.Graph(id='sweep-graph',style={'height':'70vh'}),
+                dbc.Progress(id='sweep-progress',value=0,style={'margin-top':10}),
+            ],width=8),
+            dbc.Col([
+                dbc.Label('Sweep'),
+                dcc.Dropdown(id='sweep-path',options=[{'label':p.name,'value':str(p)} for p in paths],
+                             value=str(paths[0]) if paths else None),
+                dbc.Label('X axis',style={'padding-top':10}),
+                dcc.Dropdown(id='sweep-x',clearable=False),
+                dbc.Label('Y axis',style={'padding-top':10}),
+                dcc.Dropdown(id='sweep-y',clearable=False),
+                dbc.RadioItems(id='sweep-quantity',options=[{'label':'Reflectance','value':'R'},
+                                                            {'label':'Transmittance','value':'T'}],
+                               value='R',inline=True,style={'padding-top':10}),
+                dbc.RadioItems(id='sweep-polarization',options=[{'label':'Average','value':'average'},
+                                                                {'label':'s','value':'s'},
+                                                                {'label':'p','value':'p'}],
+                               value='average',inline=True),
+                dbc.Label(id='sweep-wavelength-label',style={'padding-top':10}),
+                dcc.Slider(id='sweep-wavelength',min=0,max=0,step=1,value=0,marks=None),
+                html.Div(id='sweep-fixed'),
+            ]),
+        ]),
+        dcc.Interval(id='sweep-interval',interval=2000,disabled=True),
+    ])
+    return layout
+
+layout = serve_layout
+
+@callback(
+    Output('sweep-x','options'),
+    Output('sweep-x','value'),
+    Output('sweep-y','options'),
+    Output('sweep-y','value'),
+    Output('sweep-wavelength','max'),
+    Output('sweep-wavelength','value'),
+    Input('sweep-path','value')
+)
+def select_sweep(path):
+    if path is None:
+        return [],None,[],None,0,0
+    store = sweep.SweepStore(path)
+    options = [{'label':_label(store,name),'value':name} for name,_ in store.axes]
+    wavelength = [{'label':'Wavelength (nm)','value':'wavelength'}]
+    y = store.axes[1][0] if len(store.axes) > 1 else 'wavelength'
+    return options,store.axes[0][0],options+wavelength,y,len(store.wavelength)-1,len(store.wavelength)//2
+
+@callback(
+    Output('sweep-fixed','children'),
+    Input('sweep-x','value'),
+    Input('sweep-y','value'),
+    State('sweep-path','value')
+)
+def fixed_axes(x,y,path):
+    if path is None:
+        return []
+    store = sweep.SweepStore(path)
+    children = []
+    for name,values in store.axes:
+        if name in (x,y):
+            continue
+        children += [dbc.Label(_label(store,name),style={'padding-top':10}),
+                     dcc.Slider(id={'type':'sweep-fixed','axis':name},min=0,max=len(values)-1,step=1,
+                                value=len(values)//2,marks=None,tooltip={'placement':'bottom'})]
+    return children
+
+@callback(
+    Output('sweep-graph','figure'),
+    Output('sweep-wavelength-label','children'),
+    Output('sweep-progress','value'),
+    Output('sweep-progress','label'),
+    Output('sweep-interval','disabled'),
+    Input('sweep-x','value'),
+    Input('sweep-y','value'),
+    Input('sweep-quantity','value'),
+    Input('sweep-polarization','value'),
+    Input('sweep-wavelength','value'),
+    Input({'type':'sweep-fixed','axis':ALL},'value'),
+    Input('sweep-interval','n_intervals'),
+    State({'type':'sweep-fixed','axis':ALL},'id'),
+    State('sweep-path','value')
+)
+def update_heatmap(x,y,quantity,polarization,wavelength,fixed,n_intervals,ids,path):
+    if path is None:
+        return message_figure('No sweeps (run python -m opticalsimulation.sweep)'),'',0,'',True
+    store = sweep.SweepStore(path)
+    names = [name for name,_ in store.axes]
+    if x not in names or (y not in names and y != 'wavelength') or x == y:
+        return message_figure('Select two different axes'),'',0,'',True
+    index = {name:len(values)//2 for name,values in store.axes if name not in (x,y)}
+    index.update({i['axis']:v for i,v in zip(ids,fixed) if i['axis'] in index})
+    label = 'Wavelength {:g} nm'.format(store.wavelength[wavelength])
+    if y == 'wavelength':
+        z = store.select(quantity,polarization,**index)
+        ys,ytitle = store.wavelength,'Wavelength (nm)'
+    else:
+        z = store.select(quantity,polarization,wavelength,**index)
+        ys,ytitle = store.axis(y),_label(store,y)
+    # select keeps the axis order of the sweep; the heat map wants (y, x)
+    if y == 'wavelength' or names.index(x) < names.index(y):
+        z = z.T
+    progress = store.progress()
+    fig = heatmap_figure(store.axis(x),ys,z,_label(store,x),ytitle,quantity)
+    return fig,label,progress*100,'{:.0f} %'.format(progress*100),progress >= 1
@@ -0,0 +1,18 @@
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import opticalsimulation.database as db
+from opticalsimulation.settings import Base
+
+@pytest.fixture
+def database():
+    engine = create_engine('sqlite://',connect_args={'check_same_thread':False},poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    bind = db.Session.session_factory.kw['bind']
+    db.Session.configure(bind=engine)
+    db.clear_cache()
+    yield engine
+    db.Session.configure(bind=bind)
+    db.clear_cache()
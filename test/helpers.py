@@ -0,0 +1,3 @@
+def write_nk(path,ws,n,k):
+    path.write_text('Wavelength(nm)\tn\tk\n'+''.join('{}\t{}\t{}\n'.format(w,n,k) for w in ws))
+    return path
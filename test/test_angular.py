@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+
+from opticalsimulation.opticalsimulation import calc_spectra_batch
+from opticalsimulation.angular import Distribution,calc_spectra_averaged,cone,uniform
+
+LAM = np.linspace(400,800,41)
+NS = [np.full(len(LAM),2.3-0.001j),np.full(len(LAM),1.46)]*3
+DS = [55,95]*3
+
+def spectra(theta):
+    return calc_spectra_batch(1,1.52,1,theta,NS,DS,[],[],1000,LAM)
+
+def test_uniform_average():
+    (r01,t01,r,t),evaluations = calc_spectra_averaged(1,1.52,1,uniform(0.1,0.6),NS,DS,[],[],1000,LAM,tol=1e-6)
+    theta = np.linspace(0.1,0.6,4001)
+    reference = np.trapezoid(spectra(theta)[0][0],theta,axis=0)/0.5
+    assert r01.shape == (1,2,len(LAM))
+    assert np.allclose(r01[0],reference,atol=1e-6)
+    assert evaluations < 200
+
+@pytest.mark.parametrize(('half_angle','axis'),[(0.3,0.0),(0.2,0.5),(0.35,0.2)])
+def test_cone(half_angle,axis):
+    (r01,_,_,_),evaluations = calc_spectra_averaged(1,1.52,1,cone(half_angle,axis),NS,DS,[],[],1000,LAM,tol=1e-5)
+    # 円錐内の光線を (t, phi) で直接積分する
+    t = (np.arange(60)+0.5)/60*half_angle
+    phi = (np.arange(120)+0.5)/120*2*np.pi
+    t,phi = [x.ravel() for x in np.meshgrid(t,phi,indexing='ij')]
+    cos = np.cos(axis)*np.cos(t)+np.sin(axis)*np.sin(t)*np.cos(phi)
+    weight = np.sin(t)*cos
+    reference = np.einsum('a,apl->pl',weight,spectra(np.arccos(cos))[0][0])/weight.sum()
+    assert np.allclose(r01[0],reference,atol=2e-5)
+    assert evaluations <= 100
+
+def test_narrow_cone():
+    (r01,t01,_,_),_ = calc_spectra_averaged(1,1.52,1,cone(1e-4,0.4),NS,DS,[],[],1000,LAM)
+    direct = spectra(0.4)
+    assert np.allclose(r01,direct[0][:,0],atol=1e-7) and np.allclose(t01,direct[1][:,0],atol=1e-7)
+
+def test_distribution_range():
+    with pytest.raises(ValueError):
+        cone(0.2,1.45)
+    with pytest.raises(ValueError):
+        Distribution(np.ones_like,0.5,0.2)
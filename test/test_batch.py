@@ -0,0 +1,52 @@
+import json
+import pytest
+import numpy as np
+
+from opticalsimulation.opticalsimulation import calc_spectra
+from opticalsimulation.batch import run,simulate
+from test.helpers import write_nk
+
+@pytest.fixture
+def library(database,tmp_path):
+    import opticalsimulation.database as db
+    write_nk(tmp_path/'SiO2.txt',range(300,1200,5),1.46,0)
+    write_nk(tmp_path/'TiO2.txt',range(350,1000,5),2.35,0.001)
+    write_nk(tmp_path/'BK7.txt',range(300,1200,5),1.52,0.00001)
+    db.import_opticalindex_directory(tmp_path)
+    return tmp_path
+
+def design(name,d1,d2,**kwargs):
+    return dict(name=name,layers=[['TiO2.txt',d1],['SiO2.txt',d2]],substrate='BK7.txt',**kwargs)
+
+def test_simulate_matches_calc_spectra(library):
+    designs = [design('a',20,90,angles=[0,45]),design('b',30,100,angles=[0,45]),
+               design('c',30,100,substrate_thickness=1000,wavelength={'start':400,'end':800,'step':20})]
+    results = list(simulate(designs))
+    assert [len(result['index']) for result in results] == [2,1]
+    first,second = results
+    assert first['wavelength'][0] == 350
+    assert first['R'].shape == (2,2,2,len(first['wavelength']))
+    n = np.full(len(second['wavelength']),2.35-0.001j)
+    r,t = calc_spectra(1,np.full(len(n),1.52-0.00001j),1,0.0,[n,np.full(len(n),1.46)],[30,100],[],[],1000,
+                       second['wavelength'])[2:]
+    assert np.allclose(second['R'][0,0],r,atol=1e-6)
+    assert np.allclose(second['T'][0,0],t,atol=1e-6)
+
+def test_run_npz(library,tmp_path):
+    path = tmp_path/'designs.jsonl'
+    path.write_text(''.join(json.dumps(design(str(i),10+i,90)) +'\n' for i in range(25))
+                    +json.dumps(dict(name='x',layers=[['Unknown',1]],substrate='BK7.txt'))+'\n')
+    report = run(path,tmp_path/'out',chunk=10)
+    assert report['designs'] == 25
+    parts = sorted((tmp_path/'out').glob('part-*.npz'))
+    assert len(parts) == 3
+    assert list(np.load(parts[-1])['index']) == list(range(20,25))
+
+def test_run_parquet(library,tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path/'designs.jsonl'
+    path.write_text(''.join(json.dumps(design(str(i),10+i,90,angles=[0,30]))+'\n' for i in range(5)))
+    run(path,tmp_path/'out.parquet',format='parquet')
+    table = pq.read_table(tmp_path/'out.parquet')
+    assert table.num_rows == 10
+    assert table.column('angle').to_pylist()[:2] == [0,30]
@@ -0,0 +1,49 @@
+import pytest
+
+from opticalsimulation.cache import LRUCache
+
+def test_hit_and_miss():
+    cache = LRUCache(maxsize=2)
+    assert cache.get('a') is None
+    cache.put('a',1)
+    assert cache.get('a') == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_eviction_order():
+    cache = LRUCache(maxsize=2)
+    cache.put('a',1)
+    cache.put('b',2)
+    cache.get('a')              #'a'が最近使われたので'b'が追い出される
+    cache.put('c',3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.stats()['evictions'] == 1
+
+@pytest.mark.parametrize(('keys','id','left'),[
+    ([(1,400,800,10),(1,300,900,10),(2,400,800,10)],1,1),
+    ([(1,400,800,10),(2,400,800,10)],3,2),
+])
+def test_invalidate(keys,id,left):
+    cache = LRUCache()
+    for key in keys:
+        cache.put(key,key)
+    cache.invalidate(lambda key:key[0] == id)
+    assert len(cache) == left
+
+def test_byte_budget():
+    import numpy as np
+    cache = LRUCache(maxsize=100,maxbytes=3000)
+    for key in 'abc':
+        cache.put(key,(np.zeros(100),np.zeros(50)))       #1200 bytes
+    assert 'a' not in cache and cache.nbytes == 2400
+    value = [np.zeros(100)]
+    cache.put('b',value)
+    assert cache.nbytes == 2000
+    value.append(np.zeros(200))
+    cache.put('b',value)                                  #大きくなった値は put し直すと測り直す
+    assert 'c' not in cache and cache.nbytes == 2400
+    cache.put('big',np.zeros(1000))
+    assert 'big' not in cache and cache.nbytes == 0
+    cache.invalidate(lambda key:True)
+    assert cache.nbytes == 0
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import opticalsimulation.color as color
+
+LAM = np.arange(360.0,831.0,5.0)
+
+@pytest.mark.parametrize(('illuminant','observer','xy'),[
+    ('D65','1931',(0.3127,0.3290)),
+    ('D50','1931',(0.3457,0.3585)),
+    ('A','1931',(0.4476,0.4074)),
+    ('D65','1964',(0.3138,0.3310)),
+])
+def test_white_point(illuminant,observer,xy):
+    assert np.allclose(color.chromaticity(color.white(LAM,illuminant,observer)),xy,atol=1e-4)
+
+def test_perfect_reflector():
+    result = color.color(np.ones(len(LAM)),LAM)
+    assert result['XYZ'][1] == pytest.approx(100)
+    assert np.allclose(result['Lab'],[100,0,0])
+    assert np.isnan(result['dominant'])
+    assert color.luminous(np.full(len(LAM),0.04),LAM) == pytest.approx(0.04)
+
+@pytest.mark.parametrize('peak',[470,520,580,640])
+def test_dominant_wavelength(peak):
+    lam = np.arange(360.0,831.0,1.0)
+    line = np.exp(-(lam-peak)**2)
+    assert color.color(line,lam)['dominant'] == pytest.approx(peak,abs=0.5)
+
+def test_purple_is_complementary():
+    spectrum = np.exp(-((LAM-440)/15)**2)+np.exp(-((LAM-660)/15)**2)
+    assert 490 < -color.color(spectrum,LAM)['dominant'] < 570
+
+def test_batch_shape_and_cache():
+    lam = np.arange(380.0,781.0,10.0)
+    spectra = np.random.default_rng(0).random((7,5,2,len(lam)))
+    result = color.color(spectra,lam)
+    assert result['XYZ'].shape == (7,5,2,3)
+    assert result['dominant'].shape == (7,5,2)
+    assert np.allclose(result['XYZ'][3,2,1],color.xyz(spectra[3,2,1],lam))
+    assert color.weights(lam) is color.weights(lam.copy())     #同じ波長グリッドなら再計算しない
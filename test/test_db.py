@@ -1,7 +1,127 @@
 import pytest
+import numpy as np
+
+import opticalsimulation.database as db
+from test.helpers import write_nk
 
 def func(x):
     return x+1
 
 def test_func():
-    assert func(1) == 2
\ No newline at end of file
+    assert func(1) == 2
+
+def test_parse_opticalindex():
+    ws,ns,ks = db.parse_opticalindex('Wavelength(nm)\tn\tk\n400\t1.5\t0.1\n500 1.4 0\n')
+    assert np.all(ws == [400,500])
+    assert np.all(ns == [1.5,1.4])
+    assert np.all(ks == [0.1,0])
+
+def test_import_directory(database,tmp_path):
+    write_nk(tmp_path/'SiO2.txt',range(200,1200,5),1.46,0)
+    write_nk(tmp_path/'TiO2.txt',range(300,1000,1),2.4,0.01)
+    report = db.import_opticalindex_directory(tmp_path)
+    assert report['materials'] == 2
+    assert report['rows'] == 200+700
+    assert [name for _,name in db.get_material_list()] == ['SiO2.txt','TiO2.txt']
+    assert db.get_range(2) == (300,999)
+    report = db.import_opticalindex_directory(tmp_path)      #同名の材料は追加しない
+    assert report['materials'] == 0
+
+def test_fitted_opticalindex_cache(database,tmp_path):
+    db.import_opticalindex_files([write_nk(tmp_path/'TiO2.txt',range(300,1000,1),2.4,0.01)])
+    nks = db.fitted_opticalindex(1,400,800,10)
+    assert np.allclose(nks,2.4-0.01j)
+    assert db.fitted_opticalindex(1,400,800,10) is nks
+    assert db.get_cache_stats()['hits'] == 1
+    db.delete_opticalindex(1)
+    assert len(db.fitted_opticalindex(1,400,800,10)) == 0
+
+def test_get_opticalindex_sorted(database,tmp_path):
+    path = tmp_path/'a.txt'
+    path.write_text('Wavelength(nm)\tn\tk\n600\t1.6\t0\n400\t1.4\t0.2\n500\t1.5\t0.1\n')
+    db.import_opticalindex_files([path])
+    ws,nks = db.get_opticalindex(1)
+    assert np.all(ws == [400,500,600])
+    assert np.allclose(nks,[1.4-0.2j,1.5-0.1j,1.6])
+    assert db.get_range(1) == (400,600)
+
+def test_resolve_stack(database,tmp_path):
+    from sqlalchemy import event
+    import opticalsimulation.grid as grid
+    write_nk(tmp_path/'SiO2.txt',range(200,1200,5),1.46,0)
+    write_nk(tmp_path/'TiO2.txt',range(300,1000,1),2.4,0.01)
+    write_nk(tmp_path/'BK7.txt',range(250,1500,5),1.52,0)
+    db.import_opticalindex_directory(tmp_path)
+    statements = []
+    event.listen(database,'before_cursor_execute',lambda *args:statements.append(args[2]))
+    wl,nks = db.resolve_stack([3,2,1,2],grid.uniform(10))
+    assert len(statements) == 2        #範囲の索引と n/k の読み込み
+    assert wl[0] == 300 and wl[-1] == 990
+    assert np.array_equal(nks[1],db.fitted_opticalindex(2,300,1000,10))
+    assert nks[1] is nks[3]
+    statements.clear()
+    assert db.resolve_stack([3,2,1,2],grid.uniform(10))[1][0] is nks[0]
+    assert statements == []
+    with pytest.raises(ValueError):
+        db.resolve_stack([1,3],[250,500])
+    with pytest.raises(ValueError):
+        db.resolve_stack([1,9])
+
+def test_session_scope(database,tmp_path):
+    from opticalsimulation.models import Material
+    db.import_opticalindex_files([write_nk(tmp_path/'SiO2.txt',range(200,1200,5),1.46,0)])
+    assert db.get_material_name(1) == 'SiO2.txt'
+    assert db.get_material_name(9) is None
+    with pytest.raises(RuntimeError):
+        with db.session_scope() as session:
+            session.add(Material(name='x'))
+            with db.session_scope() as inner:      #入れ子は外側のセッションを共有する
+                assert inner is session
+            raise RuntimeError
+    assert not db.Session.registry.has()
+    assert db.get_material_list() == [(1,'SiO2.txt')]
+    db.delete_opticalindex(1)
+    db.delete_opticalindex(1)
+    assert db.get_material_list() == []
+
+def test_material_list_cache(database,tmp_path,monkeypatch):
+    from opticalsimulation.models import Material
+    db.import_opticalindex_files([write_nk(tmp_path/'SiO2.txt',range(200,1200,5),1.46,0)])
+    assert db.get_material_list() == [(1,'SiO2.txt')]
+    with db.session_scope() as session:         #別プロセスからの追加を模擬する
+        session.add(Material(name='x'))
+    assert db.get_material_list() == [(1,'SiO2.txt')]      #確認間隔の間はキャッシュを使う
+    monkeypatch.setattr(db,'CHECK_SECONDS',0.0)
+    assert db.get_material_list() == [(1,'SiO2.txt'),(2,'x')]
+    with db.session_scope() as session:
+        session.execute(db.delete(Material).where(Material.id == 2))
+        session.add(Material(name='y'))
+    assert db.get_material_list() == [(1,'SiO2.txt'),(3,'y')]
+    id = db.add_model('Cauchy','cauchy',{'A':1.5,'B':0.0,'C':0.0})
+    assert db.get_material_list() == [(1,'SiO2.txt'),(3,'y'),(id,'Cauchy')]
+    db.delete_opticalindex(1)
+    assert db.get_material_list() == [(3,'y'),(id,'Cauchy')]
+
+def test_material_index_revalidated(database,tmp_path,monkeypatch):
+    from opticalsimulation.models import Material
+    db.import_opticalindex_files([write_nk(tmp_path/'SiO2.txt',range(200,1200,5),1.46,0)])
+    monkeypatch.setattr(db,'CHECK_SECONDS',0.0)
+    db.resolve_stack([1],[500.0])
+    assert db.get_range(1) == (200,1195) and len(db.nk_cache) == 1
+    with db.session_scope() as session:         #別プロセスでモデルを追加し SiO2 を削除する
+        session.add(Material(name='film',kind='cauchy',params={'A':1.5,'B':0.0,'C':0.0}))
+        session.execute(db.delete(db.Dispersion).where(db.Dispersion.material_id == 1))
+        session.execute(db.delete(Material).where(Material.id == 1))
+    assert db.get_model(2) is not None
+    assert db.get_range(1) == (None,None)
+    assert len(db.nk_cache) == 0
+    assert db.get_material_list() == [(2,'film')]
+
+def test_sqlite_engine(tmp_path):
+    from sqlalchemy import text
+    from opticalsimulation.settings import create
+    engine = create('sqlite:///{}'.format(tmp_path/'a.db'))
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 30000
+    engine.dispose()
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+
+from opticalsimulation.design import merit,optimize_thickness,needle_derivative,design
+
+LAM = np.arange(450.0,650.0,5.0)
+INDEXES = {'L':np.full(len(LAM),1.46),'H':np.full(len(LAM),2.35-0.001j)}
+N_SUB = np.full(len(LAM),1.52)
+
+@pytest.mark.parametrize(('n','lam','d'),[
+    (1.38,550.0,550/4/1.38),            #単層ARは1/4波長膜
+    (1.46,600.0,600/4/1.46),
+])
+def test_quarter_wave(n,lam,d):
+    ds,value = optimize_thickness([np.array([n])],[80],1,np.array([1.52]),np.array([lam]),0.0)
+    assert np.isclose(ds[0],d,rtol=1e-4)
+
+def test_merit_gradient():
+    ns = [INDEXES['H'],INDEXES['L']]
+    ds = np.array([60.0,90.0])
+    value,gradient = merit(ns,ds,1,N_SUB,LAM,1.0,theta=[0,0.3])
+    for i in range(2):
+        h = np.zeros(2)
+        h[i] = 1e-4
+        numeric = (merit(ns,ds+h,1,N_SUB,LAM,1.0,theta=[0,0.3])[0]-merit(ns,ds-h,1,N_SUB,LAM,1.0,theta=[0,0.3])[0])/2e-4
+        assert np.isclose(gradient[i],numeric,rtol=1e-5)
+
+def test_needle_derivative():
+    ns = [INDEXES['H'],INDEXES['L']]
+    ds = np.array([40.0,90.0])
+    derivative,depths = needle_derivative(ns,ds,[INDEXES['L']],1,N_SUB,LAM,0.0,points=4)
+    d = depths[0,1]
+    h = 1e-4
+    inserted = merit([INDEXES['H'],INDEXES['L'],INDEXES['H'],INDEXES['L']],[d,h,40-d,90],1,N_SUB,LAM,0.0)[0]
+    assert np.isclose((inserted-merit(ns,ds,1,N_SUB,LAM,0.0)[0])/h,derivative[0,0,1],rtol=1e-3)
+
+def test_needle_design_improves_merit():
+    _,_,refined = design(['H','L'],[400,400],INDEXES,1,N_SUB,LAM,1.0)
+    materials,ds,value = design(['H','L'],[400,400],INDEXES,1,N_SUB,LAM,1.0,candidates=['H','L'],needles=5)
+    assert value < refined
+    assert len(materials) == len(ds)
+    assert all(a != b for a,b in zip(materials,materials[1:]))
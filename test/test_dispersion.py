@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy import integrate
+
+import opticalsimulation.database as db
+import opticalsimulation.opticalsimulation as op
+from opticalsimulation.dispersion import HC,Model,cauchy,drude,fit_model,sellmeier,tauc_lorentz
+from test.helpers import write_nk
+
+BK7 = {'B':(1.03961212,0.231792344,1.01046945),'C':(0.00600069867,0.0200179144,103.560653)}
+
+def test_sellmeier_bk7():
+    assert sellmeier(587.56,**BK7).real == pytest.approx(1.5168,abs=1e-4)
+
+@pytest.mark.parametrize('E',[1.0,2.5,3.5,5.0,7.0])
+def test_tauc_lorentz_kramers_kronig(E):
+    A,E0,C,Eg,eps_inf = 120,4.2,1.8,3.1,1.3
+    eps2 = lambda x:A*E0*C*(x-Eg)**2/(((x**2-E0**2)**2+C**2*x**2)*x) if x > Eg else 0
+    if E > Eg:
+        v,_ = integrate.quad(lambda x:x*eps2(x)/(x+E),Eg,1e4,weight='cauchy',wvar=E,limit=1000)
+    else:
+        v,_ = integrate.quad(lambda x:x*eps2(x)/(x**2-E**2),Eg,np.inf,limit=500)
+    eps = np.conj(tauc_lorentz(HC/E,A,E0,C,Eg,eps_inf))**2
+    assert eps.real == pytest.approx(eps_inf+2/np.pi*v,abs=1e-5)
+    assert eps.imag == pytest.approx(eps2(E))
+
+def test_drude_metal():
+    nk = drude(np.array([500,1000]),wp=9.0,gamma=0.05)
+    assert np.all(nk.real < 0.5)
+    assert np.all(-nk.imag > 2)             #n-ik 表記なので k は正
+
+def test_fit_model():
+    lam = np.linspace(400,1000,61)
+    model,error = fit_model('cauchy',lam,cauchy(lam,1.45,0.0036,0.0),{'A':1.5,'B':0.0,'C':0.0},fixed=('C',))
+    assert error < 1e-8
+    assert model.params['A'] == pytest.approx(1.45)
+    assert model.params['B'] == pytest.approx(0.0036)
+
+def test_callable_index():
+    lam = np.linspace(400,800,41)
+    glass = Model('sellmeier',**BK7)
+    film = Model('cauchy',A=2.3,B=0.02)
+    expected = op.calc_spectra(1,glass(lam),1,0.3,[film(lam)],[80],[],[],1000,lam)
+    assert np.allclose(op.calc_spectra(1,glass,1,0.3,[film],[80],[],[],1000,lam),expected)
+
+def test_model_material(database,tmp_path):
+    db.import_opticalindex_files([write_nk(tmp_path/'TiO2.txt',range(350,1000,5),2.35,0.001)])
+    id = db.add_model('BK7','sellmeier',BK7)
+    assert db.get_range(id) == (None,None)
+    wl,(n1,n) = db.resolve_stack([id,1])
+    assert wl[0] == 350 and wl[-1] == 990          #モデルは範囲を狭めない
+    assert np.allclose(n1,sellmeier(wl,**BK7))
+    wl,(n1,) = db.resolve_stack([id])
+    assert (wl[0],wl[-1]+10) == db.MODEL_RANGE
+    assert len(db.fitted_opticalindex(id,100,3000,100)) == 29
+    with pytest.raises(TypeError):
+        db.add_model('bad','cauchy',{'D':1})
+
+def test_fit_material(database,tmp_path):
+    ws = np.arange(400,1000,5)
+    path = tmp_path/'film.txt'
+    path.write_text('Wavelength(nm)\tn\tk\n'+''.join('{}\t{}\t0\n'.format(w,n) for w,n in zip(ws,cauchy(ws,1.6,0.01).real)))
+    db.import_opticalindex_files([path])
+    id,error = db.fit_material(1,'cauchy',{'A':1.5,'B':0.0})
+    assert error < 1e-6
+    assert db.get_material_name(id) == 'film.txt (cauchy)'
+    assert db.get_model(id).params['A'] == pytest.approx(1.6)
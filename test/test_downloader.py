@@ -0,0 +1,90 @@
+import time
+import asyncio
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import opticalsimulation.database as db
+import opticalsimulation.downloader as dl
+
+NK = 'Wavelength(nm)\tn\tk\n'+''.join('{}\t1.5\t0\n'.format(w) for w in range(400,800,10))
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+    flaky = set()
+
+    def do_GET(self):
+        Handler.requests.append(self.path)
+        if self.path in Handler.flaky:
+            Handler.flaky.discard(self.path)        #最初の 1 回だけ 503
+            self.send_error(503)
+            return
+        if self.path == '/download/html':
+            body = b'<html>not found</html>'
+        elif self.path.startswith('/download/'):
+            body = NK.encode()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    Handler.flaky = set()
+    httpd = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    thread = threading.Thread(target=httpd.serve_forever,daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_download(server,tmp_path):
+    cache = dl.Cache(tmp_path)
+    Handler.flaky = {'/download/TiO2'}
+    urls = [server+'/download/SiO2',server+'/download/TiO2',server+'/missing/x',server+'/download/html']
+    done = []
+    results = asyncio.run(dl.download(urls,concurrency=4,backoff=0,cache=cache,progress=done.append))
+    assert [r['status'] for r in results] == ['downloaded','downloaded','error','error']
+    assert [r['name'] for r in results][:2] == ['SiO2','TiO2']
+    assert results[0]['text'] == NK
+    assert len(done) == 4
+    assert Handler.requests.count('/download/TiO2') == 2
+    # SiO2 と TiO2 は同じ内容なので 1 つのオブジェクト
+    assert len(list((tmp_path/'objects').glob('*/*'))) == 1
+    Handler.requests = []
+    results = asyncio.run(dl.download(urls[:2],cache=cache))
+    assert [r['status'] for r in results] == ['cached','cached']
+    assert Handler.requests == []
+
+def test_import_job(database,server,tmp_path):
+    id = dl.start_import([server+'/download/SiO2',server+'/download/BK7',server+'/missing/x'],cache=dl.Cache(tmp_path))
+    for _ in range(100):
+        status = dl.job_status(id)
+        if status['state'] == 'finished':
+            break
+        time.sleep(0.05)
+    assert status['state'] == 'finished'
+    assert status['done'] == status['total'] == 3
+    assert len(status['failed']) == 1
+    assert status['report']['materials'] == 2
+    assert [name for _,name in db.get_material_list()] == ['SiO2','BK7']
+    assert dl.job_status('unknown') is None
+
+def test_job_history(database,server,tmp_path,monkeypatch):
+    monkeypatch.setattr(dl,'_jobs',dl.LRUCache(maxsize=2))
+    ids = [dl.start_import([server+'/download/SiO2'],cache=dl.Cache(tmp_path)) for _ in range(3)]
+    for _ in range(100):
+        status = dl.job_status(ids[-1])
+        if status['state'] == 'finished':
+            break
+        time.sleep(0.05)
+    assert status['state'] == 'finished'
+    assert dl.job_status(ids[0]) is None        #古いジョブは破棄される
+    assert dl.job_status(ids[1]) is not None
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from opticalsimulation.field import calc_absorption_batch,calc_field,iter_field
+from opticalsimulation.opticalsimulation import calc_spectra_batch
+
+LAM = np.linspace(400.0,800.0,9)
+NS = [np.full(len(LAM),2.3-0.05j),np.full(len(LAM),1.46-0.001j),np.full(len(LAM),3.1-3.3j)]
+DS = [60,90,20]
+N_SUB = np.full(len(LAM),1.52+0j)
+
+@pytest.mark.parametrize('theta',[0.0,0.6,np.array([0.0,0.3,1.0])])
+def test_energy_balance(theta):
+    r,t,a = calc_absorption_batch(NS,DS,1,N_SUB,theta,LAM)
+    r01,t01,_,_ = calc_spectra_batch(1,N_SUB,1,theta,NS,DS,[],[],1,LAM)
+    assert np.allclose(r,r01) and np.allclose(t,t01)
+    assert np.all(a > 0)
+    assert np.allclose(r+t+a.sum(axis=0),1)           #R+T+ΣA=1
+
+def test_absorption_matches_field_integral():
+    _,_,a = calc_absorption_batch(NS,DS,1,N_SUB,0.0,LAM)
+    tops = np.cumsum([0]+DS)
+    for i,n in enumerate(NS):
+        z = np.linspace(tops[i],tops[i+1],4001)
+        field = calc_field(NS,DS,1,N_SUB,0.0,LAM,z)
+        integral = 4*np.pi*n.real*(-n.imag)/LAM*np.trapezoid(field[:,0],z,axis=0)
+        assert np.allclose(integral,a[i,0,0],rtol=1e-6)
+
+def test_field_at_surface():
+    # 表面の |E|^2 は入射波と反射波の重ね合わせ |1+r|^2
+    field = calc_field([],[],1,N_SUB,0.0,LAM,[0.0])
+    r = (1-N_SUB)/(1+N_SUB)
+    assert np.allclose(field[0,0,0],np.abs(1+r)**2)
+
+def test_chunks():
+    depths = np.linspace(0,170,1001)
+    chunks = list(iter_field(NS,DS,1,N_SUB,[0.0,0.7],LAM,depths,chunk=100))
+    assert len(chunks) == 11 and all(len(z) <= 100 for z,_ in chunks)
+    field = np.concatenate([f for _,f in chunks])
+    assert np.allclose(field,calc_field(NS,DS,1,N_SUB,[0.0,0.7],LAM,depths,chunk=1000))
+    assert np.max(np.abs(np.diff(field[:,:,0],axis=0))) < 0.05       #s の接線成分は界面で連続
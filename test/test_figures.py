@@ -0,0 +1,31 @@
+import json
+import base64
+import pytest
+import numpy as np
+
+from opticalsimulation.figures import downsample,spectra_figure
+
+@pytest.mark.parametrize(('length','width'),[(10,None),(10,5),(10000,100),(10001,333)])
+def test_downsample_keeps_extremes(length,width):
+    x = np.linspace(0,50,length)
+    for y in (np.sin(x),np.cos(3*x)):
+        index = downsample(y,width)
+        assert np.all(np.diff(index) > 0)
+        assert index[0] == 0 and index[-1] == length-1
+        if width is not None:
+            assert len(index) <= 2*width+2              #各トレース単独で 2*width+2 点まで
+        bucket = np.arange(length)*(width or length)//length
+        for b in np.unique(bucket)[::7]:
+            members = np.flatnonzero(bucket == b)
+            assert members[np.argmax(y[members])] in index
+            assert members[np.argmin(y[members])] in index
+
+def test_spectra_figure_float32():
+    wl = np.arange(400.0,800.0)
+    spectra = np.array([np.full(len(wl),0.1),np.sin(wl/10)])
+    fig = spectra_figure(wl,spectra,width=50)
+    assert [trace.name for trace in fig.data] == ['average','s-polarized','p-polarized']
+    assert np.allclose(fig.data[1].y,0.1)
+    for trace in json.loads(fig.to_json())['data']:
+        assert trace['x']['dtype'] == trace['y']['dtype'] == 'f4'      #base64 の float32 配列で送る
+        assert len(base64.b64decode(trace['y']['bdata'])) <= 4*(2*50+2)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from opticalsimulation.fitting import Problem,fit,fit_lot,read_measurement,stack_problem
+from test.helpers import write_nk
+
+LAM = np.arange(400.0,800.0,5.0)
+H = np.full(len(LAM),2.35-0.001j)
+L = np.full(len(LAM),1.46+0j)
+SUB = np.full(len(LAM),1.52+0j)
+NOMINAL = [20,35,110,90]
+
+def test_read_measurement():
+    lam,values = read_measurement('Wavelength(nm),R(%)\n# comment\n500,4.5\n400,5.0\n600,4.0\n')
+    assert np.all(lam == [400,500,600])
+    assert np.allclose(values,[0.05,0.045,0.04])
+    lam,values = read_measurement('400\t0.1\t0.8\n500\t0.2\t0.7\n')
+    assert values.shape == (2,2)
+
+@pytest.mark.parametrize(('quantity','t_sub'),[('R',None),('T',None),('R',1000)])
+def test_fit_recovers_thickness(quantity,t_sub):
+    problem = Problem([H,L,H,L],1,SUB,LAM,quantity,t_sub=t_sub)
+    true = np.array([23,31,113,87.5])
+    result = fit(problem,problem.model(true)[0,0],NOMINAL)
+    assert np.allclose(result['thickness'],true,atol=1e-3)
+    assert result['rms'] < 1e-8
+
+@pytest.mark.parametrize(('quantity','t_sub','polarization','sub'),[
+    ('R',None,'average',SUB),('T',None,'s',SUB),('R',1000,'p',SUB-1e-5j),('T',500,'average',SUB-1e-5j)])
+def test_jacobian(quantity,t_sub,polarization,sub):
+    problem = Problem([H,L],1,sub,LAM,quantity,theta=[0,0.5],polarization=polarization,t_sub=t_sub,fit_index=True)
+    x = np.array([30.0,80.0,1.01,0.99])
+    measured = problem.model(x)[0]
+    jacobian = problem.jacobian(x,measured)
+    for i,h in enumerate([1e-3,1e-3,1e-6,1e-6]):
+        e = np.zeros(4)
+        e[i] = h
+        numeric = (problem.residual(x+e,measured)-problem.residual(x-e,measured))/(2*h)
+        assert np.allclose(jacobian[:,i],numeric,atol=1e-5)
+
+@pytest.mark.parametrize('workers',[1,2])
+def test_fit_lot(workers):
+    problem = Problem([H,L,H,L],1,SUB,LAM,'R')
+    true = np.array(NOMINAL)+np.random.default_rng(0).uniform(-2,2,(6,4))
+    results = fit_lot(problem,problem.model(true)[:,0],NOMINAL,workers=workers)
+    assert np.allclose([r['thickness'] for r in results],true,atol=1e-3)
+
+def test_fit_lot_shared_pool():
+    # 同じプールを複数のロットで使い回す
+    from concurrent.futures import ProcessPoolExecutor
+    problem = Problem([H,L,H,L],1,SUB,LAM,'R')
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        for seed in (1,2):
+            true = np.array(NOMINAL)+np.random.default_rng(seed).uniform(-2,2,(4,4))
+            results = fit_lot(problem,problem.model(true)[:,0],NOMINAL,workers=2,executor=executor)
+            assert np.allclose([r['thickness'] for r in results],true,atol=1e-3)
+
+def test_stack_problem(database,tmp_path):
+    import opticalsimulation.database as db
+    write_nk(tmp_path/'TiO2.txt',range(350,1000,5),2.35,0.001)
+    write_nk(tmp_path/'SiO2.txt',range(300,1200,5),1.46,0)
+    db.import_opticalindex_directory(tmp_path)
+    id = db.add_model('BK7','sellmeier',{'B':(1.03961212,0.231792344,1.01046945),
+                                          'C':(0.00600069867,0.0200179144,103.560653)})
+    problem,keep = stack_problem([2,1],id,np.arange(300,1100,10.0))
+    assert problem.lam[0] == 350 and problem.lam[-1] == 990        #測定波長を材料の範囲に切り詰める
+    assert np.count_nonzero(keep) == len(problem.lam)
+    with pytest.raises(ValueError):
+        stack_problem([2],id,np.arange(100,300,10.0))
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import opticalsimulation.grid as grid
+
+@pytest.mark.parametrize(('builder','count'),[(grid.uniform(10),30),(grid.energy(25),25),(grid.adaptive(40),40)])
+def test_grid_inside_window(builder,count):
+    ws = np.linspace(300,700,81)
+    tables = lambda:{1:(ws,np.full(81,1.5),np.zeros(81))}
+    wl = builder(400,700,tables)
+    assert len(wl) == count
+    assert wl[0] == 400 and wl[-1] <= 700
+    assert np.all(np.diff(wl) > 0)
+
+def test_energy_grid():
+    wl = grid.energy(11,start=400,end=800)(300,1000,None)
+    assert np.allclose(np.diff(grid.HC/wl),np.diff(grid.HC/wl)[0])
+    assert wl[0] == 400 and wl[-1] == 800
+
+def test_adaptive_grid_follows_edge():
+    ws = np.linspace(300,800,501)
+    ks = np.where(ws < 450,0.5,0.0)*np.exp(-np.clip(ws-440,0,None)/5)        #450 nm 付近の吸収端
+    wl = grid.adaptive(100)(300,800,lambda:{1:(ws,np.full(501,2.0),ks)})
+    near = np.count_nonzero((wl > 430) & (wl < 470))
+    assert near > 100*40/500*3
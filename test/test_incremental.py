@@ -0,0 +1,89 @@
+import pytest
+import numpy as np
+
+from opticalsimulation.opticalsimulation import (admittance_batch,calc_matrix_batch,calc_spectra_batch,
+                                                 characteristic_param,characteristic_product)
+from opticalsimulation.incremental import StackEvaluator,layer_cache
+
+LAM = np.linspace(400,800,41)
+THETA = np.array([0.0,0.3,0.8])
+NS = {'H':2.35-0.001j,'L':1.46,'M':1.8-0.01j}
+
+def expected(layers,t_sub=1000):
+    ns = [NS[m] for m,_ in layers]
+    ds = [[d for _,d in layers]]
+    return calc_spectra_batch(1,1.52,1,THETA,ns,ds,[],[],t_sub,LAM)
+
+def evaluate(evaluator,layers):
+    evaluator.update([(m,NS[m],d) for m,d in layers])
+    return evaluator.spectra(1.52,1,1000)
+
+@pytest.mark.parametrize('edits',[
+    [[('H',100),('L',150),('H',80),('L',90)],[('H',100),('L',151),('H',80),('L',90)]],
+    [[('H',100),('L',150)],[('H',100),('M',60),('L',150)],[('L',150)],[]],
+    [[('H',50)]*5,[('H',50),('L',20),('H',50),('M',30),('H',50)],[('M',30),('H',50)]],
+])
+def test_update(edits):
+    layer_cache.clear()
+    evaluator = StackEvaluator(1,THETA,LAM)
+    for layers in edits:
+        for x,y in zip(evaluate(evaluator,layers),expected(layers)):
+            assert np.allclose(x,y,rtol=0,atol=1e-12)
+
+def test_repeated_edit_cost():
+    evaluator = StackEvaluator(1,THETA,LAM)
+    layers = [('H' if i % 2 else 'L',100+i) for i in range(20)]
+    evaluate(evaluator,layers)
+    assert evaluator.products == 19
+    layers[7] = ('M',10)
+    before = evaluator.products
+    evaluate(evaluator,layers)
+    assert evaluator.products-before <= 7+2           #編集位置まで前側の積を伸ばす
+    for d in (20,30):
+        layers[7] = ('M',d)
+        before = evaluator.products
+        for x,y in zip(evaluate(evaluator,layers),expected(layers)):
+            assert np.allclose(x,y,rtol=0,atol=1e-12)
+        assert evaluator.products-before == 2        #同じ層の編集は前後の積と 2 回の積で済む
+    before = evaluator.products
+    evaluator.insert(3,'L',NS['L'],40)
+    evaluator.delete(3)
+    evaluator.product()
+    assert evaluator.products-before <= 2+7-3
+
+def test_reversed():
+    ns = [NS['H'],NS['L'],NS['M']]
+    ds = [120,80,45]
+    evaluator = StackEvaluator(1,THETA,LAM)
+    for i,(n,d) in enumerate(zip(ns,ds)):
+        evaluator.insert(i,i,n,d)
+    reverse = characteristic_product(ns[::-1],np.array([ds[::-1]],dtype=float),1,THETA.reshape(-1,1,1),LAM)
+    assert all(np.allclose(x,y) for x,y in zip(evaluator.reversed(),reverse))
+    eta = admittance_batch(1.52,1,THETA.reshape(-1,1,1))
+    assert np.allclose(characteristic_param(evaluator.product(),eta),calc_matrix_batch(ns,ds,1,1.52,THETA,LAM))
+
+def test_empty_stack():
+    evaluator = StackEvaluator(1,THETA,LAM)
+    for x,y in zip(evaluate(evaluator,[]),expected([])):
+        assert x.shape == y.shape == (1,3,2,41)
+        assert np.allclose(x,y)
+
+def test_memory_budget():
+    # セッションごとの評価器をバイト数で制限しても編集の積の回数は変わらない
+    from opticalsimulation.cache import LRUCache
+    budget = 2**20
+    evaluators = LRUCache(maxsize=100,maxbytes=budget)
+    layers = [('H' if i % 2 else 'L',100+i) for i in range(20)]
+    for session in range(10):
+        evaluator = evaluators.get(session) or StackEvaluator(1,THETA,LAM)
+        evaluate(evaluator,layers)
+        evaluators.put(session,evaluator)
+        assert evaluators.nbytes <= budget
+    assert 0 < evaluator.nbytes <= budget and evaluators.stats()['evictions'] > 0
+    for d,cost in ((20,7+2),(30,2)):
+        layers[7] = ('M',d)
+        before = evaluator.products
+        evaluate(evaluator,layers)
+        evaluators.put(session,evaluator)
+        assert evaluator.products-before <= cost
+        assert session in evaluators and evaluators.nbytes <= budget
@@ -0,0 +1,62 @@
+import time
+import numpy as np
+import pytest
+
+import opticalsimulation.database as db
+import opticalsimulation.opticalsimulation as op
+from opticalsimulation import metrics
+from test.helpers import write_nk
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enable()
+    yield metrics.registry
+    metrics.enable(False)
+    metrics.reset()
+
+def test_disabled_is_noop():
+    metrics.reset()
+    with metrics.timer('stage'):
+        metrics.count('calls')
+    assert metrics.timer('stage') is metrics.timer('other')
+    assert metrics.snapshot()['timers'] == {}
+    assert metrics.snapshot()['counters'] == {}
+
+def test_timer_and_values(enabled):
+    for x in (1,5,3):
+        with metrics.timer('stage'):
+            metrics.value('size',x)
+    snapshot = metrics.snapshot()
+    assert snapshot['timers']['stage']['count'] == 3
+    assert snapshot['values']['size'] == {'count':3,'total':9,'mean':3.0,'max':5}
+
+def test_traced_callback(enabled,database,tmp_path):
+    db.import_opticalindex_files([write_nk(tmp_path/'A.txt',[400,500,600],1.5,0)])
+    id = db.get_material_list()[0][0]
+
+    @metrics.traced('callback.test')
+    def callback():
+        wl_min,wl_max = db.get_range(id)
+        n1 = db.fitted_opticalindex(id,wl_min,wl_max,10)
+        r,t,_,_ = op.calc_spectra(1,n1,1,0,[],[],[],[],1,np.arange(wl_min,wl_max,10))
+        return {'r':r}
+
+    callback()
+    record = metrics.snapshot()['callbacks'][-1]
+    assert record['name'] == 'callback.test'
+    assert {'db.get_range','db.fitted_opticalindex','calc_spectra','callback.serialize'} <= set(record['stages'])
+    assert record['counters']['db.round_trips'] == 2       #get_range と n/k の読み込み
+    # db.load_opticalindex runs inside db.fitted_opticalindex, only the outer stages add up
+    assert record['seconds'] >= record['stages']['db.get_range']+record['stages']['db.fitted_opticalindex']
+
+def test_callback_record_in_worker_thread(enabled):
+    from opticalsimulation.service import ComputeService
+    service = ComputeService(workers=1)
+
+    @metrics.traced('callback.service')
+    def callback():
+        return service.get('s','key',lambda:metrics.count('computed') or 1)
+
+    callback()
+    assert metrics.snapshot()['callbacks'][-1]['counters'] == {'computed':1}
@@ -3,6 +3,10 @@ import numpy as np
 
 
 from opticalsimulation.opticalsimulation import snell,admittance,phasedifference,characteristic_matrix,reflectance,calc_matrix,transmittance,Y0
+from opticalsimulation.opticalsimulation import absorb
+from opticalsimulation.opticalsimulation import calc_spectra,calc_matrix_batch,calc_spectra_batch,calc_gradient_batch
+from opticalsimulation.opticalsimulation import calc_stack,calc_stack_batch,calc_spectra_chunked,precision_error
+from opticalsimulation.opticalsimulation import calc_spectra_jacobian
 
 @pytest.mark.parametrize(('n1','n0','angle','theta'),[
     (1.0,1.0,5*np.pi/180,5*np.pi/180),          #媒質の屈折率が同じなら出射角は入射角に等しい
@@ -75,4 +79,167 @@ def test_transmittance(ns,ds,n0,n1,theta,lam,trans):
     eta0 = admittance(n0,n0,theta)
     eta1 = admittance(n1,n0,theta)
     param = calc_matrix(ns,ds,n0,n1,theta,lam)
-    assert np.all(np.isclose(transmittance(param,eta0,eta1),trans))
\ No newline at end of file
+    assert np.all(np.isclose(transmittance(param,eta0,eta1),trans))
+
+LAM = np.arange(400.0,800.0,10.0)
+NS = [np.full(len(LAM),2.1-0.01j),np.full(len(LAM),1.46),np.full(len(LAM),2.1-0.01j)]
+N_SUB = np.full(len(LAM),1.52-1e-5j)
+
+def reference_param(ns,ds,n0,n1,theta,lam):
+    # 基準実装: 波長ごとに 2x2 の特性行列を順に掛ける (バッチ化前の calc_matrix)
+    eta = admittance(n1,n0,theta)
+    theta = np.broadcast_to(theta,lam.shape)
+    param = (np.empty((2,1,len(lam)),dtype=complex),np.empty((2,1,len(lam)),dtype=complex))
+    for i in range(len(lam)):
+        for pol in range(2):
+            mat = np.eye(2,dtype=complex)
+            for n,d in zip(ns,ds):
+                mat = mat@characteristic_matrix(n[i],d,n0[i],theta[i],lam[i])[pol]
+            param[pol][:,0,i] = mat@np.array([1,eta[pol][i]])
+    return param
+
+def reference_spectra(n0,n1,n2,theta,front_ns,front_ds,back_ns,back_ds,t_sub,lam):
+    phi1 = snell(n1,n0,theta)
+    eta0 = admittance(n0,n0,theta)
+    eta1 = admittance(n1,n0,theta)
+    eta2 = admittance(n2,n0,theta)
+    front_forward = reference_param(front_ns,front_ds,n0,n1,theta,lam)
+    front_backward = reference_param(front_ns[::-1],front_ds[::-1],n1,n0,phi1,lam)
+    back_backward = reference_param(back_ns[::-1],back_ds[::-1],n1,n2,phi1,lam)
+    r01 = reflectance(front_forward,eta0)
+    r10 = reflectance(front_backward,eta1)
+    t01 = transmittance(front_forward,eta0,eta1)
+    t10 = transmittance(front_backward,eta1,eta0)
+    r12 = reflectance(back_backward,eta1)
+    t12 = transmittance(back_backward,eta1,eta2)
+    beta = absorb(n1,t_sub,n0,theta,lam)
+    r = tuple(r01[i]+t01[i]*r12[i]*t10[i]*beta/(1-r10[i]*r12[i]*beta) for i in range(2))
+    t = tuple(t01[i]*t12[i]*np.sqrt(beta)/(1-r10[i]*r12[i]*beta) for i in range(2))
+    return r01,t01,r,t
+
+@pytest.mark.parametrize(('thetas','ds'),[
+    (np.array([0.0]),[100,80,60]),
+    (np.array([0.0,0.5,1.2]),[[100,80,60]]),
+    (np.array([0.1,0.7]),[[100,80,60],[90,85,55],[0,0,0]]),
+])
+def test_calc_spectra_batch(thetas,ds):
+    spectra = calc_spectra_batch(1,N_SUB,1,thetas,NS,ds,NS[:1],[50],[1000],LAM)
+    ds = np.reshape(ds,(-1,len(NS)))
+    for x in spectra:
+        assert x.shape == (len(ds),len(thetas),2,len(LAM))
+    for b,d in enumerate(ds):
+        for a,theta in enumerate(thetas):
+            expected = reference_spectra(np.ones(len(LAM)),N_SUB,np.ones(len(LAM)),theta,NS,list(d),NS[:1],[50],1000,LAM)
+            for x,y in zip(spectra,expected):
+                assert np.allclose(x[b,a],y)
+
+def test_calc_matrix_batch_empty_stack():
+    param = calc_matrix_batch([],[],1.0,N_SUB,np.array([0.0,0.3]),LAM)
+    assert param.shape == (2,1,2,2,len(LAM))
+    assert np.allclose(param[0],1)
+
+@pytest.mark.parametrize(('thetas','ds'),[
+    (np.array([0.0]),[100,80,60]),
+    (np.array([0.2,0.9]),[[100,80,60],[30,120,10]]),
+])
+def test_calc_gradient_batch(thetas,ds):
+    ds = np.reshape(np.asarray(ds,dtype=float),(-1,len(NS)))
+    r,t,dr,dt = calc_gradient_batch(NS,ds,1,N_SUB,thetas,LAM)
+    for i in range(len(NS)):
+        h = np.zeros(len(NS))
+        h[i] = 1e-4
+        rp,tp,_,_ = calc_gradient_batch(NS,ds+h,1,N_SUB,thetas,LAM)
+        rm,tm,_,_ = calc_gradient_batch(NS,ds-h,1,N_SUB,thetas,LAM)
+        assert np.allclose((rp-rm)/2e-4,dr[i],atol=1e-8)
+        assert np.allclose((tp-tm)/2e-4,dt[i],atol=1e-8)
+
+@pytest.mark.parametrize(('thetas','t_sub'),[(np.array([0.0]),1),(np.array([0.2,0.9]),[1000,200])])
+def test_calc_spectra_jacobian(thetas,t_sub):
+    # 吸収のある基板の裏面反射も含めた膜厚微分
+    n_sub = N_SUB-1e-5j
+    ds = np.array([[100,80,60],[30,120,10]],dtype=float)
+    spectra,jacobian = calc_spectra_jacobian(1,n_sub,1,thetas,NS,ds,t_sub,LAM)
+    for x,y in zip(spectra,calc_spectra_batch(1,n_sub,1,thetas,NS,ds,[],[],t_sub,LAM)):
+        assert np.allclose(x,y,rtol=0,atol=1e-14)
+    for i in range(len(NS)):
+        h = np.zeros(len(NS))
+        h[i] = 1e-4
+        plus = calc_spectra_batch(1,n_sub,1,thetas,NS,ds+h,[],[],t_sub,LAM)
+        minus = calc_spectra_batch(1,n_sub,1,thetas,NS,ds-h,[],[],t_sub,LAM)
+        for p,m,d in zip(plus,minus,jacobian):
+            assert np.allclose((p-m)/2e-4,d[i],atol=1e-8)
+
+@pytest.mark.parametrize(('theta','key','h'),[
+    (0.0,'n',1e-6),
+    (0.7,'n',1e-6),
+    (0.0,'k',-1e-6j),
+    (0.7,'k',-1e-6j),
+])
+def test_calc_matrix_jacobian_index(theta,key,h):
+    ds = [100,80,60]
+    param,jacobian = calc_matrix(NS,ds,1,N_SUB,theta,LAM,jacobian=True,index=True)
+    eta0 = admittance(1,1,theta)
+    eta1 = admittance(N_SUB,1,theta)
+    assert np.allclose(reflectance(param,eta0),reflectance(calc_matrix(NS,ds,1,N_SUB,theta,LAM),eta0))
+    for i in range(len(NS)):
+        plus = [n+h if j == i else n for j,n in enumerate(NS)]
+        minus = [n-h if j == i else n for j,n in enumerate(NS)]
+        p1 = calc_matrix(plus,ds,1,N_SUB,theta,LAM)
+        p2 = calc_matrix(minus,ds,1,N_SUB,theta,LAM)
+        dr = (np.array(reflectance(p1,eta0))-np.array(reflectance(p2,eta0)))/2e-6
+        dt = (np.array(transmittance(p1,eta0,eta1))-np.array(transmittance(p2,eta0,eta1)))/2e-6
+        assert np.allclose(jacobian[key][0][i],dr,atol=1e-7)
+        assert np.allclose(jacobian[key][1][i],dt,atol=1e-7)
+
+@pytest.mark.parametrize('theta',[0.0,0.5,np.array([0.0,0.3,1.2])])
+def test_calc_stack_matches_calc_spectra(theta):
+    front,back = NS[:2],NS[1:]
+    ref = calc_spectra_batch(1,N_SUB,1,theta,front,[60,90],back,[80,30],1000,LAM)
+    r,t = calc_stack_batch(1,1,theta,front+[N_SUB]+back[::-1],[60,90,1e6,30,80],
+                           [True,True,False,True,True],LAM)
+    assert np.allclose(r,ref[2],atol=1e-14)
+    assert np.allclose(t,ref[3],atol=1e-14)
+    r,t = calc_stack_batch(1,N_SUB,theta,front,[60,90],None,LAM)        #全層コヒーレント
+    assert np.allclose(r,ref[0]) and np.allclose(t,ref[1])
+
+def test_calc_stack_laminate():
+    glass = np.full(len(LAM),1.52+0j)
+    pvb = np.full(len(LAM),1.48+0j)
+    absorbing = np.full(len(LAM),1.5-0.5j)
+    r,t = calc_stack(1,1,0.4,[NS[1],glass,pvb,glass,NS[1]],[100,3e6,7.6e5,3e6,100],
+                     [True,False,False,False,True],LAM)
+    assert np.allclose(np.add(r,t),1)             #吸収なしならエネルギー保存
+    r,t = calc_stack(1,1,0.4,[glass,absorbing,glass],[1e6,1e6,1e6],[False,False,False],LAM)
+    assert np.allclose(t,0) and np.all(np.isfinite(r)) and np.all(np.array(r) > 0.04)
+
+@pytest.mark.parametrize('chunk',[1,7,len(LAM),1000])
+def test_calc_spectra_chunked(chunk):
+    from opticalsimulation.dispersion import Model
+    ns = [NS[0],Model('cauchy',A=1.46,B=0.004),NS[2]]
+    theta = np.array([0.0,0.6])
+    ref = calc_spectra_batch(1,N_SUB,1,theta,ns,[[60,90,40],[70,80,50]],NS[:1],[30],1000,LAM)
+    out = tuple(np.zeros_like(x) for x in ref)
+    spectra = calc_spectra_chunked(1,N_SUB,1,theta,ns,[[60,90,40],[70,80,50]],NS[:1],[30],1000,LAM,chunk,out=out)
+    assert spectra is out
+    assert all(np.array_equal(x,y) for x,y in zip(spectra,ref))
+
+def test_calc_spectra_complex64():
+    ref = calc_spectra(1,N_SUB,1,0.3,NS,[60,90,40],[],[],1000,LAM)
+    spectra = calc_spectra(1,N_SUB,1,0.3,NS,[60,90,40],[],[],1000,LAM,chunk=16,dtype=np.complex64)
+    assert spectra[0][0].dtype == np.float32
+    assert np.allclose(spectra,ref,rtol=0,atol=1e-5)
+    assert precision_error(1,N_SUB,1,0.3,NS,[60,90,40],[],[],1000,LAM) < 1e-5
+    # 許容誤差を超えると complex128 で計算し直す
+    spectra = calc_spectra_chunked(1,N_SUB,1,0.3,NS,[60,90,40],[],[],1000,LAM,dtype=np.complex64,tolerance=1e-12)
+    assert spectra[0].dtype == np.float64
+
+@pytest.mark.parametrize('module',['opticalsimulation.opticalsimulation','opticalsimulation.sweep',
+                                   'opticalsimulation.tolerance','opticalsimulation.fitting',
+                                   'opticalsimulation.design','opticalsimulation.angular'])
+def test_core_imports(module):
+    # ワーカーや CLI が読み込むモジュールは DB や scipy を読み込まない
+    import sys
+    import subprocess
+    script = 'import sys,{};print(*sorted(sys.modules))'.format(module)
+    loaded = subprocess.run([sys.executable,'-c',script],capture_output=True,text=True,check=True).stdout.split()
+    assert not {'sqlalchemy','requests','scipy','plotly'} & set(loaded)
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+
+from opticalsimulation.service import ComputeService,Superseded,angle_index
+
+@pytest.mark.parametrize(('angle','index'),[(0,0),(12.3,123),(89.9,899),(90,899)])
+def test_angle_index(angle,index):
+    assert angle_index(angle) == index
+
+def test_memoized():
+    service = ComputeService(workers=1)
+    calls = []
+    compute = lambda:calls.append(1) or len(calls)
+    assert service.get('a','key',compute) == 1
+    assert service.get('b','key',compute) == 1
+    assert len(calls) == 1
+
+def test_superseded_request():
+    service = ComputeService(workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+    results = {}
+    def first():
+        try:
+            results['first'] = service.get('session','old',slow)
+        except Superseded:
+            results['first'] = Superseded
+    thread = threading.Thread(target=first)
+    thread.start()
+    started.wait(5)
+    waiting = threading.Thread(target=lambda:results.setdefault('second',service.get('session','new',lambda:'new')))
+    waiting.start()
+    for _ in range(100):
+        if service._latest.get('session') == 'new':
+            break
+        time.sleep(0.05)
+    assert service._latest.get('session') == 'new'
+    release.set()
+    thread.join(5)
+    waiting.join(5)
+    assert results['first'] is Superseded       #古いリクエストは破棄される
+    assert results['second'] == 'new'
+    assert service.cache.get('old') == 'slow'
+
+def test_cancel_pending_request():
+    service = ComputeService(workers=1)
+    release = threading.Event()
+    blocker = threading.Thread(target=lambda:service.get('other','busy',lambda:release.wait(5)))
+    blocker.start()
+    calls = []
+    results = {}
+    def pending():
+        try:
+            results['pending'] = service.get('session','old',lambda:calls.append('old'))
+        except Superseded:
+            results['pending'] = Superseded
+    thread = threading.Thread(target=pending)
+    thread.start()
+    for _ in range(100):
+        if 'old' in service._running:
+            break
+        time.sleep(0.05)
+    assert 'old' in service._running
+    newer = threading.Thread(target=lambda:results.setdefault('new',service.get('session','new',lambda:'new')))
+    newer.start()
+    thread.join(5)
+    assert results['pending'] is Superseded
+    release.set()
+    newer.join(5)
+    blocker.join(5)
+    assert results['new'] == 'new'
+    assert calls == []                          #開始前のリクエストはキャンセルされる
+
+def test_session_history():
+    service = ComputeService(workers=1,sessions=2)
+    for session in ('a','b','c'):
+        assert service.get(session,'key',lambda:'value') == 'value'
+    assert len(service._latest) == 2
+    assert 'a' not in service._latest
+    service.forget('c')
+    assert 'c' not in service._latest
@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+
+from opticalsimulation.opticalsimulation import calc_spectra
+from opticalsimulation.sweep import SweepStore,iter_sweep,sweep
+
+LAM = np.arange(400.0,800.0,20.0)
+NS = [np.full(len(LAM),2.35-0.001j),np.full(len(LAM),1.46)]
+N_SUB = np.full(len(LAM),1.52)
+AXES = [('d0',np.linspace(40,60,5)),('angle',[0,20,40]),('d1',[80,90])]
+
+def expected(d0,angle,d1,t_sub=None):
+    r01,t01,r,t = calc_spectra(1,N_SUB,1,np.radians(angle),NS,[d0,d1],[],[],1 if t_sub is None else t_sub,LAM)
+    return np.array((r01,t01) if t_sub is None else (r,t))
+
+@pytest.mark.parametrize('workers',[1,2])
+def test_sweep(tmp_path,workers):
+    store = sweep(tmp_path/'s',NS,[50,90],N_SUB,LAM,AXES,chunk=7,workers=workers)
+    assert store.shape == (5,3,2) and store.progress() == 1
+    r = store.select('R','s')
+    assert r.shape == (5,3,2,len(LAM))
+    for i,j,k in [(0,0,0),(4,2,1),(2,1,0)]:
+        rs,ts = expected(AXES[0][1][i],AXES[1][1][j],AXES[2][1][k])
+        assert np.allclose(r[i,j,k],rs[0],atol=1e-6)
+        assert np.allclose(store.select('T','p',d0=i,angle=j,d1=k),ts[1],atol=1e-6)
+
+def test_substrate_axis(tmp_path):
+    store = sweep(tmp_path,NS,[50,90],N_SUB,LAM,[('t_sub',[500,1000])],theta=20,t_sub=1000,workers=1)
+    r = store.select('R')
+    rs,_ = expected(50,20,90,t_sub=500)
+    assert np.allclose(r[0],rs.mean(axis=0),atol=1e-6)
+
+def test_resume(tmp_path):
+    # 途中で止めた掃引は残りのチャンクだけ計算する
+    runs = iter_sweep(tmp_path,NS,[50,90],N_SUB,LAM,AXES,chunk=4,workers=1)
+    for done,total in runs:
+        if done == 3:
+            break
+    runs.close()
+    store = SweepStore(tmp_path)
+    assert len(store.done()) == 3
+    partial = store.select('R',wavelength=5)
+    assert partial.shape == (5,3,2)
+    assert np.isnan(partial).sum() == 30-12
+    (tmp_path/'R-000001.npy').unlink()
+    progress = list(iter_sweep(tmp_path,NS,[50,90],N_SUB,LAM,AXES,chunk=4,workers=1))
+    assert progress[0] == (2,8) and progress[-1] == (8,8)
+    full = SweepStore(tmp_path).select('R',wavelength=5)
+    assert not np.isnan(full).any()
+    assert np.allclose(full[:1],partial[:1])
+
+def test_select(tmp_path):
+    store = sweep(tmp_path,NS,[50,90],N_SUB,LAM,AXES,chunk=5,workers=1)
+    full = store.select('T','average')
+    assert store.select('T',d0=[1,3],angle=slice(1,None),wavelength=[2,4]).shape == (2,2,2,2)
+    assert np.array_equal(store.select('T',d0=[1,3],angle=slice(1,None),wavelength=[2,4]),full[[1,3]][:,1:][...,[2,4]])
+    assert store.select('T',angle=2,wavelength=0).shape == (5,2)
+    with pytest.raises(KeyError):
+        store.select('T',d2=0)
+
+def test_mismatch(tmp_path):
+    sweep(tmp_path,NS,[50,90],N_SUB,LAM,AXES[:1],workers=1)
+    with pytest.raises(ValueError):
+        sweep(tmp_path,NS,[50,95],N_SUB,LAM,AXES[:1],workers=1)
+    with pytest.raises(ValueError):
+        sweep(tmp_path/'x',NS,[50,90],N_SUB,LAM,[('t_sub',[1,2])],workers=1)
@@ -0,0 +1,35 @@
+import pytest
+import numpy as np
+
+from opticalsimulation.opticalsimulation import calc_spectra
+from opticalsimulation.tolerance import percentiles,tolerance_analysis,iter_tolerance
+
+LAM = np.arange(400.0,800.0,20.0)
+NS = [np.full(len(LAM),2.35-0.001j),np.full(len(LAM),1.46)]
+N_SUB = np.full(len(LAM),1.52)
+
+@pytest.mark.parametrize('ps',[(5,50,95),(25,75)])
+def test_percentiles(ps):
+    x = np.random.default_rng(0).random((20000,3))
+    counts = np.stack([np.histogram(x[:,i],bins=1000,range=(0,1))[0] for i in range(3)])
+    assert np.allclose(percentiles(counts,ps),np.percentile(x,ps,axis=0),atol=2e-3)
+
+def test_without_perturbation():
+    #誤差が0なら全サンプルが設計値と一致する
+    stats = tolerance_analysis(NS,[50,90],N_SUB,LAM,sigma_d=0,samples=300,chunk=100,workers=1,seed=0)
+    r,t,_,_ = calc_spectra(1,N_SUB,1,0.0,NS,[50,90],[],[],1,LAM)
+    assert stats['samples'] == 300
+    assert np.allclose(stats['mean'][0],(r[0]+r[1])/2)
+    assert np.allclose(stats['mean'][1],(t[0]+t[1])/2)
+    assert np.allclose(stats['std'],0,atol=1e-6)
+
+def test_bands_and_early_stop():
+    stats = None
+    for stats in iter_tolerance(NS,[50,90],N_SUB,LAM,sigma_d=3,sigma_n=0.01,samples=10000,chunk=200,
+                                workers=1,seed=1):
+        if stats['samples'] >= 1000:
+            break
+    assert stats['samples'] == 1000
+    bands = stats['percentiles']
+    assert np.all(bands[5] <= bands[50]+1e-3)
+    assert np.all(bands[50] <= bands[95]+1e-3)